@@ -61,12 +61,15 @@ class ClusterConfig extends Logging {
     var cpus: Double = 1
     var mem: Long = 512
     var repoSize: Long = 1024
+    // when resuming a job, skip the actions that did not change since they completed
+    var memoize: Boolean = false
 
     def load(props: Properties): Unit = {
 
       if (props.containsKey("jobs.cpu")) cpus = props.getProperty("jobs.cpu").asInstanceOf[Double]
       if (props.containsKey("jobs.mem")) mem = props.getProperty("jobs.mem").asInstanceOf[Long]
       if (props.containsKey("jobs.repoSize")) repoSize = props.getProperty("jobs.repoSize").asInstanceOf[Long]
+      if (props.containsKey("jobs.memoize")) memoize = props.getProperty("jobs.memoize").toBoolean
 
       Tasks.load(props)
     }
@@ -0,0 +1,73 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.common.dataobjects
+
+/**
+  * How an export is written, as given by its entry in the exports map of an action. An entry
+  * is either a format or a format followed by options, e.g. "parquet; mode=append; partitionBy=day".
+  * Exports in append mode add partitions to the export of the previous runs instead of
+  * overwriting it. With sample=<rows> a sample of about that many rows is written next to the
+  * export, stratified by the sampleBy column when one is given
+  */
+case class ExportSpec(format: String,
+                      mode: String = ExportSpec.OverwriteMode,
+                      partitionBy: Seq[String] = Seq.empty,
+                      sample: Long = 0,
+                      sampleBy: Option[String] = None) {
+
+  def append: Boolean = mode == ExportSpec.AppendMode
+
+  override def toString: String = {
+    val options = Seq(
+      if (mode != ExportSpec.OverwriteMode) Some(s"mode=$mode") else None,
+      if (partitionBy.nonEmpty) Some(s"partitionBy=${partitionBy.mkString(",")}") else None,
+      if (sample > 0) Some(s"sample=$sample") else None,
+      sampleBy.map(column => s"sampleBy=$column")
+    ).flatten
+    (format +: options).mkString("; ")
+  }
+
+}
+
+object ExportSpec {
+
+  val OverwriteMode = "overwrite"
+  val AppendMode = "append"
+
+  /**
+    * Parses an entry of an action's exports map. Partitioned exports are only supported in
+    * append mode, exports written over are read as a whole
+    */
+  def parse(value: String): ExportSpec = {
+
+    val parts = Option(value).getOrElse("").split(";").map(_.trim)
+    val spec = parts.tail.filter(_.nonEmpty).foldLeft(ExportSpec(parts.head)) { (spec, option) =>
+      option.split("=", 2).map(_.trim) match {
+        case Array("mode", mode) if mode == OverwriteMode || mode == AppendMode => spec.copy(mode = mode)
+        case Array("partitionBy", columns) => spec.copy(partitionBy = columns.split(",").map(_.trim).filter(_.nonEmpty))
+        case Array("sample", rows) if rows.nonEmpty && rows.forall(_.isDigit) => spec.copy(sample = rows.toLong)
+        case Array("sampleBy", column) if column.nonEmpty => spec.copy(sampleBy = Some(column))
+        case _ => throw new IllegalArgumentException(s"invalid export option $option in $value")
+      }
+    }
+
+    if (spec.partitionBy.nonEmpty && !spec.append)
+      throw new IllegalArgumentException(s"partitionBy is only supported for exports in append mode, $value")
+    spec
+  }
+
+}
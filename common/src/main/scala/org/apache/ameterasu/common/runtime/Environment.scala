@@ -28,6 +28,9 @@ case class Environment() {
   var outputRootPath: String = ""
   var workingDir: String = ""
 
+  // the job-name of the job's maki, set by the leader rather than read from the environment
+  var jobName: String = ""
+
   var configuration: Map[String, String] = null
 
 }
\ No newline at end of file
@@ -17,6 +17,11 @@
 package org.apache.amaterasu.executor.execution.actions.runners.spark.PySpark;
 
 import org.apache.amaterasu.executor.runtime.AmaContext;
+import org.apache.amaterasu.executor.runtime.ExportManifest;
+import org.apache.amaterasu.executor.runtime.ExportSamples;
+import org.apache.amaterasu.executor.runtime.ExportViews;
+import org.apache.amaterasu.executor.runtime.IncrementalExports;
+import org.apache.amaterasu.common.dataobjects.ExportSpec;
 import org.apache.amaterasu.common.runtime.Environment;
 
 import org.apache.spark.SparkEnv;
@@ -25,12 +30,21 @@ import org.apache.spark.sql.SQLContext;
 import org.apache.spark.SparkConf;
 import org.apache.spark.SparkContext;
 
+import org.apache.spark.sql.Dataset;
+import org.apache.spark.sql.Row;
+import org.apache.spark.sql.SaveMode;
 import org.apache.spark.sql.SparkSession;
 import py4j.GatewayServer;
 
+import scala.collection.JavaConverters;
+
 import java.io.IOException;
 import java.net.ServerSocket;
+import java.util.HashMap;
+import java.util.Map;
 import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.CountDownLatch;
+import java.util.concurrent.TimeUnit;
 
 public class PySparkEntryPoint {
 
@@ -43,6 +57,10 @@ public class PySparkEntryPoint {
     private static JavaSparkContext jsc = null;
     private static SQLContext sqlContext = null;
     private static SparkEnv sparkEnv = null;
+    private static String reportLevel = null;
+    private static CountDownLatch readiness = new CountDownLatch(1);
+    private static String startupReport = null;
+    private static String importReport = null;
 
     public static PySparkExecutionQueue getExecutionQueue() {
         return queue;
@@ -66,6 +84,18 @@ public class PySparkEntryPoint {
         return AmaContext.env();
     }
 
+    public static Map<String, String> getConfiguration() {
+        Environment env = AmaContext.env();
+        if (env == null || env.configuration() == null) {
+            return new HashMap<>();
+        }
+        return new HashMap<>(JavaConverters.mapAsJavaMapConverter(env.configuration()).asJava());
+    }
+
+    public static String getReportLevel() {
+        return reportLevel;
+    }
+
     public static SQLContext getSqlContext() {
         SparkEnv.set(sparkEnv);
         return sqlContext;
@@ -80,6 +110,62 @@ public class PySparkEntryPoint {
         return jsc.getConf();
     }
 
+    /**
+     * Writes an export of a python action, its manifest and, when enabled, its in memory
+     * view. This is done in a single call so that the scheduler pool, which is a thread
+     * local property, applies to the py4j thread running the write, even when exports are
+     * written concurrently. Exports in append mode are committed to their partition manifest
+     * instead.
+     * @param export the export's entry in the action's exports map, e.g. "parquet; mode=append; partitionBy=day"
+     */
+    public static void saveExport(Dataset<Row> df, String actionName, String name, String path, String export, String pool) {
+        SparkContext sc = sparkSession.sparkContext();
+        if (pool != null && !pool.isEmpty()) {
+            sc.setLocalProperty("spark.scheduler.pool", pool);
+        }
+        try {
+            ExportSpec spec = ExportSpec.parse(export);
+            if (spec.append()) {
+                IncrementalExports.append(sparkSession, df, path, spec, AmaContext.jobId());
+            } else {
+                df.write().mode(SaveMode.Overwrite).format(spec.format()).save(path);
+                ExportManifest.write(sparkSession, df, path, spec.format(), AmaContext.env());
+                ExportSamples.write(sparkSession, path, df.schema(), spec);
+                ExportViews.register(sparkSession, path, spec.format(), df.schema(), AmaContext.jobId(), actionName, name, AmaContext.env());
+            }
+            AmaContext.dataFrames().invalidate(actionName, name);
+        } finally {
+            sc.setLocalProperty("spark.scheduler.pool", null);
+        }
+    }
+
+    /**
+     * Called by the python interpreter once it is ready to execute actions.
+     * @param report the timings of the interpreter's startup phases
+     * @param imports the time every module took to import, one line per module
+     */
+    public static void ready(String report, String imports) {
+        startupReport = report;
+        importReport = imports;
+        readiness.countDown();
+    }
+
+    /**
+     * Waits for the python interpreter to signal it is ready.
+     * @return true if the interpreter is ready, false if the timeout elapsed first
+     */
+    public static boolean awaitReady(long timeout, TimeUnit unit) throws InterruptedException {
+        return readiness.await(timeout, unit);
+    }
+
+    public static String getStartupReport() {
+        return startupReport;
+    }
+
+    public static String getImportReport() {
+        return importReport;
+    }
+
     private static void generatePort() {
 
         try {
@@ -101,7 +187,8 @@ public class PySparkEntryPoint {
     public static void start(SparkSession spark,
                              String jobName,
                              Environment env,
-                             SparkEnv sparkEnv) {
+                             SparkEnv sparkEnv,
+                             String reportLevel) {
 
         AmaContext.init(spark, jobName, env);
 
@@ -109,6 +196,10 @@ public class PySparkEntryPoint {
         jsc = new JavaSparkContext(spark.sparkContext());
         sqlContext = spark.sqlContext();
         PySparkEntryPoint.sparkEnv = sparkEnv;
+        PySparkEntryPoint.reportLevel = reportLevel;
+        readiness = new CountDownLatch(1);
+        startupReport = null;
+        importReport = null;
         generatePort();
         GatewayServer gatewayServer = new GatewayServer(new PySparkEntryPoint(), port);
 
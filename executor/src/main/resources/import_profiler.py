@@ -0,0 +1,55 @@
+import sys
+import time
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+
+class ImportProfiler(object):
+    """
+    Records how long modules take to import while installed, in the spirit of python's
+    -X importtime: every import that loaded new modules is recorded with the time spent
+    in it on its own and cumulatively with the imports nested in it.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.nested = []
+        self.original = None
+
+    def install(self):
+        self.original = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        builtins.__import__ = self.original
+
+    def report(self, threshold=0.001):
+        lines = ['import time: self [us] | cumulative | imported package']
+        for depth, name, own, cumulative in self.entries:
+            if cumulative >= threshold:
+                lines.append('import time: %9d | %10d | %s%s' % (own * 1e6, cumulative * 1e6, '  ' * depth, name))
+        return '\n'.join(lines)
+
+    def slowest(self, count=3):
+        top = sorted([e for e in self.entries if e[0] == 0], key=lambda e: e[3], reverse=True)[:count]
+        return ', '.join('%s %.3fs' % (name, cumulative) for depth, name, own, cumulative in top)
+
+    def _import(self, name, *args, **kwargs):
+        loaded = len(sys.modules)
+        self.nested.append(0.0)
+        started = time.time()
+        try:
+            return self.original(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            nested = self.nested.pop()
+            if self.nested:
+                self.nested[-1] += elapsed
+            if len(sys.modules) > loaded:
+                fromlist = args[2] if len(args) > 2 else kwargs.get('fromlist')
+                if fromlist:
+                    name = '%s (%s)' % (name, ', '.join(fromlist))
+                self.entries.append((len(self.nested), name, elapsed - nested, elapsed))
@@ -1,3 +1,395 @@
+import datetime
+import json
+import os
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+class LruCache(object):
+    """
+    The executor local LRU caches of AmaContext, keyed by action, dataset and further parts.
+    The least recently used entries are evicted and released once there are more than
+    max_entries of them or they take more than max_bytes. Values are created outside the
+    lock, so creating one, e.g. collecting an export, does not hold up the other actions,
+    and threads asking for a value that is being created wait for it instead of creating
+    it again. Every entry is a list of the value, whether the cache owns the value's
+    resources and releases them, and its size in bytes.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        # the keys whose values are being created, with an event set once they are
+        self.creating = {}
+        # the keys invalidated while their values were being created, these are not cached
+        self.invalidated = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_or_create(self, key, create):
+        while True:
+            with self.lock:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.hits += 1
+                    # re-inserted as the most recently used entry
+                    self.entries[key] = entry
+                    return entry
+                created = self.creating.get(key)
+                if created is None:
+                    self.misses += 1
+                    created = self.creating[key] = threading.Event()
+                    break
+            # created by another thread, or created again if that failed
+            created.wait()
+
+        try:
+            entry = create()
+        except BaseException:
+            with self.lock:
+                del self.creating[key]
+                self.invalidated.discard(key)
+            created.set()
+            raise
+
+        with self.lock:
+            del self.creating[key]
+            if key in self.invalidated:
+                self.invalidated.discard(key)
+            else:
+                self.entries[key] = entry
+                self._evict(key)
+        created.set()
+        return entry
+
+    def invalidate(self, action_name, dataset_name):
+        # drops the entries of an export, used when the export is written again
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == action_name and k[1] == dataset_name]:
+                self._release(self.entries.pop(key))
+            self.invalidated.update(k for k in self.creating if k[0] == action_name and k[1] == dataset_name)
+
+    def release(self):
+        with self.lock:
+            while self.entries:
+                self._release(self.entries.popitem()[1])
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(entry[2] for entry in self.entries.values())
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'bytes': self.total_bytes()}
+
+    def _evict(self, keep):
+        size = self.total_bytes()
+        for key in list(self.entries):
+            if len(self.entries) <= self.max_entries and size <= self.max_bytes:
+                break
+            if key != keep:
+                entry = self.entries.pop(key)
+                size -= entry[2]
+                self._release(entry)
+                self.evictions += 1
+
+    def _release(self, entry):
+        if entry[1]:
+            try:
+                entry[0].unpersist()
+            except Exception:
+                pass
+
+
+class DataFrameCache(LruCache):
+    """
+    An executor local LRU cache of the DataFrames read through AmaContext, keyed by action,
+    dataset and format. A cached DataFrame keeps its resolved relation, so reading the same
+    export again skips listing its files and reading their footers.
+    DataFrames can be persisted on the way, the least recently used entries are evicted (and
+    unpersisted) once there are more than max_entries of them or the persisted ones take
+    more than max_bytes. Persisted DataFrames take no space until an action fills their
+    cache, so their sizes are measured again on every access to the cache.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=1 << 30):
+        super(DataFrameCache, self).__init__(max_entries, max_bytes)
+
+    def get_or_load(self, key, load, persist=None):
+        entry = self._get_or_create(key, lambda: [load(), False, 0])
+        with self.lock:
+            df = entry[0]
+            if persist is not None and not df.is_cached:
+                df.persist(persist)
+                entry[1] = True
+
+            self._measure()
+            self._evict(key)
+            return df
+
+    def dataframes(self):
+        with self.lock:
+            return [entry[0] for entry in self.entries.values()]
+
+    def key_of(self, df):
+        # the key df is cached at, None if it is not cached
+        with self.lock:
+            for key, entry in self.entries.items():
+                if entry[0] is df:
+                    return key
+        return None
+
+    def persisted_bytes(self):
+        return self.total_bytes()
+
+    def report(self):
+        return 'dataframe cache hits: %(hits)d, misses: %(misses)d, evictions: %(evictions)d, ' \
+               '%(entries)d entries, %(bytes)d bytes persisted' % self.stats()
+
+    def _measure(self):
+        for entry in self.entries.values():
+            if entry[1]:
+                entry[2] = cached_size(entry[0])
+
+
+class BroadcastRegistry(LruCache):
+    """
+    The broadcast variables created through AmaContext, shared by the actions of an executor
+    and keyed by action, dataset and columns, so that a lookup table many actions broadcast
+    is collected and broadcast once. The least recently used broadcasts are unpersisted
+    from the executors once there are more than max_entries of them or their pickled values
+    take more than max_bytes, and the broadcasts of an export once it is written again. The
+    rest are kept until the interpreter runs out of actions, or are dropped with the spark
+    context when the executor shuts down. An action still holding an unpersisted broadcast
+    can keep using it, the executors fetch it again.
+    """
+
+    def __init__(self, max_entries=16, max_bytes=256 << 20):
+        super(BroadcastRegistry, self).__init__(max_entries, max_bytes)
+
+    def get_or_create(self, key, create):
+        def entry():
+            broadcast = create()
+            return [broadcast, True, _broadcast_size(broadcast)]
+        return self._get_or_create(key, entry)[0]
+
+    def report(self):
+        return 'broadcast registry hits: %(hits)d, misses: %(misses)d, evictions: %(evictions)d, ' \
+               '%(entries)d entries, %(bytes)d bytes broadcast' % self.stats()
+
+
+def _broadcast_size(broadcast):
+    # the driver keeps the pickled value of a broadcast in a file, which is what executors fetch
+    try:
+        return os.path.getsize(broadcast._path)
+    except Exception:
+        return 0
+
+
+def cached_size(df):
+    # the size of a persisted DataFrame's cached data, 0 until an action filled the cache
+    try:
+        return int(df._sc._jvm.org.apache.amaterasu.executor.runtime.DataFrameCache.cachedSize(df._jdf))
+    except Exception:
+        return 0
+
+
+def _arrow_filesystem(path):
+    """
+    The pyarrow.fs file system of a path and the path within it. Without pyarrow.fs, which
+    older pyarrow versions lack, only local paths are supported and the file system is None.
+    """
+    if path.startswith('file:') and not path.startswith('file://'):
+        path = 'file://' + path[len('file:'):]
+    try:
+        from pyarrow import fs
+    except ImportError:
+        if '://' in path and not path.startswith('file://'):
+            raise ValueError('accessing %s with pyarrow requires pyarrow.fs' % path)
+        return None, path[len('file://'):] if path.startswith('file://') else path
+    return fs.FileSystem.from_uri(path if '://' in path else os.path.abspath(path))
+
+
+def _list_data_files(filesystem, path):
+    # spark's data sources skip files starting with an underscore or a dot, so do we
+    if filesystem is None:
+        names = os.listdir(path)
+    else:
+        from pyarrow import fs
+        names = [info.base_name for info in filesystem.get_file_info(fs.FileSelector(path)) if info.type == fs.FileType.File]
+    return [path + '/' + name for name in sorted(names) if not name.startswith('_') and not name.startswith('.')]
+
+
+# the arrow types of the spark types of partition columns and how their values are parsed from
+# a partition's directory, columns of other types are read as strings
+_PARTITION_TYPES = {
+    'byte': ('int8', int), 'short': ('int16', int), 'integer': ('int32', int), 'long': ('int64', int),
+    'float': ('float32', float), 'double': ('float64', float), 'boolean': ('bool_', lambda v: v == 'true'),
+    'date': ('date32', lambda v: datetime.datetime.strptime(v, '%Y-%m-%d').date()), 'string': ('string', lambda v: v)}
+
+
+def _partition_values(relative_dir):
+    # the values of the partition columns of a data file from its directory, e.g. day=1/hour=2
+    try:
+        from urllib.parse import unquote
+    except ImportError:
+        from urllib import unquote
+    values = {}
+    for segment in [segment for segment in relative_dir.split('/') if segment]:
+        key, _, value = segment.partition('=')
+        values[unquote(key)] = None if value == '__HIVE_DEFAULT_PARTITION__' else unquote(value)
+    return values
+
+
+def _partition_column(value, spark_type, rows):
+    import pyarrow as pa
+    arrow_type, parse = _PARTITION_TYPES.get(spark_type if isinstance(spark_type, basestring) else None, ('string', lambda v: v))
+    return pa.array([None if value is None else parse(value)] * rows, type=getattr(pa, arrow_type)())
+
+
+def _open_input(filesystem, path, memory_map):
+    import pyarrow as pa
+    if _is_local(filesystem):
+        return pa.memory_map(path) if memory_map else pa.OSFile(path)
+    return filesystem.open_input_file(path)
+
+
+def _pyarrow_installed():
+    try:
+        import pyarrow.parquet
+        return True
+    except ImportError:
+        return False
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _prefetch(batches, depth):
+    """
+    Yields the batches while a background thread fetches up to depth of the following ones.
+    Failures of the fetching thread are raised to the reader, and the thread stops once the
+    reader stops iterating.
+    """
+    if depth <= 0:
+        for batch in batches:
+            yield batch
+        return
+
+    try:
+        import queue as queues
+    except ImportError:
+        import Queue as queues
+
+    buffer = queues.Queue(depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queues.Full:
+                pass
+        return False
+
+    def fetch():
+        try:
+            for batch in batches:
+                if not put((batch, None)):
+                    return
+            put((done, None))
+        except Exception:
+            put((done, sys.exc_info()[1]))
+
+    fetcher = threading.Thread(target=fetch, name='amaterasu-prefetch')
+    fetcher.daemon = True
+    fetcher.start()
+    try:
+        while True:
+            batch, failure = buffer.get()
+            if batch is done:
+                if failure is not None:
+                    raise failure
+                return
+            yield batch
+    finally:
+        stopped.set()
+
+
+def _is_local(filesystem):
+    return filesystem is None or type(filesystem).__name__ == 'LocalFileSystem'
+
+
+def _local_copy(filesystem, path, cache_dir):
+    """
+    A local copy of a file of a remote file system, kept in cache_dir for the following
+    reads as long as the file keeps its size and modification time. The copy is written
+    under a temporary name and renamed, so concurrent readers never see a partial copy.
+    """
+    info = filesystem.get_file_info(path)
+    modified = info.mtime_ns / 1e9 if info.mtime_ns is not None else None
+    local = os.path.join(cache_dir, path.lstrip('/'))
+    if os.path.isfile(local) and os.path.getsize(local) == info.size \
+            and (modified is None or int(os.path.getmtime(local)) == int(modified)):
+        return local
+
+    if not os.path.isdir(os.path.dirname(local)):
+        try:
+            os.makedirs(os.path.dirname(local))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(local)):
+                raise
+    partial = '%s.%d.%d' % (local, os.getpid(), threading.current_thread().ident)
+    source = filesystem.open_input_stream(path)
+    try:
+        with open(partial, 'wb') as target:
+            shutil.copyfileobj(source, target, 1 << 20)
+    finally:
+        source.close()
+    if modified is not None:
+        os.utime(partial, (modified, modified))
+    os.rename(partial, local)
+    return local
+
+
+def _recreate_dir(filesystem, path):
+    if filesystem is None:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+    else:
+        from pyarrow import fs
+        if filesystem.get_file_info(path).type != fs.FileType.NotFound:
+            filesystem.delete_dir(path)
+        filesystem.create_dir(path, recursive=True)
+
+
+def _open_output(filesystem, path):
+    import pyarrow as pa
+    return pa.OSFile(path, 'wb') if filesystem is None else filesystem.open_output_stream(path)
+
+
 class AmaContext(object):
 
     def __init__(self, sc, spark, job_id, env):
@@ -5,16 +397,467 @@ class AmaContext(object):
         self.spark = spark
         self.job_id = job_id
         self.env = env
+        self.pinned = set()
+        self.local = threading.local()
+        self.dataframes = DataFrameCache(env.get_conf('dataframeCacheEntries', 32),
+                                         env.get_conf('dataframeCacheBytes', 1 << 30))
+        self.broadcasts = BroadcastRegistry(env.get_conf('pysparkBroadcastCacheEntries', 16),
+                                            env.get_conf('pysparkBroadcastCacheBytes', 256 << 20))
+        # the lineage checkpoints of every action, reported by the interpreter once it completes
+        self.checkpoints = {}
+        # the generation of every export, as the JVM's DataFrameCache counted it, when it was cached
+        self.generations = {}
+
+    @property
+    def action_name(self):
+        # the action running on the calling thread, set by the interpreter
+        return getattr(self.local, 'action_name', None)
+
+    @action_name.setter
+    def action_name(self, name):
+        self.local.action_name = name
+
+    def pin(self, *names):
+        # pinned variables survive the action defining them and are visible to later actions
+        self.pinned.update(names)
+
+    def get_dataframe(self, action_name, dataset_name, format = "parquet", persist=None, columns=None, where=None, since=None,
+                      sample=None):
+        """
+        Reads a DataFrame exported by a previous action, from memory when the export was handed
+        over in memory on this executor. Otherwise DataFrames are cached by the executor, so
+        reading the same export again reuses the resolved DataFrame. persist takes a
+        StorageLevel to keep the DataFrame at, e.g. for exports read by many actions.
+        The export's manifest, when it has one, provides its schema and files.
+        columns and where, a SQL expression or a Column, project and filter the export as it
+        is read, and files the manifest's statistics rule out for where are not read at all.
+        For exports written in append mode, since reads only the partitions committed after
+        the marker, e.g. the get_marker of the export at the reader's last run.
+        sample reads the sample written with the export instead, when it has one, by default
+        for every read when the job's environment sets exportSampleReads.
+        """
+        from pyspark.sql import DataFrame
+
+        sample_path = self._sample_path(action_name, dataset_name) if self._sampling(sample) else None
+        if sample_path is not None:
+            df = self.spark.read.parquet(sample_path)
+            if where is not None:
+                df = df.filter(where)
+            return df.select(*columns) if columns else df
+
+        def load():
+            incremental = self._incremental().load(self.spark._jsparkSession, self._incremental_path(action_name, dataset_name), 0)
+            if incremental.isDefined():
+                return DataFrame(incremental.get(), self.spark._wrapped)
+            jdf = self._manifests().load(self.spark._jsparkSession, self._export_path(action_name, dataset_name), format)
+            return DataFrame(jdf, self.spark._wrapped)
+
+        if since:
+            # only the newly committed partitions, these are not cached
+            jdf = self._incremental().load(self.spark._jsparkSession, self._incremental_path(action_name, dataset_name), since)
+            if not jdf.isDefined():
+                raise ValueError('%s of %s is not exported in append mode' % (dataset_name, action_name))
+            df = DataFrame(jdf.get(), self.spark._wrapped)
+            if where is not None:
+                df = df.filter(where)
+            return df.select(*columns) if columns else df
+
+        view = self._views().lookup(self.spark._jsparkSession, self.job_id, action_name, dataset_name)
+        if view.isDefined():
+            # handed over in memory by an action that ran on this executor
+            df = DataFrame(view.get(), self.spark._wrapped)
+            if where is not None:
+                df = df.filter(where)
+        elif where is None:
+            df = self._cached(action_name, dataset_name, format, load, persist)
+        else:
+            condition = self.sc._jvm.org.apache.spark.sql.functions.expr(where) if isinstance(where, basestring) else where._jc
+            matching = self._manifests().loadMatching(self.spark._jsparkSession, self._export_path(action_name, dataset_name), format, condition)
+            if matching.isDefined():
+                df = DataFrame(matching.get(), self.spark._wrapped)
+            else:
+                df = self._cached(action_name, dataset_name, format, load, persist)
+            df = df.filter(where)
+
+        return df.select(*columns) if columns else df
+
+    def _cached(self, action_name, dataset_name, format, load, persist):
+        self._refresh(action_name, dataset_name)
+        return self.dataframes.get_or_load((action_name, dataset_name, format), load, persist)
+
+    def _refresh(self, action_name, dataset_name):
+        # scala actions only invalidate the JVM's cache of the exports they write again, what
+        # is cached here of an export is dropped once the JVM counted another invalidation
+        key = (action_name, dataset_name)
+        generation = self._jvm_dataframes().generation(action_name, dataset_name)
+        if self.generations.setdefault(key, generation) != generation:
+            self.generations[key] = generation
+            self.dataframes.invalidate(action_name, dataset_name)
+            self.broadcasts.invalidate(action_name, dataset_name)
+
+    def estimate_bytes(self, df):
+        """
+        An estimate of the size of df: spark's statistics of its plan, or for an export read
+        as is, the row count of its manifest times spark's row width when that is larger, as
+        spark estimates files by their compressed size. None when there is no estimate, as
+        spark only guesses the size of joins and of DataFrames created from python data.
+        """
+        size = self.sc._jvm.org.apache.amaterasu.executor.runtime.DataFrameCache.estimatedSize(df._jdf)
+        estimate = size.get() if size.isDefined() else None
+        key = self.dataframes.key_of(df)
+        if key is not None:
+            manifest = self.get_manifest(key[0], key[1])
+            if manifest is not None and manifest['rowCount'] >= 0:
+                estimate = max(estimate or 0, manifest['rowCount'] * df._jdf.schema().defaultSize())
+        return estimate
+
+    def get_broadcast(self, action_name, dataset_name, key_col, value_col=None, format="parquet"):
+        """
+        Broadcasts an export as a dict from the values of key_col to the values of value_col,
+        or to whole Rows when value_col is None, e.g. a lookup table joined in python UDFs.
+        The broadcast is shared by all the actions of the executor asking for the same export
+        and columns, so the export is only collected and broadcast once.
+        """
+        def create():
+            df = self.get_dataframe(action_name, dataset_name, format)
+            if value_col is not None:
+                rows = df.select(key_col, value_col).collect()
+                return self.sc.broadcast(dict((row[0], row[1]) for row in rows))
+            return self.sc.broadcast(dict((row[key_col], row) for row in df.collect()))
+
+        self._refresh(action_name, dataset_name)
+        return self.broadcasts.get_or_create((action_name, dataset_name, key_col, value_col, format), create)
+
+    def invalidate(self, action_name, dataset_name):
+        # drops what is cached of an export that is written again, here and by the JVM
+        self._jvm_dataframes().invalidate(action_name, dataset_name)
+        self.generations[(action_name, dataset_name)] = self._jvm_dataframes().generation(action_name, dataset_name)
+        self.dataframes.invalidate(action_name, dataset_name)
+        self.broadcasts.invalidate(action_name, dataset_name)
+
+    def get_manifest(self, action_name, dataset_name):
+        """
+        The manifest written with an export as a dict holding its format, schema, rowCount,
+        files and per column statistics, None if the export has no manifest. Row counts are
+        -1 unless the export was written with statistics.
+        """
+        manifest = self._manifests().readJson(self.spark._jsparkSession, self._export_path(action_name, dataset_name))
+        return json.loads(manifest) if manifest else None
+
+    def get_marker(self, action_name, dataset_name):
+        """
+        The marker of the last commit to an export written in append mode, 0 if nothing was
+        committed to it yet. Passed as since to read only what was committed after it.
+        """
+        manifest = self._incremental().readJson(self.spark._jsparkSession, self._incremental_path(action_name, dataset_name))
+        if not manifest:
+            return 0
+        return max([commit['marker'] for commit in json.loads(manifest)['commits']] or [0])
+
+    def get_row_count(self, action_name, dataset_name, format = "parquet"):
+        # taken from the export's manifest without scanning the export, when the manifest was
+        # written with statistics
+        manifest = self.get_manifest(action_name, dataset_name)
+        if manifest is not None and manifest['rowCount'] >= 0:
+            return manifest['rowCount']
+        return self.get_dataframe(action_name, dataset_name, format).count()
+
+    def get_pandas(self, action_name, dataset_name, columns=None, memory_map=False, sample=None, since=None):
+        """
+        Reads a parquet export, or one put_pandas wrote as arrow, straight into a pandas
+        DataFrame with pyarrow, without going through the JVM. Row groups are read one at a
+        time and assembled without copying, memory_map maps local files instead of reading
+        them into memory. sample reads the export's sample as get_dataframe does. Exports
+        written in append mode are read from the files committed to them, with their
+        partition columns, and since reads only the partitions committed after the marker.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # the partition columns of exports written in append mode, with their spark types
+        partitions = []
+        sample_path = self._sample_path(action_name, dataset_name) if self._sampling(sample) else None
+        if sample_path is not None:
+            filesystem, path = _arrow_filesystem(sample_path)
+            files = _list_data_files(filesystem, path)
+        else:
+            committed = self._committed_files(action_name, dataset_name, since)
+            if committed is not None:
+                filesystem, path, files, partitions = committed
+            else:
+                manifest = self.get_manifest(action_name, dataset_name)
+                if manifest is not None and manifest['format'] != 'parquet':
+                    raise ValueError('%s of %s is a %s export, get_pandas reads parquet exports only' % (dataset_name, action_name, manifest['format']))
+
+                filesystem, path = _arrow_filesystem(self._export_path(action_name, dataset_name))
+                if manifest is not None:
+                    files = [path + '/' + f['path'] for f in manifest['files']]
+                else:
+                    files = _list_data_files(filesystem, path)
+
+        types = dict(partitions)
+        file_columns = [c for c in columns if c not in types] if columns else None
+
+        def with_partitions(table, values):
+            # partition columns are not stored in the files, their values come from the file's directory
+            for column, spark_type in partitions:
+                if not columns or column in columns:
+                    table = table.append_column(column, _partition_column(values.get(column), spark_type, table.num_rows))
+            return table.select(columns) if columns and partitions else table
+
+        row_groups = []
+        empty = None
+        for name in files:
+            if name.endswith('.arrow'):
+                # written by put_pandas as arrow, memory mapped files are read without copying
+                table = pa.ipc.open_file(_open_input(filesystem, name, memory_map)).read_all()
+                row_groups.append(table.select(columns) if columns else table)
+                continue
+            values = _partition_values(name[len(path) + 1:].rpartition('/')[0]) if partitions else {}
+            parquet_file = pq.ParquetFile(_open_input(filesystem, name, memory_map))
+            for index in range(parquet_file.num_row_groups):
+                row_groups.append(with_partitions(parquet_file.read_row_group(index, columns=file_columns), values))
+            if empty is None:
+                # keeps the columns of exports without rows
+                empty = with_partitions(parquet_file.read(columns=file_columns).slice(0, 0), values)
+
+        if not row_groups:
+            if empty is None:
+                import pandas
+                return pandas.DataFrame(columns=columns or [])
+            row_groups = [empty]
+
+        table = pa.concat_tables(row_groups)
+        try:
+            # releases the arrow buffers while converting, keeping peak memory down
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+        except TypeError:
+            return table.to_pandas()
+
+    def iter_batches(self, action_name, dataset_name, batch_size=10000, columns=None, where=None, prefetch=2,
+                     since=None):
+        """
+        Iterates over an export in lists of up to batch_size Rows, for post-processing exports
+        on the driver that are too large to collect. A background thread fetches up to
+        prefetch of the following batches while the current one is processed, so only a few
+        batches are held at a time. Parquet exports with a manifest are read a row group at a
+        time with pyarrow when it is installed, other exports, filtered reads and exports
+        written in append mode are fetched from Spark a partition at a time. since reads only
+        the partitions committed after the marker, as get_dataframe does.
+        """
+        return _prefetch(self._batches(action_name, dataset_name, batch_size, columns, where, since), prefetch)
 
-    def get_dataframe(self, action_name, dataset_name, format = "parquet"):
-        return self.spark.read.format(format).load(str(self.env.working_dir) + "/" + self.job_id + "/" + action_name + "/" + dataset_name)
+    def iter_rows(self, action_name, dataset_name, batch_size=10000, columns=None, where=None, prefetch=2, since=None):
+        # the rows of iter_batches, one at a time
+        for batch in self.iter_batches(action_name, dataset_name, batch_size, columns, where, prefetch, since):
+            for row in batch:
+                yield row
+
+    def _batches(self, action_name, dataset_name, batch_size, columns, where, since):
+        manifest = self.get_manifest(action_name, dataset_name) if not since else None
+        if manifest is not None and manifest['format'] == 'parquet' and where is None and _pyarrow_installed() \
+                and not self._sampling(None):
+            return self._row_group_batches(action_name, dataset_name, manifest, batch_size, columns)
+
+        format = manifest['format'] if manifest is not None else 'parquet'
+        df = self.get_dataframe(action_name, dataset_name, format, columns=columns, where=where, since=since)
+        return _chunks(df.toLocalIterator(), batch_size)
+
+    def _row_group_batches(self, action_name, dataset_name, manifest, batch_size, columns):
+        import pyarrow.parquet as pq
+        from pyspark.sql import Row
+
+        filesystem, path = _arrow_filesystem(self._export_path(action_name, dataset_name))
+        make_row = None
+        for f in manifest['files']:
+            parquet_file = pq.ParquetFile(_open_input(filesystem, path + '/' + f['path'], False))
+            for index in range(parquet_file.num_row_groups):
+                table = parquet_file.read_row_group(index, columns=columns)
+                if make_row is None:
+                    # keeps the export's column order, Row(**fields) would sort the fields
+                    make_row = Row(*table.schema.names)
+                # converted to python a batch at a time, row groups may be large
+                for start in range(0, table.num_rows, batch_size):
+                    chunk = table.slice(start, batch_size)
+                    values = [chunk.column(i).to_pylist() for i in range(chunk.num_columns)]
+                    yield [make_row(*row) for row in zip(*values)]
+
+    def put_pandas(self, name, df, action_name=None, batch_rows=100000, format='parquet'):
+        """
+        Writes a pandas DataFrame as a parquet export of the current action (or action_name)
+        with pyarrow, without going through the JVM. The DataFrame is converted and written
+        batch_rows rows at a time. With format='arrow' it is written as an arrow IPC file
+        instead, which get_pandas memory maps without decoding, but spark does not read.
+        Returns the path of the export.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if format not in ('parquet', 'arrow'):
+            raise ValueError('put_pandas writes parquet or arrow, not %s' % format)
+
+        action_name = action_name or self.action_name
+        filesystem, path = _arrow_filesystem(self._export_path(action_name, name))
+        _recreate_dir(filesystem, path)
+
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        out = _open_output(filesystem, path + '/part-00000.' + format)
+        try:
+            if format == 'arrow':
+                writer = pa.ipc.new_file(out, schema)
+            else:
+                # the spark flavor writes timestamps and field names the way spark reads them
+                writer = pq.ParquetWriter(out, schema, flavor='spark')
+            try:
+                for start in range(0, len(df), batch_rows):
+                    writer.write_table(pa.Table.from_pandas(df.iloc[start:start + batch_rows], schema=schema, preserve_index=False))
+            finally:
+                writer.close()
+        finally:
+            out.close()
+
+        self.invalidate(action_name, name)
+        return self._export_path(action_name, name)
+
+    def put_array(self, name, array, action_name=None):
+        """
+        Writes a numpy array as an .npy export of the current action (or action_name), e.g.
+        model weights or embeddings, for get_array to memory map. Arrays of python objects
+        cannot be memory mapped and are not exported. Returns the path of the export.
+        """
+        import numpy
+
+        array = numpy.asanyarray(array)
+        if array.dtype.hasobject:
+            raise ValueError('%s holds python objects, only arrays of numbers, strings and records are exported' % name)
+
+        action_name = action_name or self.action_name
+        filesystem, path = _arrow_filesystem(self._export_path(action_name, name))
+        _recreate_dir(filesystem, path)
+
+        out = open(path + '/array.npy', 'wb') if filesystem is None else filesystem.open_output_stream(path + '/array.npy')
+        try:
+            numpy.lib.format.write_array(out, array, allow_pickle=False)
+        finally:
+            out.close()
+
+        self.invalidate(action_name, name)
+        return self._export_path(action_name, name)
+
+    def get_array(self, action_name, dataset_name, mmap_mode='r'):
+        """
+        Reads an array put_array exported as a numpy memmap, so that pages are only read as
+        they are accessed and actions on the same node share them through the page cache.
+        Arrays in a remote working directory are copied to pysparkArrayCacheDir first, once
+        per node. mmap_mode takes the modes of numpy.load, None reads the array into memory.
+        """
+        import numpy
+
+        filesystem, path = _arrow_filesystem(self._export_path(action_name, dataset_name) + '/array.npy')
+        if not _is_local(filesystem):
+            if mmap_mode is None:
+                source = filesystem.open_input_file(path)
+                try:
+                    return numpy.lib.format.read_array(source, allow_pickle=False)
+                finally:
+                    source.close()
+            cache_dir = self.env.get_conf('pysparkArrayCacheDir', os.path.join(os.getcwd(), 'array-cache'))
+            path = _local_copy(filesystem, path, cache_dir)
+        return numpy.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+
+    def checkpoint_lineage(self, df, max_depth=None, name=None):
+        """
+        Checkpoints df when its plan grew deeper than max_depth, by default the job's
+        checkpointPlanDepth, e.g. by unions in a loop, so that the DataFrames derived from it
+        are planned from the checkpoint rather than the whole lineage. Returns the
+        checkpointed DataFrame, or df itself when its plan is not that deep. Called by the
+        interpreter after every top level statement with pysparkAutoCheckpoint, and by
+        actions growing DataFrames in loops, e.g. df = ama_context.checkpoint_lineage(df)
+        at the end of every iteration.
+        """
+        from pyspark.sql import DataFrame
+
+        if max_depth is None:
+            max_depth = self.env.get_conf('checkpointPlanDepth', 100)
+        checkpoint = self._lineage().checkpoint(df._jdf, max_depth, str(self.env.working_dir) + "/" + self.job_id + "/checkpoints")
+        if not checkpoint.isDefined():
+            return df
+        self.checkpoints.setdefault(self.action_name, []).append(checkpoint.get().report(name or 'DataFrame'))
+        return DataFrame(checkpoint.get().dataFrame(), self.spark._wrapped)
+
+    def _committed_files(self, action_name, dataset_name, since):
+        """
+        The files committed to an export written in append mode after the since marker, as
+        its file system, its path, the files' paths and its partition columns with their
+        spark types. None if the export was not written in append mode.
+        """
+        manifest = self._incremental().readJson(self.spark._jsparkSession, self._incremental_path(action_name, dataset_name))
+        if not manifest:
+            if since:
+                raise ValueError('%s of %s is not exported in append mode' % (dataset_name, action_name))
+            return None
+
+        manifest = json.loads(manifest)
+        if manifest['format'] != 'parquet':
+            raise ValueError('%s of %s is a %s export, get_pandas reads parquet exports only' % (dataset_name, action_name, manifest['format']))
+        types = dict((field['name'], field['type']) for field in json.loads(manifest['schema'])['fields'])
+        filesystem, path = _arrow_filesystem(self._incremental_path(action_name, dataset_name))
+        files = [path + '/' + f for commit in manifest['commits'] if commit['marker'] > (since or 0) for f in commit['files']]
+        return filesystem, path, files, [(column, types.get(column)) for column in manifest['partitionBy']]
+
+    def _export_path(self, action_name, dataset_name):
+        return str(self.env.working_dir) + "/" + self.job_id + "/" + action_name + "/" + dataset_name
+
+    def _sampling(self, sample):
+        return self.env.get_conf('exportSampleReads', False) if sample is None else sample
+
+    def _sample_path(self, action_name, dataset_name):
+        # the sample written next to the export, None if it has none
+        for path in (self._export_path(action_name, dataset_name), self._incremental_path(action_name, dataset_name)):
+            if self._samples().exists(self.spark._jsparkSession, path):
+                return self._samples().path(path)
+        return None
+
+    def _incremental_path(self, action_name, dataset_name):
+        # kept per job, as jobs may share the working directory
+        return str(self.env.working_dir) + "/incremental/" + self.env.job_name.replace('/', '_') + "/" + action_name + "/" + dataset_name
+
+    def _manifests(self):
+        return self.sc._jvm.org.apache.amaterasu.executor.runtime.ExportManifest
+
+    def _views(self):
+        return self.sc._jvm.org.apache.amaterasu.executor.runtime.ExportViews
+
+    def _samples(self):
+        return self.sc._jvm.org.apache.amaterasu.executor.runtime.ExportSamples
+
+    def _incremental(self):
+        return self.sc._jvm.org.apache.amaterasu.executor.runtime.IncrementalExports
+
+    def _lineage(self):
+        return self.sc._jvm.org.apache.amaterasu.executor.runtime.LineageCheckpoints
+
+    def _jvm_dataframes(self):
+        return self.sc._jvm.org.apache.amaterasu.executor.runtime.AmaContext.dataFrames()
 
 class Environment(object):
 
-    def __init__(self, name, master, input_root_path, output_root_path, working_dir, configuration):
+    def __init__(self, name, master, input_root_path, output_root_path, working_dir, configuration, job_name=''):
         self.name = name
         self.master = master
         self.input_root_path = input_root_path
         self.output_root_path = output_root_path
         self.working_dir = working_dir
         self.configuration = configuration
+        self.job_name = job_name
+
+    def get_conf(self, key, default=None):
+        # configuration values arrive as strings, so they are coerced to the type of the default
+        value = (self.configuration or {}).get(key)
+        if value is None:
+            return default
+        if isinstance(default, bool):
+            return str(value).lower() in ('true', 'yes', '1')
+        if default is not None:
+            return type(default)(value)
+        return value
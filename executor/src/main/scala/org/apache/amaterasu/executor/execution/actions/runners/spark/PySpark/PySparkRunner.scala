@@ -18,6 +18,7 @@ package org.apache.amaterasu.executor.execution.actions.runners.spark.PySpark
 
 import java.io.{File, PrintWriter, StringWriter}
 import java.util
+import java.util.concurrent.TimeUnit
 
 import org.apache.amaterasu.common.execution.actions.Notifier
 import org.apache.amaterasu.common.execution.dependencies.{PythonDependencies, PythonPackage}
@@ -27,8 +28,10 @@ import org.apache.amaterasu.sdk.AmaterasuRunner
 import org.apache.spark.SparkEnv
 import org.apache.spark.sql.SparkSession
 
+import scala.concurrent.{Future, Promise}
 import scala.sys.process.Process
 import scala.io.Source
+import scala.util.Try
 
 /**
   * Created by roadan on 9/2/16.
@@ -37,6 +40,10 @@ class PySparkRunner extends AmaterasuRunner with Logging {
 
   var proc: Process = _
   var notifier: Notifier = _
+  var exitCode: Future[Int] = _
+  var launched: Long = _
+  var startupTimeout: Long = _
+  @volatile private var ready = false
 
   override def getIdentifier: String = "pyspark"
 
@@ -46,6 +53,7 @@ class PySparkRunner extends AmaterasuRunner with Logging {
 
   def interpretSources(source: String, actionName: String, exports: util.Map[String, String]): Unit = {
 
+    awaitInterpreter()
     PySparkEntryPoint.getExecutionQueue.setForExec((source, actionName, exports))
     val resQueue = PySparkEntryPoint.getResultQueue(actionName)
 
@@ -58,25 +66,51 @@ class PySparkRunner extends AmaterasuRunner with Logging {
       res.resultType match {
         case ResultType.success =>
           notifier.success(res.statement)
+          // carries the statement's profile when profiling is enabled
+          if (res.message != null && res.message.nonEmpty)
+            log.info(s"$actionName: ${res.statement} - ${res.message}")
         case ResultType.error =>
           notifier.error(res.statement, res.message)
           throw new Exception(res.message)
         case ResultType.completion =>
+          if (res.message.nonEmpty)
+            notifier.info(res.message)
           notifier.info(s"================= finished action $actionName =================")
       }
     } while (res != null && res.resultType != ResultType.completion)
   }
 
+  /**
+    * Blocks until the python interpreter signalled it is ready to execute actions, failing
+    * fast if it exits or is not ready within the startup timeout
+    */
+  def awaitInterpreter(): Unit = synchronized {
+
+    if (!ready) {
+      val deadline = launched + startupTimeout
+      while (!PySparkEntryPoint.awaitReady(1, TimeUnit.SECONDS)) {
+        if (exitCode != null && exitCode.isCompleted)
+          throw new Exception(s"pyspark interpreter exited during startup with code ${exitCode.value.get.getOrElse(-1)}")
+        if (System.currentTimeMillis() > deadline)
+          throw new Exception(s"pyspark interpreter was not ready within ${startupTimeout / 1000} seconds")
+      }
+      ready = true
+      log.info(s"pyspark interpreter ready ${System.currentTimeMillis() - launched} ms after launch, ${PySparkEntryPoint.getStartupReport}")
+      log.debug(s"pyspark interpreter imports:\n${PySparkEntryPoint.getImportReport}")
+    }
+  }
+
 }
 
-object PySparkRunner {
+object PySparkRunner extends Logging {
 
   def apply(env: Environment,
             jobId: String,
             notifier: Notifier,
             spark: SparkSession,
             pypath: String,
-            pyDeps: PythonDependencies): PySparkRunner = {
+            pyDeps: PythonDependencies,
+            reportLevel: String): PySparkRunner = {
 
     //TODO: can we make this less ugly?
     var pysparkPython = "/usr/bin/python"
@@ -89,7 +123,7 @@ object PySparkRunner {
 
     val result = new PySparkRunner
 
-    PySparkEntryPoint.start(spark, jobId, env, SparkEnv.get)
+    PySparkEntryPoint.start(spark, jobId, env, SparkEnv.get, reportLevel)
     val port = PySparkEntryPoint.getPort
     var intpPath = ""
     if (env.configuration.contains("cwd")) {
@@ -109,8 +143,21 @@ object PySparkRunner {
       "PYSPARK_PYTHON" -> pysparkPython,
       "PYTHONHASHSEED" -> 0.toString) #> System.out
 
-    proc.run()
-
+    // the interpreter starts in the background, actions wait for its ready signal
+    result.startupTimeout = env.configuration.getOrElse("pysparkStartupTimeout", "600").toLong * 1000
+    result.launched = System.currentTimeMillis()
+    val running = proc.run()
+    result.proc = running
+    // waiting for the interpreter to exit blocks for as long as it runs, so it gets a thread
+    // of its own rather than one of the global execution context's
+    val exited = Promise[Int]()
+    val waiter = new Thread(new Runnable {
+      override def run(): Unit = exited.complete(Try(running.exitValue()))
+    }, s"pyspark-interpreter-$port")
+    waiter.setDaemon(true)
+    waiter.start()
+    result.exitCode = exited.future
+    log.info(s"launched pyspark interpreter $intpPath on port $port")
 
     result.notifier = notifier
 
@@ -18,6 +18,8 @@ package org.apache.amaterasu.executor.execution.actions.runners.spark.PySpark
 
 import java.util.concurrent.{ TimeUnit, LinkedBlockingQueue }
 
+import com.fasterxml.jackson.databind.ObjectMapper
+
 /**
   * Created by roadan on 10/17/16.
   */
@@ -42,4 +44,19 @@ class ResultQueue {
     val result = new PySparkResult(ResultType.withName(resultType), action, statement, message)
     queue.put(result)
   }
+
+  /**
+    * Bulk version of put, used by the python interpreter to report a batch of results
+    * in a single py4j call
+    * @param results a json array of [resultType, action, statement, message] arrays
+    */
+  def putAll(results: String) = {
+
+    ResultQueue.mapper.readValue(results, classOf[Array[Array[String]]])
+      .foreach(r => put(r(0), r(1), r(2), r(3)))
+  }
+}
+
+object ResultQueue {
+  private val mapper = new ObjectMapper()
 }
@@ -73,13 +73,15 @@ class SparkRunnersProvider extends RunnersProvider with Logging {
     SparkRunnerHelper.notifier = notifier
     val spark = SparkRunnerHelper.createSpark(data.env, sparkAppName, jars, conf, executorEnv)
 
+    // the python interpreter is launched first so that it starts up while the scala
+    // interpreter is initialised, actions only wait for it once they are executed
+    val pySparkRunner = PySparkRunner(data.env, jobId, notifier, spark, "spark-2.1.1-bin-hadoop2.7/python:spark-2.1.1-bin-hadoop2.7/python/pyspark:spark-2.1.1-bin-hadoop2.7/python/pyspark/build:spark-2.1.1-bin-hadoop2.7/python/pyspark/lib/py4j-0.10.4-src.zip", data.pyDeps, data.reportLevel)
+    runners.put(pySparkRunner.getIdentifier(), pySparkRunner)
+
     lazy val sparkScalaRunner = SparkScalaRunner(data.env, jobId, spark, outStream, notifier, jars)
     sparkScalaRunner.initializeAmaContext(data.env)
 
     runners.put(sparkScalaRunner.getIdentifier, sparkScalaRunner)
-
-    lazy val pySparkRunner = PySparkRunner(data.env, jobId, notifier, spark, "spark-2.1.1-bin-hadoop2.7/python:spark-2.1.1-bin-hadoop2.7/python/pyspark:spark-2.1.1-bin-hadoop2.7/python/pyspark/build:spark-2.1.1-bin-hadoop2.7/python/pyspark/lib/py4j-0.10.4-src.zip", data.pyDeps)
-    runners.put(pySparkRunner.getIdentifier(), pySparkRunner)
   }
 
   private def installAnacondaPackage(pythonPackage: PythonPackage): Unit = {
@@ -20,6 +20,7 @@ import org.apache.amaterasu.common.logging.Logging
 import org.apache.amaterasu.common.runtime.Environment
 import org.apache.spark.SparkContext
 import org.apache.spark.sql._
+import org.apache.spark.storage.StorageLevel
 
 object AmaContext extends Logging {
 
@@ -27,6 +28,7 @@ object AmaContext extends Logging {
   var sc: SparkContext = _
   var jobId: String = _
   var env: Environment = _
+  var dataFrames: DataFrameCache = new DataFrameCache(32, 1L << 30)
 
   def init(spark: SparkSession,
            jobId: String,
@@ -37,18 +39,135 @@ object AmaContext extends Logging {
     AmaContext.jobId = jobId
     AmaContext.env = env
 
+    val conf = Conf(env)
+    AmaContext.dataFrames = new DataFrameCache(
+      conf.getOrElse("dataframeCacheEntries", "32").toInt,
+      conf.getOrElse("dataframeCacheBytes", (1L << 30).toString).toLong)
+
+  }
+
+  /**
+    * Reads a DataFrame exported by a previous action, from memory when the export was handed
+    * over in memory on this executor. Otherwise DataFrames are cached by the executor, so
+    * reading the same export again reuses the resolved DataFrame, and the export's manifest,
+    * when it has one, provides its schema and files
+    * @param persist a storage level to keep the DataFrame at, e.g. for exports read by many actions
+    * @param columns the columns to read, all of them when empty
+    * @param where a filter applied as the export is read, e.g. expr("x > 3"). Files the
+    *              manifest's statistics rule out are not read at all
+    * @param since for exports written in append mode, reads only the partitions committed
+    *              after this marker, e.g. the getMarker of the export at the reader's last run
+    * @param sample reads the sample written with the export instead, when it has one. By
+    *               default for every read when the environment sets exportSampleReads
+    */
+  def getDataFrame(actionName: String,
+                   dfName: String,
+                   format: String = "parquet",
+                   persist: StorageLevel = null,
+                   columns: Seq[String] = Seq.empty,
+                   where: Column = null,
+                   since: Long = 0,
+                   sample: Boolean = ExportSamples.enabled(AmaContext.env)): DataFrame = {
+
+    val path = exportPath(actionName, dfName)
+    val sampled = if (sample) loadSample(actionName, dfName) else None
+    val read = (ExportViews.lookup(spark, jobId, actionName, dfName), Option(where)) match {
+      case _ if sampled.isDefined =>
+        Option(where).map(sampled.get.where).getOrElse(sampled.get)
+      case _ if since > 0 =>
+        // only the newly committed partitions, these are not cached
+        val incremental = IncrementalExports.load(spark, incrementalPath(actionName, dfName), since)
+          .getOrElse(throw new IllegalArgumentException(s"$dfName of $actionName is not exported in append mode"))
+        Option(where).map(incremental.where).getOrElse(incremental)
+      case (Some(view), Some(condition)) =>
+        view.where(condition)
+      case (Some(view), None) =>
+        view
+      case (None, Some(condition)) =>
+        ExportManifest.loadMatching(spark, path, format, condition)
+          .getOrElse(cached(actionName, dfName, format, persist))
+          .where(condition)
+      case (None, None) =>
+        cached(actionName, dfName, format, persist)
+    }
+
+    if (columns.isEmpty) read else read.select(columns.map(read.col): _*)
+
+  }
+
+  private def cached(actionName: String, dfName: String, format: String, persist: StorageLevel): DataFrame = {
+
+    dataFrames.getOrLoad((actionName, dfName, format), Option(persist)) {
+      IncrementalExports.load(spark, incrementalPath(actionName, dfName), 0)
+        .getOrElse(ExportManifest.load(spark, exportPath(actionName, dfName), format))
+    }
+
+  }
+
+  private def loadSample(actionName: String, dfName: String): Option[DataFrame] = {
+
+    val sample = ExportSamples.load(spark, exportPath(actionName, dfName))
+      .orElse(ExportSamples.load(spark, incrementalPath(actionName, dfName)))
+    if (sample.isEmpty)
+      log.info(s"$dfName of $actionName has no sample, reading the whole export")
+    sample
+
+  }
+
+  def getDataset[T: Encoder](actionName: String, dfName: String, format: String = "parquet", persist: StorageLevel = null): Dataset[T] = {
+
+    getDataFrame(actionName, dfName, format, persist).as[T]
+
+  }
+
+  /**
+    * The number of rows of an export, taken from its manifest without scanning the export when
+    * the manifest was written with statistics
+    */
+  def getRowCount(actionName: String, dfName: String, format: String = "parquet"): Long = {
+
+    ExportManifest.read(spark, exportPath(actionName, dfName))
+      .map(_.rowCount)
+      .filter(_ >= 0)
+      .getOrElse(getDataFrame(actionName, dfName, format).count())
+
   }
 
-  def getDataFrame(actionName: String, dfName: String, format: String = "parquet"): DataFrame = {
+  def getManifest(actionName: String, dfName: String): Option[ExportManifest] = {
 
-    spark.read.format(format).load(s"${env.workingDir}/$jobId/$actionName/$dfName")
+    ExportManifest.read(spark, exportPath(actionName, dfName))
 
   }
 
-  def getDataset[T: Encoder](actionName: String, dfName: String, format: String = "parquet"): Dataset[T] = {
+  /**
+    * The marker of the last commit to an export written in append mode, 0 if nothing was
+    * committed to it yet
+    */
+  def getMarker(actionName: String, dfName: String): Long = {
+
+    IncrementalExports.read(spark, incrementalPath(actionName, dfName)).map(_.lastMarker).getOrElse(0L)
 
-    getDataFrame(actionName, dfName, format).as[T]
+  }
+
+  /**
+    * Checkpoints a DataFrame whose plan grew deeper than maxDepth, e.g. by unions in a loop,
+    * so that the DataFrames derived from it are planned from the checkpoint rather than the
+    * whole lineage. Returns the DataFrame itself when its plan is not that deep
+    */
+  def checkpointLineage(df: DataFrame, maxDepth: Int = LineageCheckpoints.maxDepth(AmaContext.env)): DataFrame = {
+
+    LineageCheckpoints.checkpoint(df, maxDepth, LineageCheckpoints.dir(env.workingDir, jobId))
+      .map(_.dataFrame)
+      .getOrElse(df)
+
+  }
+
+  private def incrementalPath(actionName: String, dfName: String): String = {
+    IncrementalExports.path(env.workingDir, env.jobName, actionName, dfName)
+  }
 
+  private def exportPath(actionName: String, dfName: String): String = {
+    s"${env.workingDir}/$jobId/$actionName/$dfName"
   }
 
 }
@@ -0,0 +1,166 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.executor.runtime
+
+import java.util
+
+import org.apache.amaterasu.common.logging.Logging
+import org.apache.spark.sql.DataFrame
+import org.apache.spark.sql.catalyst.plans.logical.{Join, LeafNode}
+import org.apache.spark.storage.StorageLevel
+
+import scala.collection.JavaConverters._
+import scala.collection.mutable
+
+/**
+  * An executor local LRU cache of the DataFrames read through AmaContext, keyed by action,
+  * dataset and format. A cached DataFrame keeps its resolved relation, so reading the same
+  * export again skips listing its files and reading their footers.
+  * DataFrames can be persisted on the way, the least recently used entries are evicted (and
+  * unpersisted) once there are more than maxEntries of them or the persisted ones take more
+  * than maxBytes. Persisted DataFrames take no space until an action fills their cache, so
+  * their sizes are measured again on every access to the cache.
+  * Every export has a generation, counting the times it was invalidated, for the cache of the
+  * pyspark interpreter to drop what it cached of exports written again by other actions
+  */
+class DataFrameCache(maxEntries: Int, maxBytes: Long) extends Logging {
+
+  private class Entry(val df: DataFrame, var persisted: Boolean = false, var bytes: Long = 0)
+
+  // access ordered, iteration starts at the least recently used entry
+  private val entries = new util.LinkedHashMap[(String, String, String), Entry](16, 0.75f, true)
+
+  private val generations = mutable.Map.empty[(String, String), Long]
+
+  var hits = 0L
+  var misses = 0L
+  var evictions = 0L
+
+  def getOrLoad(key: (String, String, String), persist: Option[StorageLevel])(load: => DataFrame): DataFrame = synchronized {
+
+    var entry = entries.get(key)
+    if (entry == null) {
+      misses += 1
+      entry = new Entry(load)
+      entries.put(key, entry)
+    } else {
+      hits += 1
+    }
+
+    persist.foreach(level => {
+      if (entry.df.storageLevel == StorageLevel.NONE) {
+        entry.df.persist(level)
+        entry.persisted = true
+      }
+    })
+
+    measure()
+    evict(key)
+    entry.df
+  }
+
+  /**
+    * Drops the cached DataFrames of an export, used when the export is written again
+    */
+  def invalidate(actionName: String, dfName: String): Unit = synchronized {
+
+    val stale = entries.keySet.asScala.filter(k => k._1 == actionName && k._2 == dfName).toList
+    stale.foreach(key => release(entries.remove(key)))
+    generations((actionName, dfName)) = generation(actionName, dfName) + 1
+  }
+
+  /**
+    * The number of times an export was invalidated on this executor
+    */
+  def generation(actionName: String, dfName: String): Long = synchronized {
+    generations.getOrElse((actionName, dfName), 0L)
+  }
+
+  def persistedBytes: Long = synchronized {
+    entries.values.asScala.map(_.bytes).sum
+  }
+
+  def stats: String = synchronized {
+    f"dataframe cache hits: $hits, misses: $misses, evictions: $evictions, ${entries.size} entries, ${persistedBytes / 1048576.0}%.1f MB persisted"
+  }
+
+  private def measure(): Unit = {
+    entries.values.asScala.filter(_.persisted).foreach(entry => entry.bytes = DataFrameCache.cachedSize(entry.df))
+  }
+
+  private def evict(keep: (String, String, String)): Unit = {
+
+    val iterator = entries.entrySet.iterator
+    var bytes = entries.values.asScala.map(_.bytes).sum
+    while (iterator.hasNext && (entries.size > maxEntries || bytes > maxBytes)) {
+      val next = iterator.next()
+      if (next.getKey != keep) {
+        log.debug(s"evicting dataframe ${next.getKey} from the dataframe cache")
+        bytes -= next.getValue.bytes
+        release(next.getValue)
+        iterator.remove()
+        evictions += 1
+      }
+    }
+  }
+
+  private def release(entry: Entry): Unit = {
+    if (entry != null && entry.persisted)
+      entry.df.unpersist()
+  }
+
+}
+
+object DataFrameCache {
+
+  /**
+    * The size of a persisted DataFrame's cached data, 0 until an action filled the cache. It
+    * grows as actions compute more of the DataFrame's partitions
+    */
+  def cachedSize(df: DataFrame): Long = {
+    try {
+      val unknown = BigInt(df.sparkSession.conf.get("spark.sql.defaultSizeInBytes", Long.MaxValue.toString).toLong)
+      // spark sizes cached data that was not computed yet as spark.sql.defaultSizeInBytes
+      val size = df.queryExecution.withCachedData.statistics.sizeInBytes
+      if (size >= unknown) 0L else size.toLong
+    } catch {
+      case _: Exception => 0L
+    }
+  }
+
+  /**
+    * Spark's estimate of the DataFrame's size when it is one, None when spark only guessed:
+    * when a leaf of the plan has no statistics, e.g. a DataFrame created from an RDD or from
+    * python data, which spark sizes as spark.sql.defaultSizeInBytes, or when the plan joins,
+    * as a join is estimated as the product of the sizes of its inputs
+    */
+  def estimatedSize(df: DataFrame): Option[Long] = {
+    try {
+      val plan = df.queryExecution.optimizedPlan
+      val unknown = BigInt(df.sparkSession.conf.get("spark.sql.defaultSizeInBytes", Long.MaxValue.toString).toLong)
+      val guessed = plan.find {
+        case leaf: LeafNode => leaf.statistics.sizeInBytes >= unknown
+        case _: Join => true
+        case _ => false
+      }
+      if (guessed.isDefined) None else Some(plan.statistics.sizeInBytes.min(BigInt(Long.MaxValue)).toLong)
+    } catch {
+      case _: Exception => None
+    }
+  }
+
+}
@@ -0,0 +1,297 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.executor.runtime
+
+import com.fasterxml.jackson.databind.ObjectMapper
+import com.fasterxml.jackson.module.scala.DefaultScalaModule
+import org.apache.amaterasu.common.logging.Logging
+import org.apache.amaterasu.common.runtime.Environment
+import org.apache.hadoop.fs.Path
+import org.apache.spark.sql.catalyst.analysis.UnresolvedAttribute
+import org.apache.spark.sql.catalyst.expressions._
+import org.apache.spark.sql.catalyst.util.TypeUtils
+import org.apache.spark.sql.functions._
+import org.apache.spark.sql.types._
+import org.apache.spark.sql.{Column, DataFrame, Row, SparkSession}
+
+import scala.collection.JavaConverters._
+import scala.io.Source
+
+case class ColumnStats(min: String, max: String, nullCount: Long)
+
+/**
+  * A data file of an export. columns holds the file's statistics, it is null in manifests
+  * written without statistics
+  */
+case class ManifestFile(path: String, size: Long, rowCount: Long, columns: Map[String, ColumnStats])
+
+/**
+  * A sidecar written next to the data files of an export, describing the export so that
+  * readers can skip schema inference and listing the export's directory, and, when it was
+  * written with statistics, know its row count without scanning it and skip files that
+  * cannot match a filter. Row counts are -1 when unknown. min and max are only collected for
+  * orderable column types
+  */
+case class ExportManifest(format: String,
+                          schema: String,
+                          rowCount: Long,
+                          files: Seq[ManifestFile],
+                          columns: Map[String, ColumnStats]) {
+
+  def structType: StructType = DataType.fromJson(schema).asInstanceOf[StructType]
+
+}
+
+object ExportManifest extends Logging {
+
+  // files starting with an underscore are ignored by spark's data sources
+  val fileName = "_amaterasu_manifest.json"
+
+  private val mapper = new ObjectMapper()
+  mapper.registerModule(DefaultScalaModule)
+
+  /**
+    * Writes the manifest of an export once its data files are written. Row counts and column
+    * statistics, which let readers skip files, take another pass over the written data, so
+    * they are only collected when the environment sets exportManifestStats. Failing to write
+    * a manifest does not fail the export as readers fall back to reading the export without it
+    */
+  def write(spark: SparkSession, df: DataFrame, path: String, format: String, env: Environment): Unit = {
+
+    val conf = Conf(env)
+    if (!conf.getOrElse("exportManifest", "true").toBoolean)
+      return
+
+    try {
+      val dir = new Path(path)
+      val fs = dir.getFileSystem(spark.sparkContext.hadoopConfiguration)
+      val statuses = fs.listStatus(dir)
+        .filter(s => s.isFile && !s.getPath.getName.startsWith("_") && !s.getPath.getName.startsWith("."))
+        .toSeq
+
+      val manifest =
+        if (conf.getOrElse("exportManifestStats", "false").toBoolean) {
+          val written = spark.read.schema(df.schema).format(format).load(path)
+          val (rowCount, columns, fileStats) = collectStats(spark, written)
+          // files without rows do not show up in the statistics
+          val files = statuses.map(s => {
+            val (rows, stats) = fileStats.getOrElse(s.getPath.getName, (0L, Map.empty[String, ColumnStats]))
+            ManifestFile(s.getPath.getName, s.getLen, rows, stats)
+          })
+          ExportManifest(format, df.schema.json, rowCount, files, columns)
+        } else {
+          val files = statuses.map(s => ManifestFile(s.getPath.getName, s.getLen, -1, null))
+          ExportManifest(format, df.schema.json, -1, files, Map.empty)
+        }
+
+      val out = fs.create(new Path(dir, fileName), true)
+      try {
+        mapper.writeValue(out, manifest)
+      } finally {
+        out.close()
+      }
+    } catch {
+      case e: Exception => log.warn(s"failed to write the manifest of export $path: ${e.getMessage}")
+    }
+  }
+
+  def read(spark: SparkSession, path: String): Option[ExportManifest] = {
+
+    val json = readJson(spark, path)
+    if (json == null) None else Some(mapper.readValue(json, classOf[ExportManifest]))
+
+  }
+
+  /**
+    * The manifest of an export as json, or null if the export has none. Used by the python runtime
+    */
+  def readJson(spark: SparkSession, path: String): String = {
+
+    try {
+      val file = new Path(path, fileName)
+      val fs = file.getFileSystem(spark.sparkContext.hadoopConfiguration)
+      if (!fs.exists(file)) {
+        null
+      } else {
+        val in = fs.open(file)
+        try Source.fromInputStream(in, "UTF-8").mkString finally in.close()
+      }
+    } catch {
+      case e: Exception =>
+        log.warn(s"failed to read the manifest of export $path: ${e.getMessage}")
+        null
+    }
+  }
+
+  /**
+    * Reads an export, using its manifest when it has one written for the same format
+    */
+  def load(spark: SparkSession, path: String, format: String): DataFrame = {
+
+    read(spark, path) match {
+      case Some(manifest) if manifest.format == format => loadFiles(spark, path, manifest, manifest.files)
+      case _ => spark.read.format(format).load(path)
+    }
+  }
+
+  /**
+    * Reads only the files of an export that may hold rows matching the condition, judged by
+    * the min/max statistics of the files in its manifest. None if the export has no manifest
+    * with file statistics for the format. The condition itself is not applied
+    */
+  def loadMatching(spark: SparkSession, path: String, format: String, condition: Column): Option[DataFrame] = {
+
+    read(spark, path)
+      .filter(m => m.format == format && m.files.forall(_.columns != null))
+      .map(manifest => {
+        val schema = manifest.structType
+        val matching = manifest.files.filter(f => mayMatch(f, condition.expr, schema))
+        log.debug(s"pruned ${manifest.files.size - matching.size} of ${manifest.files.size} files of export $path")
+        loadFiles(spark, path, manifest, matching)
+      })
+  }
+
+  private def loadFiles(spark: SparkSession, path: String, manifest: ExportManifest, files: Seq[ManifestFile]): DataFrame = {
+
+    if (files.isEmpty && manifest.files.nonEmpty) {
+      // every file was pruned
+      spark.createDataFrame(List.empty[Row].asJava, manifest.structType)
+    } else if (files.isEmpty) {
+      spark.read.schema(manifest.structType).format(manifest.format).load(path)
+    } else {
+      spark.read.schema(manifest.structType).format(manifest.format).load(files.map(f => s"$path/${f.path}"): _*)
+    }
+  }
+
+  /**
+    * Whether a file may hold rows matching the predicate. Conjunctions, disjunctions, null
+    * checks and comparisons of a column with literals are judged by the file's statistics,
+    * any other predicate keeps the file
+    */
+  private def mayMatch(file: ManifestFile, predicate: Expression, schema: StructType): Boolean = {
+
+    def stats(name: String): Option[(ColumnStats, DataType)] = {
+      schema.fields.find(_.name.equalsIgnoreCase(name))
+        .flatMap(f => file.columns.find(_._1.equalsIgnoreCase(name)).map(c => (c._2, f.dataType)))
+    }
+
+    // whether the file's [min, max] range of the column may satisfy the test against the literal value.
+    // Literals of other types are compared the way spark coerces them, e.g. int_col < 5.5 as doubles,
+    // so these keep the file
+    def inRange(name: String, literal: Literal)(test: (Ordering[Any], Any, Any, Any) => Boolean): Boolean = {
+      stats(name) match {
+        case Some((_, dataType)) if !comparable(literal.dataType, dataType) => true
+        case Some((s, dataType)) if s.min != null && s.max != null =>
+          val min = Cast(Literal(s.min), dataType).eval()
+          val max = Cast(Literal(s.max), dataType).eval()
+          val value = Cast(literal, dataType).eval()
+          min == null || max == null || value == null || test(TypeUtils.getInterpretedOrdering(dataType), min, max, value)
+        case Some((s, _)) if file.rowCount > 0 && s.nullCount == file.rowCount =>
+          // comparisons never hold for nulls
+          false
+        case _ => true
+      }
+    }
+
+    predicate match {
+      case _ if file.rowCount == 0 => false
+      case And(left, right) => mayMatch(file, left, schema) && mayMatch(file, right, schema)
+      case Or(left, right) => mayMatch(file, left, schema) || mayMatch(file, right, schema)
+      case EqualTo(ColumnName(name), l: Literal) => inRange(name, l)((o, min, max, v) => o.lteq(min, v) && o.gteq(max, v))
+      case LessThan(ColumnName(name), l: Literal) => inRange(name, l)((o, min, _, v) => o.lt(min, v))
+      case LessThanOrEqual(ColumnName(name), l: Literal) => inRange(name, l)((o, min, _, v) => o.lteq(min, v))
+      case GreaterThan(ColumnName(name), l: Literal) => inRange(name, l)((o, _, max, v) => o.gt(max, v))
+      case GreaterThanOrEqual(ColumnName(name), l: Literal) => inRange(name, l)((o, _, max, v) => o.gteq(max, v))
+      case EqualTo(l: Literal, c) => mayMatch(file, EqualTo(c, l), schema)
+      case LessThan(l: Literal, c) => mayMatch(file, GreaterThan(c, l), schema)
+      case LessThanOrEqual(l: Literal, c) => mayMatch(file, GreaterThanOrEqual(c, l), schema)
+      case GreaterThan(l: Literal, c) => mayMatch(file, LessThan(c, l), schema)
+      case GreaterThanOrEqual(l: Literal, c) => mayMatch(file, LessThanOrEqual(c, l), schema)
+      case In(c @ ColumnName(_), values) if values.forall(_.isInstanceOf[Literal]) =>
+        values.exists(v => mayMatch(file, EqualTo(c, v), schema))
+      case IsNull(ColumnName(name)) => stats(name).forall(_._1.nullCount > 0)
+      case IsNotNull(ColumnName(name)) => stats(name).forall(_._1.nullCount < file.rowCount)
+      case _ => true
+    }
+  }
+
+  private val integralTypes = Seq(ByteType, ShortType, IntegerType, LongType)
+
+  /**
+    * Whether a literal compares with a column as the column's type. Besides literals of the
+    * column's own type these are integral literals of a narrower type, e.g. 5 with a bigint
+    * column, which spark widens without changing their value
+    */
+  private def comparable(literal: DataType, column: DataType): Boolean = {
+    literal == column ||
+      (integralTypes.contains(literal) && integralTypes.indexOf(literal) < integralTypes.indexOf(column))
+  }
+
+  private object ColumnName {
+    def unapply(e: Expression): Option[String] = e match {
+      case UnresolvedAttribute(Seq(name)) => Some(name)
+      case a: AttributeReference => Some(a.name)
+      case _ => None
+    }
+  }
+
+  /**
+    * Collects the row count and column statistics of the export and of each of its files.
+    * The export is scanned once for the statistics of the files, which are then combined
+    * locally into the statistics of the export
+    */
+  private def collectStats(spark: SparkSession, df: DataFrame): (Long, Map[String, ColumnStats], Map[String, (Long, Map[String, ColumnStats])]) = {
+
+    val fields = df.schema.fields.toSeq
+    val perFile = df.groupBy(input_file_name().as("file")).agg(count(lit(1)).as("rows"), fields.zipWithIndex.flatMap { case (f, i) =>
+      val column = col(s"`${f.name.replace("`", "``")}`")
+      val (min_, max_) =
+        if (orderable(f.dataType)) (min(column), max(column))
+        else (lit(null).cast(StringType), lit(null).cast(StringType))
+      Seq(min_.as(s"min$i"), max_.as(s"max$i"), sum(when(column.isNull, 1).otherwise(0)).as(s"nulls$i"))
+    }: _*)
+
+    val files = spark.createDataFrame(perFile.collect().toList.asJava, perFile.schema)
+
+    // the min, max and null count of every field as string, string and long
+    def statsColumns(stats: Int => (Column, Column, Column)): Seq[Column] = fields.indices.flatMap(n => {
+      val (min_, max_, nulls) = stats(n)
+      Seq(min_.cast(StringType), max_.cast(StringType), nulls.cast(LongType))
+    })
+
+    def columnStats(row: Row, offset: Int): Map[String, ColumnStats] = fields.zipWithIndex.map { case (f, i) =>
+      val at = offset + i * 3
+      f.name -> ColumnStats(row.getString(at), row.getString(at + 1), if (row.isNullAt(at + 2)) 0L else row.getLong(at + 2))
+    }.toMap
+
+    val fileStats = files.select(col("file") +: col("rows").cast(LongType) +: statsColumns(n => (col(s"min$n"), col(s"max$n"), col(s"nulls$n"))): _*)
+      .collect()
+      .map(row => new Path(row.getString(0)).getName -> (row.getLong(1), columnStats(row, 2)))
+      .toMap
+
+    val totals = files.agg(sum(col("rows")).cast(LongType), statsColumns(n => (min(col(s"min$n")), max(col(s"max$n")), sum(col(s"nulls$n")))): _*)
+      .head()
+
+    (if (totals.isNullAt(0)) 0L else totals.getLong(0), columnStats(totals, 1), fileStats)
+  }
+
+  private def orderable(dataType: DataType): Boolean = dataType match {
+    case _: NumericType | StringType | DateType | TimestampType | BooleanType => true
+    case _ => false
+  }
+
+}
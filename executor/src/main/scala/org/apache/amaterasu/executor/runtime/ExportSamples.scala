@@ -0,0 +1,122 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.executor.runtime
+
+import org.apache.amaterasu.common.dataobjects.ExportSpec
+import org.apache.amaterasu.common.logging.Logging
+import org.apache.amaterasu.common.runtime.Environment
+import org.apache.hadoop.fs.Path
+import org.apache.spark.sql.expressions.Window
+import org.apache.spark.sql.functions._
+import org.apache.spark.sql.types.{LongType, StructField, StructType}
+import org.apache.spark.sql.{DataFrame, Row, SaveMode, SparkSession}
+
+import scala.collection.JavaConverters._
+
+/**
+  * Samples of a fixed number of rows written as parquet next to the data of exports with a
+  * sample option, for development runs that do not need the full data. Readers get the
+  * sample instead of the export when they ask for it, or for every read when the job's
+  * environment sets exportSampleReads, falling back to the export when it has no sample
+  */
+object ExportSamples extends Logging {
+
+  // ignored by spark's data sources when reading the export itself
+  val dirName = "_amaterasu_sample"
+
+  // samples are the same across runs over the same data
+  private val seed = 17L
+
+  // stratified samples draw some extra rows before cutting every stratum down to its share
+  private val oversample = 1.1
+
+  def path(exportPath: String): String = s"$exportPath/$dirName"
+
+  def enabled(env: Environment): Boolean = {
+    Conf.get(env, "exportSampleReads", "false").toBoolean
+  }
+
+  /**
+    * Samples an export that was just written, reading it back rather than computing the
+    * exported DataFrame again. A no-op for exports without a sample option
+    */
+  def write(spark: SparkSession, exportPath: String, schema: StructType, spec: ExportSpec): Unit = {
+
+    if (spec.sample > 0)
+      write(spark.read.schema(schema).format(spec.format).load(exportPath), exportPath, spec)
+
+  }
+
+  /**
+    * Writes a sample of the written data. A uniform sample keeps the rows with the smallest
+    * random keys, which spark finds in a single pass keeping the top rows of every
+    * partition. Failing to write a sample does not fail the export
+    */
+  def write(written: DataFrame, exportPath: String, spec: ExportSpec): Unit = {
+
+    if (spec.sample <= 0)
+      return
+
+    try {
+      val sample = spec.sampleBy match {
+        case Some(column) => stratified(written, column, spec.sample)
+        case None => written.orderBy(rand(seed)).limit(spec.sample.toInt)
+      }
+      sample.write.mode(SaveMode.Overwrite).parquet(path(exportPath))
+    } catch {
+      case e: Exception => log.warn(s"failed to write the sample of export $exportPath: ${e.getMessage}")
+    }
+  }
+
+  def exists(spark: SparkSession, exportPath: String): Boolean = {
+
+    val dir = new Path(path(exportPath))
+    dir.getFileSystem(spark.sparkContext.hadoopConfiguration).exists(dir)
+
+  }
+
+  def load(spark: SparkSession, exportPath: String): Option[DataFrame] = {
+
+    if (exists(spark, exportPath)) Some(spark.read.parquet(path(exportPath))) else None
+
+  }
+
+  /**
+    * Every value of the column gets a share of the rows proportional to its count, and at
+    * least one row. Rows with a null value are not sampled
+    */
+  private def stratified(df: DataFrame, column: String, rows: Long): DataFrame = {
+
+    val counts = df.groupBy(col(column)).count().collect()
+      .filterNot(_.isNullAt(0))
+      .map(r => (r.get(0), r.getLong(1)))
+    val total = counts.map(_._2).sum.toDouble
+    val quotas = counts.map { case (value, count) => value -> math.max(1L, math.round(rows * count / total)) }.toMap
+    val fractions = counts.map { case (value, count) => value -> math.min(1.0, (oversample * quotas(value) + 10) / count) }.toMap
+
+    val quotaSchema = StructType(Seq(df.schema(column), StructField("_quota", LongType)))
+    val quotaRows = quotas.toList.map { case (value, quota) => Row(value, quota) }
+    val quotaDf = df.sparkSession.createDataFrame(quotaRows.asJava, quotaSchema)
+
+    df.stat.sampleBy(column, fractions, seed)
+      .withColumn("_rank", row_number().over(Window.partitionBy(col(column)).orderBy(rand(seed))))
+      .join(broadcast(quotaDf), Seq(column))
+      .where(col("_rank") <= col("_quota"))
+      .select(df.columns.map(c => col(s"`${c.replace("`", "``")}`")): _*)
+  }
+
+}
@@ -0,0 +1,155 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.executor.runtime
+
+import java.util
+
+import org.apache.amaterasu.common.logging.Logging
+import org.apache.amaterasu.common.runtime.Environment
+import org.apache.spark.sql.types.StructType
+import org.apache.spark.sql.{DataFrame, SparkSession}
+import org.apache.spark.storage.StorageLevel
+
+/**
+  * Hands exports over to the following actions on the same executor in memory. When enabled
+  * (exportViews), a written export is read back, persisted and registered as a global temp
+  * view that AmaContext reads it from instead of the export's files. The view reads the
+  * written files rather than computing the action's DataFrame, so blocks evicted from the
+  * cache are read again instead of running the action's lineage again. The least recently
+  * read views are dropped and unpersisted once the cached exports take more than
+  * exportViewBytes, readers then fall back to the files
+  */
+object ExportViews extends Logging {
+
+  private class View(val df: DataFrame, var bytes: Long)
+
+  // access ordered, iteration starts at the least recently read view
+  private val views = new util.LinkedHashMap[String, View](16, 0.75f, true)
+
+  def enabled(env: Environment): Boolean = Conf(env).getOrElse("exportViews", "false").toBoolean
+
+  /**
+    * Registers a written export as a global temp view, replacing the view of an earlier write.
+    * The export is cached as it is registered, outside the lock so that lookups and other
+    * registrations do not wait for it to be read. Failing to cache it does not fail the
+    * export, the cached blocks are released and readers read the export's files
+    */
+  def register(spark: SparkSession,
+               path: String,
+               format: String,
+               schema: StructType,
+               jobId: String,
+               actionName: String,
+               name: String,
+               env: Environment): Unit = {
+
+    if (!enabled(env))
+      return
+
+    val view = viewName(jobId, actionName, name)
+
+    // spark would otherwise reuse the earlier write's cached data, as it reads the same path
+    synchronized {
+      drop(spark, view)
+    }
+
+    val df = spark.read.schema(schema).format(format).load(path)
+    try {
+      df.persist(StorageLevel.fromString(Conf(env).getOrElse("exportViewStorageLevel", "MEMORY_AND_DISK")))
+      df.count()
+    } catch {
+      case e: Exception =>
+        df.unpersist()
+        log.warn(s"failed to cache export view $view: ${e.getMessage}")
+        return
+    }
+
+    synchronized {
+      // registered by a concurrent write of the same export meanwhile
+      drop(spark, view)
+      df.createGlobalTempView(view)
+
+      val registered = new View(df, sizeOf(df))
+      views.put(view, registered)
+      log.debug(s"registered export view $view of ${registered.bytes} bytes")
+
+      evict(spark, view, Conf(env).getOrElse("exportViewBytes", (1L << 30).toString).toLong)
+    }
+  }
+
+  /**
+    * The in memory view of an export, None if it has none or it was evicted
+    */
+  def lookup(spark: SparkSession, jobId: String, actionName: String, name: String): Option[DataFrame] = synchronized {
+
+    val view = viewName(jobId, actionName, name)
+    if (views.get(view) == null) None else Some(spark.table(s"${globalDatabase(spark)}.$view"))
+
+  }
+
+  def cachedBytes: Long = synchronized {
+
+    var bytes = 0L
+    val iterator = views.values.iterator
+    while (iterator.hasNext) bytes += iterator.next().bytes
+    bytes
+
+  }
+
+  private def evict(spark: SparkSession, keep: String, maxBytes: Long): Unit = {
+
+    var bytes = cachedBytes
+    val names = new util.ArrayList[String](views.keySet)
+    val iterator = names.iterator
+    while (iterator.hasNext && bytes > maxBytes) {
+      val view = iterator.next()
+      if (view != keep) {
+        bytes -= views.get(view).bytes
+        log.info(s"evicting export view $view, the cached exports exceed $maxBytes bytes")
+        drop(spark, view)
+      }
+    }
+  }
+
+  private def drop(spark: SparkSession, view: String): Unit = {
+
+    val registered = views.remove(view)
+    if (registered != null)
+      registered.df.unpersist()
+    spark.catalog.dropGlobalTempView(view)
+
+  }
+
+  private def sizeOf(df: DataFrame): Long = {
+
+    // the size of the cached data, which registering the view filled
+    try {
+      df.queryExecution.withCachedData.statistics.sizeInBytes.toLong
+    } catch {
+      case _: Exception => 0L
+    }
+  }
+
+  private def globalDatabase(spark: SparkSession): String = {
+    spark.conf.get("spark.sql.globalTempDatabase", "global_temp")
+  }
+
+  private def viewName(jobId: String, actionName: String, name: String): String = {
+    s"${jobId}_${actionName}_$name".replaceAll("\\W", "_")
+  }
+
+}
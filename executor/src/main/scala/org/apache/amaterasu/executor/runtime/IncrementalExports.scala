@@ -0,0 +1,217 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.executor.runtime
+
+import java.io.IOException
+import java.util.UUID
+import java.util.concurrent.ConcurrentHashMap
+
+import com.fasterxml.jackson.databind.ObjectMapper
+import com.fasterxml.jackson.module.scala.DefaultScalaModule
+import org.apache.amaterasu.common.dataobjects.ExportSpec
+import org.apache.amaterasu.common.logging.Logging
+import org.apache.hadoop.fs.{FileSystem, Path}
+import org.apache.spark.sql.types.{DataType, StructType}
+import org.apache.spark.sql.{DataFrame, Row, SaveMode, SparkSession}
+
+import scala.collection.JavaConverters._
+import scala.collection.mutable.ListBuffer
+import scala.io.Source
+
+/**
+  * The partitions and data files added to an incremental export by a single run. Markers
+  * increase with every commit
+  */
+case class PartitionCommit(marker: Long, jobId: String, timestamp: Long, partitions: Seq[String], files: Seq[String])
+
+/**
+  * The record of the commits of an incremental export, files missing from it were not
+  * committed, e.g. the files of a failed run, and are not read
+  */
+case class PartitionManifest(format: String, partitionBy: Seq[String], schema: String, commits: Seq[PartitionCommit]) {
+
+  def structType: StructType = DataType.fromJson(schema).asInstanceOf[StructType]
+
+  def lastMarker: Long = if (commits.isEmpty) 0L else commits.map(_.marker).max
+
+}
+
+/**
+  * Exports written in append mode. These outlive the job run writing them, so they are kept
+  * under the job's directory in the working directory rather than the run's directory, apart
+  * from the exports of other jobs sharing the working directory, and every run adds its
+  * partitions to the export and commits them to the export's partition manifest. Readers
+  * can read the partitions committed since a marker only, so that incremental pipelines
+  * process the new data rather than the whole history
+  */
+object IncrementalExports extends Logging {
+
+  val fileName = "_amaterasu_partitions.json"
+
+  private val mapper = new ObjectMapper()
+  mapper.registerModule(DefaultScalaModule)
+
+  // one lock per export, appends to different exports commit concurrently
+  private val locks = new ConcurrentHashMap[String, Object]()
+
+  def path(workingDir: String, jobName: String, actionName: String, name: String): String = {
+    s"$workingDir/incremental/${jobName.replace("/", "_")}/$actionName/$name"
+  }
+
+  /**
+    * Appends the DataFrame to the export and commits the files it added. The DataFrame is
+    * written to a staging directory of its own, so the commit holds exactly the files of
+    * this write. Moving them into the export and committing them is serialised per export,
+    * so concurrent appends, e.g. of the same variable exported twice, each commit their own
+    * files and no commit is lost
+    */
+  def append(spark: SparkSession, df: DataFrame, path: String, spec: ExportSpec, jobId: String): PartitionCommit = {
+
+    val dir = new Path(path)
+    val fs = dir.getFileSystem(spark.sparkContext.hadoopConfiguration)
+    read(spark, path).foreach(validate(_, path, spec))
+
+    // ignored by readers and by the listing of other appends' staging directories
+    val staging = new Path(dir, s"_staging-${UUID.randomUUID()}")
+    val commit = try {
+      df.write.mode(SaveMode.ErrorIfExists).format(spec.format).partitionBy(spec.partitionBy: _*).save(staging.toString)
+      val added = dataFiles(fs, staging).sorted
+
+      lock(fs.makeQualified(dir).toString).synchronized {
+        val manifest = read(spark, path)
+        manifest.foreach(validate(_, path, spec))
+
+        added.foreach(file => {
+          val target = new Path(dir, file)
+          fs.mkdirs(target.getParent)
+          if (!fs.rename(new Path(staging, file), target))
+            throw new IOException(s"failed to move $file into export $path")
+        })
+
+        val commit = PartitionCommit(
+          manifest.map(_.lastMarker).getOrElse(0L) + 1,
+          jobId,
+          System.currentTimeMillis(),
+          added.map(f => if (f.contains("/")) f.substring(0, f.lastIndexOf('/')) else "").distinct,
+          added
+        )
+
+        // partition columns come last when the export is read
+        val (partitionFields, dataFields) = df.schema.fields.partition(f => spec.partitionBy.contains(f.name))
+        val schema = StructType(dataFields ++ spec.partitionBy.flatMap(c => partitionFields.find(_.name == c)))
+        val updated = PartitionManifest(spec.format, spec.partitionBy, schema.json, manifest.map(_.commits).getOrElse(Seq.empty) :+ commit)
+
+        val out = fs.create(new Path(dir, fileName), true)
+        try {
+          mapper.writeValue(out, updated)
+        } finally {
+          out.close()
+        }
+        commit
+      }
+    } finally {
+      fs.delete(staging, true)
+    }
+
+    log.info(s"committed ${commit.files.size} files in ${commit.partitions.size} partitions to export $path at marker ${commit.marker}")
+
+    // the sample of an incremental export is a sample of the latest run's partitions
+    if (spec.sample > 0)
+      load(spark, path, commit.marker - 1).foreach(ExportSamples.write(_, path, spec))
+
+    commit
+  }
+
+  def read(spark: SparkSession, path: String): Option[PartitionManifest] = {
+
+    val json = readJson(spark, path)
+    if (json == null) None else Some(mapper.readValue(json, classOf[PartitionManifest]))
+
+  }
+
+  /**
+    * The partition manifest of an export as json, or null if it is not an incremental export.
+    * Used by the python runtime
+    */
+  def readJson(spark: SparkSession, path: String): String = {
+
+    val file = new Path(path, fileName)
+    val fs = file.getFileSystem(spark.sparkContext.hadoopConfiguration)
+    if (!fs.exists(file)) {
+      null
+    } else {
+      val in = fs.open(file)
+      try Source.fromInputStream(in, "UTF-8").mkString finally in.close()
+    }
+  }
+
+  /**
+    * Reads the files committed to the export after the since marker, all of them for 0.
+    * None if there is no incremental export at the path
+    */
+  def load(spark: SparkSession, path: String, since: Long): Option[DataFrame] = {
+
+    read(spark, path).map(manifest => {
+      val files = manifest.commits.filter(_.marker > since).flatMap(_.files)
+      if (files.isEmpty) {
+        spark.createDataFrame(List.empty[Row].asJava, manifest.structType)
+      } else {
+        spark.read
+          .schema(manifest.structType)
+          .option("basePath", path)
+          .format(manifest.format)
+          .load(files.map(f => s"$path/$f"): _*)
+      }
+    })
+  }
+
+  private def validate(manifest: PartitionManifest, path: String, spec: ExportSpec): Unit = {
+
+    if (manifest.format != spec.format || manifest.partitionBy != spec.partitionBy)
+      throw new IllegalArgumentException(s"export $path is written as ${manifest.format} partitioned by ${manifest.partitionBy.mkString(",")}, " +
+        s"it cannot be appended to as ${spec.format} partitioned by ${spec.partitionBy.mkString(",")}")
+
+  }
+
+  private def lock(path: String): Object = {
+
+    locks.putIfAbsent(path, new Object)
+    locks.get(path)
+
+  }
+
+  /**
+    * The data files under a directory, relative to it. Files and directories
+    * starting with an underscore or a dot, such as spark's _temporary, are skipped
+    */
+  private def dataFiles(fs: FileSystem, dir: Path): Seq[String] = {
+
+    if (!fs.exists(dir))
+      return Seq.empty
+
+    val root = fs.makeQualified(dir).toUri.getPath.stripSuffix("/") + "/"
+    val files = new ListBuffer[String]
+    val iterator = fs.listFiles(dir, true)
+    while (iterator.hasNext) {
+      val relative = iterator.next().getPath.toUri.getPath.stripPrefix(root)
+      if (!relative.split("/").exists(p => p.startsWith("_") || p.startsWith(".")))
+        files += relative
+    }
+    files
+  }
+
+}
@@ -0,0 +1,134 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.executor.runtime
+
+import java.util.{ArrayDeque, IdentityHashMap}
+
+import org.apache.amaterasu.common.logging.Logging
+import org.apache.amaterasu.common.runtime.Environment
+import org.apache.hadoop.fs.Path
+import org.apache.spark.SparkContext
+import org.apache.spark.scheduler.{SparkListener, SparkListenerApplicationEnd}
+import org.apache.spark.sql.DataFrame
+import org.apache.spark.sql.catalyst.plans.logical.LogicalPlan
+
+/**
+  * A DataFrame checkpointed for the depth of its plan, with the time spark took to plan a
+  * DataFrame derived from it before and after the checkpoint, in milliseconds
+  */
+case class LineageCheckpoint(dataFrame: DataFrame, depth: Int, planningBefore: Long, planningAfter: Long) {
+
+  def report(name: String): String = {
+    s"lineage checkpoint: $name at plan depth $depth, planning ${planningBefore}ms before and ${planningAfter}ms after, " +
+      s"saving ${math.max(0L, planningBefore - planningAfter)}ms for every DataFrame derived from it"
+  }
+
+}
+
+/**
+  * Checkpoints of DataFrames with deep plans, e.g. grown by unions or withColumn calls in a
+  * loop. Spark analyses, optimises and plans the whole plan again for every DataFrame
+  * derived from such a DataFrame, so planning time grows with every step. A checkpoint
+  * writes the DataFrame's data to the job's checkpoint directory and starts a new plan
+  * reading it
+  */
+object LineageCheckpoints extends Logging {
+
+  val defaultDepth = 100
+
+  def dir(workingDir: String, jobId: String): String = s"$workingDir/$jobId/checkpoints"
+
+  /**
+    * The plan depth past which DataFrames are checkpointed, set by checkpointPlanDepth in
+    * the job's environment
+    */
+  def maxDepth(env: Environment): Int = {
+    Conf.get(env, "checkpointPlanDepth", defaultDepth.toString).toInt
+  }
+
+  /**
+    * The depth of the DataFrame's analysed plan. Subplans shared by several parents, as in
+    * df.union(df), are only visited once, and deep plans are walked without recursion
+    */
+  def depth(df: DataFrame): Int = {
+
+    val root = df.queryExecution.analyzed
+    val depths = new IdentityHashMap[LogicalPlan, Int]()
+    val pending = new ArrayDeque[LogicalPlan]()
+    pending.push(root)
+
+    while (!pending.isEmpty) {
+      val plan = pending.peek()
+      val missing = plan.children.filterNot(depths.containsKey)
+      if (missing.nonEmpty) {
+        missing.foreach(pending.push)
+      } else {
+        pending.pop()
+        depths.put(plan, 1 + (if (plan.children.isEmpty) 0 else plan.children.map(depths.get).max))
+      }
+    }
+    depths.get(root)
+  }
+
+  /**
+    * Checkpoints the DataFrame when its plan is deeper than maxDepth, None otherwise. The
+    * checkpoint directory is only set when the job did not set one of its own, and is
+    * deleted once the spark context stops, as only the context writing checkpoints reads them
+    */
+  def checkpoint(df: DataFrame, maxDepth: Int, dir: String): Option[LineageCheckpoint] = {
+
+    val planDepth = depth(df)
+    if (maxDepth <= 0 || planDepth <= maxDepth)
+      return None
+
+    val sc = df.sparkSession.sparkContext
+    sc.synchronized {
+      if (sc.getCheckpointDir.isEmpty) {
+        sc.setCheckpointDir(dir)
+        deleteOnStop(sc, new Path(sc.getCheckpointDir.get))
+      }
+    }
+
+    val before = planning(df)
+    val checkpointed = df.checkpoint(eager = true)
+    val checkpoint = LineageCheckpoint(checkpointed, planDepth, before, planning(checkpointed))
+    log.info(checkpoint.report(s"DataFrame ${df.schema.simpleString}"))
+    Some(checkpoint)
+  }
+
+  private def deleteOnStop(sc: SparkContext, checkpoints: Path): Unit = {
+
+    val hadoopConf = sc.hadoopConfiguration
+    sc.addSparkListener(new SparkListener {
+      override def onApplicationEnd(end: SparkListenerApplicationEnd): Unit = {
+        try {
+          checkpoints.getFileSystem(hadoopConf).delete(checkpoints, true)
+        } catch {
+          case e: Exception => log.warn(s"failed to delete the lineage checkpoints in $checkpoints: ${e.getMessage}")
+        }
+      }
+    })
+  }
+
+  // what planning a DataFrame derived from df takes, as every new DataFrame plans its whole plan
+  private def planning(df: DataFrame): Long = {
+    val began = System.nanoTime()
+    df.select("*").queryExecution.executedPlan
+    (System.nanoTime() - began) / 1000000
+  }
+
+}
@@ -19,11 +19,12 @@ package org.apache.spark.repl.amaterasu.runners.spark
 import java.io.ByteArrayOutputStream
 import java.util
 
+import org.apache.amaterasu.common.dataobjects.ExportSpec
 import org.apache.amaterasu.common.execution.actions.Notifier
 import org.apache.amaterasu.common.logging.Logging
 import org.apache.amaterasu.common.runtime.Environment
 import org.apache.amaterasu.sdk.AmaterasuRunner
-import org.apache.amaterasu.executor.runtime.AmaContext
+import org.apache.amaterasu.executor.runtime.{AmaContext, ExportManifest, ExportSamples, ExportViews, IncrementalExports}
 import org.apache.spark.sql.{Dataset, SparkSession}
 
 import scala.collection.mutable
@@ -88,14 +89,27 @@ class SparkScalaRunner(var env: Environment,
 
               if (exports.contains(resultName.toString)) {
 
-                val format = exports(resultName.toString)
+                val spec = ExportSpec.parse(exports(resultName.toString))
 
                 if (result != null) {
 
                   result match {
+                    case ds:  Dataset[_] if spec.append =>
+                      log.debug(s"appending DataFrame: $resultName")
+                      IncrementalExports.append(spark, ds.toDF, IncrementalExports.path(env.workingDir, env.jobName, actionName, resultName.toString), spec, jobId)
+                      AmaContext.dataFrames.invalidate(actionName, resultName.toString)
+
+                      log.debug(s"appended DataFrame: $resultName")
+
                     case ds:  Dataset[_] =>
                       log.debug(s"persisting DataFrame: $resultName")
-                      interpreter.interpret(s"""$resultName.write.mode(SaveMode.Overwrite).format("$format").save("${env.workingDir}/$jobId/$actionName/$resultName")""")
+                      val format = spec.format
+                      val exportPath = s"${env.workingDir}/$jobId/$actionName/$resultName"
+                      interpreter.interpret(s"""$resultName.write.mode(SaveMode.Overwrite).format("$format").save("$exportPath")""")
+                      ExportManifest.write(spark, ds.toDF, exportPath, format, env)
+                      ExportSamples.write(spark, exportPath, ds.schema, spec)
+                      ExportViews.register(spark, exportPath, format, ds.schema, jobId, actionName, resultName.toString, env)
+                      AmaContext.dataFrames.invalidate(actionName, resultName.toString)
 
                       log.debug(s"persisted DataFrame: $resultName")
 
@@ -0,0 +1,156 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'main', 'resources'))
+
+from runtime import BroadcastRegistry, DataFrameCache
+
+
+class FakeJvm(object):
+    # stands in for the JVM's DataFrameCache.cachedSize, answering the cached size of the fake DataFrame
+    def __getattr__(self, name):
+        return self
+
+    def cachedSize(self, jdf):
+        return jdf.cached
+
+
+class FakeSparkContext(object):
+    _jvm = FakeJvm()
+
+
+class FakeDataFrame(object):
+    # a DataFrame whose cached data takes size bytes once compute() is called
+    def __init__(self, size):
+        self._sc = FakeSparkContext()
+        self._jdf = self
+        self.size = size
+        self.cached = 0
+        self.is_cached = False
+
+    def persist(self, level):
+        self.is_cached = True
+
+    def unpersist(self):
+        self.is_cached = False
+        self.cached = 0
+
+    def compute(self):
+        if self.is_cached:
+            self.cached = self.size
+
+
+class DataFrameCacheTests(unittest.TestCase):
+
+    def test_persisted_dataframes_are_charged_once_computed(self):
+        cache = DataFrameCache(8, 1000)
+        df = cache.get_or_load(('start', 'df', 'parquet'), lambda: FakeDataFrame(100), 'MEMORY_ONLY')
+        self.assertEqual(cache.persisted_bytes(), 0)
+
+        df.compute()
+        self.assertIs(cache.get_or_load(('start', 'df', 'parquet'), None), df)
+        self.assertEqual(cache.persisted_bytes(), 100)
+
+    def test_dataframes_over_budget_are_evicted_once_computed(self):
+        cache = DataFrameCache(8, 150)
+        first = cache.get_or_load(('start', 'first', 'parquet'), lambda: FakeDataFrame(100), 'MEMORY_ONLY')
+        second = cache.get_or_load(('start', 'second', 'parquet'), lambda: FakeDataFrame(100), 'MEMORY_ONLY')
+        self.assertEqual(cache.evictions, 0)
+
+        first.compute()
+        second.compute()
+        cache.get_or_load(('start', 'second', 'parquet'), None)
+        self.assertEqual(cache.evictions, 1)
+        self.assertFalse(first.is_cached)
+        self.assertTrue(second.is_cached)
+
+    def test_dataframes_persisted_elsewhere_are_not_unpersisted(self):
+        cache = DataFrameCache(1, 1000)
+        df = FakeDataFrame(100)
+        df.persist('MEMORY_ONLY')
+        cache.get_or_load(('start', 'first', 'parquet'), lambda: df, 'MEMORY_ONLY')
+        cache.get_or_load(('start', 'second', 'parquet'), lambda: FakeDataFrame(100))
+        self.assertTrue(df.is_cached)
+
+
+class FakeBroadcast(object):
+
+    def __init__(self, value):
+        self.value = value
+        self.unpersisted = False
+
+    def unpersist(self):
+        self.unpersisted = True
+
+
+class BroadcastRegistryTests(unittest.TestCase):
+
+    def test_broadcasts_are_created_once(self):
+        registry = BroadcastRegistry()
+        first = registry.get_or_create(('start', 'lookup', 'k'), lambda: FakeBroadcast(1))
+        self.assertIs(registry.get_or_create(('start', 'lookup', 'k'), lambda: FakeBroadcast(2)), first)
+        self.assertEqual((registry.hits, registry.misses), (1, 1))
+
+    def test_broadcasts_are_created_outside_the_lock(self):
+        registry = BroadcastRegistry()
+        started = threading.Event()
+        finish = threading.Event()
+        results = []
+
+        def slow():
+            started.set()
+            finish.wait(5)
+            return FakeBroadcast('slow')
+
+        def read_slow():
+            results.append(registry.get_or_create(('start', 'slow', 'k'), slow))
+
+        creating = threading.Thread(target=read_slow)
+        creating.start()
+        started.wait(5)
+        # other broadcasts are created while the slow one is collected
+        self.assertEqual(registry.get_or_create(('start', 'fast', 'k'), lambda: FakeBroadcast('fast')).value, 'fast')
+
+        # and threads asking for the slow one wait for it rather than creating it again
+        waiting = threading.Thread(target=read_slow)
+        waiting.start()
+        finish.set()
+        creating.join(5)
+        waiting.join(5)
+        self.assertEqual(len(results), 2)
+        self.assertIs(results[0], results[1])
+        self.assertEqual(registry.misses, 2)
+
+    def test_failed_creations_are_retried(self):
+        registry = BroadcastRegistry()
+
+        def fail():
+            raise IOError('export missing')
+        self.assertRaises(IOError, registry.get_or_create, ('start', 'lookup', 'k'), fail)
+        self.assertEqual(registry.get_or_create(('start', 'lookup', 'k'), lambda: FakeBroadcast(1)).value, 1)
+
+    def test_broadcasts_created_while_invalidated_are_not_kept(self):
+        registry = BroadcastRegistry()
+
+        def written_again():
+            registry.invalidate('start', 'lookup')
+            return FakeBroadcast('stale')
+        self.assertEqual(registry.get_or_create(('start', 'lookup', 'k'), written_again).value, 'stale')
+        self.assertEqual(registry.get_or_create(('start', 'lookup', 'k'), lambda: FakeBroadcast('fresh')).value, 'fresh')
+
+    def test_least_recently_used_broadcasts_are_unpersisted(self):
+        registry = BroadcastRegistry(max_entries=1)
+        first = registry.get_or_create(('start', 'first', 'k'), lambda: FakeBroadcast(1))
+        second = registry.get_or_create(('start', 'second', 'k'), lambda: FakeBroadcast(2))
+        self.assertTrue(first.unpersisted)
+        self.assertFalse(second.unpersisted)
+
+        registry.release()
+        self.assertTrue(second.unpersisted)
+        self.assertEqual(registry.stats()['entries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,470 @@
+import ast
+import os
+import shutil
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'main', 'resources'))
+
+from intp_utils import BytecodeCache, DriverGuard, ExportSpec, PersistencePlan, ResultBuffer, SpilledRows, StatementTracer, \
+    concurrent_batches, first_line, spill_rows
+from import_profiler import ImportProfiler
+
+
+def statements(source):
+    return ast.parse(textwrap.dedent(source)).body
+
+
+class FakeDataFrame(object):
+    # stands in for a pyspark DataFrame of n rows whose size spark estimates at size bytes
+    def __init__(self, n, size):
+        self.n = n
+        self.size = size
+
+    def collect(self):
+        return list(range(self.n))
+
+    def toPandas(self):
+        return self.collect()
+
+    def toLocalIterator(self):
+        return iter(range(self.n))
+
+
+class DriverGuardTests(unittest.TestCase):
+
+    def guard(self, mode='fail'):
+        class Guarded(FakeDataFrame):
+            pass
+        guard = DriverGuard(1000, mode, lambda df: df.size, None)
+        guard.install(Guarded)
+        return guard, Guarded
+
+    def test_calls_within_the_budget_go_through(self):
+        guard, Guarded = self.guard()
+        self.assertEqual(Guarded(3, 1000).collect(), [0, 1, 2])
+        self.assertEqual(guard.refused, 0)
+
+    def test_calls_over_the_budget_fail(self):
+        guard, Guarded = self.guard()
+        self.assertRaises(MemoryError, Guarded(3, 1001).collect)
+        self.assertRaises(MemoryError, Guarded(3, 1001).toPandas)
+        self.assertEqual(guard.refused, 2)
+
+    def test_calls_without_an_estimate_go_through(self):
+        # joins and DataFrames created from python data, which spark only guesses the size of
+        guard, Guarded = self.guard()
+        self.assertEqual(Guarded(3, None).collect(), [0, 1, 2])
+        self.assertEqual(Guarded(3, None).toPandas(), [0, 1, 2])
+        self.assertEqual((guard.refused, guard.unestimated), (0, 2))
+
+    def test_collects_over_the_budget_spill(self):
+        guard, Guarded = self.guard('spill')
+        self.assertEqual(list(Guarded(3, 1001).collect()), [0, 1, 2])
+        self.assertRaises(MemoryError, Guarded(3, 1001).toPandas)
+        self.assertEqual((guard.spilled, guard.refused), (1, 1))
+
+    def test_unknown_modes_are_rejected(self):
+        self.assertRaises(ValueError, DriverGuard, 1000, 'ignore', None, None)
+
+
+class ConcurrentBatchesTests(unittest.TestCase):
+
+    def test_independent_jobs_share_a_batch(self):
+        nodes = statements("""
+            a = left.count()
+            b = right.count()
+            c = other.collect()
+        """)
+        self.assertEqual(concurrent_batches(nodes), [[0, 1, 2]])
+
+    def test_jobs_reading_names_assigned_in_the_batch_run_after_it(self):
+        nodes = statements("""
+            a = left.count()
+            b = right.filter(right.x > a).count()
+        """)
+        self.assertEqual(concurrent_batches(nodes), [[0], [1]])
+
+    def test_jobs_changing_names_another_job_reads_run_apart(self):
+        nodes = statements("""
+            a = left.count()
+            left.y = 1
+            b = left.count()
+            c = right.count()
+        """)
+        self.assertEqual(concurrent_batches(nodes), [[0], [1], [2, 3]])
+
+    def test_writes_run_on_their_own(self):
+        # the read of the path written before shows in no name
+        nodes = statements("""
+            n = df.count()
+            df.write.parquet('/tmp/out')
+            m = spark.read.parquet('/tmp/out').count()
+            events.rdd.saveAsTextFile('/tmp/events')
+            k = other.count()
+        """)
+        self.assertEqual(concurrent_batches(nodes), [[0], [1], [2], [3], [4]])
+
+    def test_statements_running_no_job_run_on_their_own(self):
+        nodes = statements("""
+            a = left.count()
+            df = left.filter('x > 1')
+            b = right.count()
+            c = other.count()
+        """)
+        self.assertEqual(concurrent_batches(nodes), [[0], [1], [2, 3]])
+
+    def test_calls_to_functions_of_the_action_run_on_their_own(self):
+        nodes = statements("""
+            def total(df):
+                return df.count()
+            a = left.count()
+            b = total(right)
+            c = len(other.collect())
+        """)
+        self.assertEqual(concurrent_batches(nodes), [[0], [1], [2], [3]])
+
+    def test_statements_failing_to_compile_run_on_their_own(self):
+        nodes = statements("""
+            a = left.count()
+            b = right.count()
+        """)
+        self.assertEqual(concurrent_batches(nodes, errors=(1,)), [[0], [1]])
+
+
+class StatementTracerTests(unittest.TestCase):
+
+    def trace(self, source, namespace=None, starts=None):
+        source = textwrap.dedent(source)
+        events = []
+        tracer = StatementTracer(starts or [first_line(node) for node in statements(source)],
+                                 lambda index: events.append(('success', index)),
+                                 lambda index: events.append(('start', index)))
+        try:
+            tracer.run(compile(source, '<action>', 'exec'), namespace if namespace is not None else {})
+        except ZeroDivisionError:
+            events.append(('error', tracer.failed_index()))
+        return events
+
+    def test_statements_are_started_before_they_succeed(self):
+        events = self.trace("""
+            a = 1
+            b = a + 1
+        """)
+        self.assertEqual(events, [('start', 0), ('success', 0), ('start', 1), ('success', 1)])
+
+    def test_statements_without_line_events_are_started_too(self):
+        # python 2 compiles constant expressions to no code, the blank line stands in for one
+        events = self.trace("""
+            a = 1
+
+            b = a + 1
+        """, starts=[2, 3, 4])
+        self.assertEqual(events, [('start', 0), ('success', 0), ('start', 1), ('success', 1),
+                                  ('start', 2), ('success', 2)])
+
+    def test_leading_and_trailing_statements_without_line_events_are_started(self):
+        events = self.trace("""
+            a = 1
+
+        """, starts=[1, 2, 3])
+        self.assertEqual(events, [('start', 0), ('success', 0), ('start', 1), ('success', 1),
+                                  ('start', 2), ('success', 2)])
+
+    def test_statements_spanning_lines_map_to_one_statement(self):
+        namespace = {}
+        events = self.trace("""
+            a = [1,
+                 2]
+            for n in a:
+                b = n
+        """, namespace)
+        self.assertEqual(events, [('start', 0), ('success', 0), ('start', 1), ('success', 1)])
+        self.assertEqual(namespace['b'], 2)
+
+    def test_a_failing_statement_is_started_and_reported(self):
+        events = self.trace("""
+            a = 1
+            b = a / 0
+            c = 2
+        """)
+        self.assertEqual(events, [('start', 0), ('success', 0), ('start', 1), ('error', 1)])
+
+
+class RecordingQueue(object):
+    # stands in for the JVM ResultQueue
+    def __init__(self):
+        self.sent = []
+
+    def put(self, result_type, action, statement, message):
+        self.sent.append([[result_type, action, statement, message]])
+
+    def putAll(self, results):
+        import json
+        self.sent.append(json.loads(results))
+
+
+class BytecodeCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_compiled_actions_are_read_back(self):
+        source = 'a = 1\nb = a + 1\n'
+        first = BytecodeCache(self.dir).compile(source, whole=True)
+        cache = BytecodeCache(self.dir)
+        second = cache.compile(source, whole=True)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual([s.to_tuple() for s in second.statements], [s.to_tuple() for s in first.statements])
+        namespace = {}
+        exec(second.codes[0], namespace)
+        self.assertEqual(namespace['b'], 2)
+
+    def test_concurrent_stores_of_an_entry_leave_one_complete_file(self):
+        source = '\n'.join('x%d = %d' % (n, n) for n in range(200))
+        errors = []
+
+        def compile_action():
+            try:
+                BytecodeCache(self.dir).compile(source)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=compile_action) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+        cache = BytecodeCache(self.dir)
+        self.assertEqual(len(cache.compile(source).statements), 200)
+        self.assertEqual(cache.hits, 1)
+
+
+class ResultBufferTests(unittest.TestCase):
+
+    def buffer(self, max_size, max_wait=60.0):
+        queue = RecordingQueue()
+        buffer = ResultBuffer(queue, max_size, max_wait)
+        self.addCleanup(buffer.close)
+        return queue, buffer
+
+    def test_successes_are_sent_once_max_size_accumulated(self):
+        queue, buffer = self.buffer(3)
+        buffer.put('success', 'start', 'a = 1', '')
+        buffer.put('success', 'start', 'b = 2', '')
+        self.assertEqual(queue.sent, [])
+        buffer.put('success', 'start', 'c = 3', '')
+        self.assertEqual([len(batch) for batch in queue.sent], [3])
+
+    def test_errors_are_sent_at_once_with_the_pending_successes(self):
+        queue, buffer = self.buffer(100)
+        buffer.put('success', 'start', 'a = 1', '')
+        buffer.put('error', 'start', 'b = a / 0', 'division by zero')
+        self.assertEqual(queue.sent, [[['success', 'start', 'a = 1', ''],
+                                       ['error', 'start', 'b = a / 0', 'division by zero']]])
+
+    def test_a_single_result_is_sent_on_its_own(self):
+        queue, buffer = self.buffer(100)
+        buffer.put('success', 'start', 'a = 1', '')
+        buffer.flush()
+        buffer.flush()
+        self.assertEqual(queue.sent, [[['success', 'start', 'a = 1', '']]])
+
+    def test_results_waiting_for_max_wait_are_sent(self):
+        queue, buffer = self.buffer(100, max_wait=0.05)
+        buffer.put('success', 'start', 'a = 1', '')
+        deadline = time.time() + 5
+        while not queue.sent and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(queue.sent, [[['success', 'start', 'a = 1', '']]])
+
+    def test_results_are_not_buffered_for_a_max_size_of_one(self):
+        queue, buffer = self.buffer(1)
+        buffer.put('success', 'start', 'a = 1', '')
+        buffer.put('success', 'start', 'b = 2', '')
+        self.assertEqual(len(queue.sent), 2)
+
+    def test_closing_sends_what_is_pending(self):
+        queue, buffer = self.buffer(100)
+        buffer.put('success', 'start', 'a = 1', '')
+        buffer.close()
+        self.assertEqual(len(queue.sent), 1)
+
+
+class PersistedFrame(object):
+    # stands in for a pyspark DataFrame recording what was persisted
+    def __init__(self):
+        self.is_cached = False
+        self.level = None
+
+    def persist(self, level):
+        self.is_cached = True
+        self.level = level
+
+    def unpersist(self):
+        self.is_cached = False
+
+
+class PersistencePlanTests(unittest.TestCase):
+
+    def run_plan(self, plan, count, namespace):
+        for index in range(count):
+            plan.after(index, namespace, lambda value: isinstance(value, PersistedFrame), 'MEMORY_AND_DISK')
+
+    def test_names_read_by_two_jobs_are_persisted_until_the_last(self):
+        nodes = statements("""
+            df = spark.read.parquet('/in').filter('a > 1')
+            a = df.count()
+            b = df.collect()
+            c = other.count()
+        """)
+        plan = PersistencePlan(nodes, {})
+        self.assertEqual((plan.persist, plan.unpersist), ({0: [('df', 0)]}, {2: [('df', 0)]}))
+
+        df = PersistedFrame()
+        plan.after(0, {'df': df}, lambda value: isinstance(value, PersistedFrame), 'MEMORY_AND_DISK')
+        self.assertEqual((df.is_cached, df.level), (True, 'MEMORY_AND_DISK'))
+        self.run_plan(plan, 4, {'df': df})
+        self.assertFalse(df.is_cached)
+        self.assertIn('df of line 2 persisted for the jobs of lines 3, 4', plan.report())
+
+    def test_names_read_by_a_single_job_are_not_persisted(self):
+        nodes = statements("""
+            df = spark.read.parquet('/in')
+            a = df.count()
+            other = spark.read.parquet('/other')
+        """)
+        plan = PersistencePlan(nodes, {})
+        self.assertEqual((plan.persist, plan.unpersist), ({}, {}))
+
+    def test_names_the_action_persists_itself_are_left_alone(self):
+        nodes = statements("""
+            df = spark.read.parquet('/in')
+            df.cache()
+            a = df.count()
+            b = df.collect()
+        """)
+        self.assertEqual(PersistencePlan(nodes, {}).persist, {})
+
+    def test_names_read_by_an_export_are_released_with_the_action(self):
+        nodes = statements("""
+            df = spark.read.parquet('/in').filter('a > 1')
+            a = df.count()
+            out = df.select('a')
+        """)
+        plan = PersistencePlan(nodes, {'out': 'parquet'})
+        self.assertEqual((plan.persist, plan.unpersist, plan.deferred), ({0: [('df', 0)]}, {}, set([('df', 0)])))
+
+        df = PersistedFrame()
+        self.run_plan(plan, 3, {'df': df})
+        self.assertTrue(df.is_cached)
+        plan.release()
+        self.assertFalse(df.is_cached)
+
+
+class ExportSpecTests(unittest.TestCase):
+
+    def test_a_format_alone_is_overwritten(self):
+        spec = ExportSpec('parquet')
+        self.assertEqual((spec.format, spec.mode, spec.append, spec.partition_by, spec.sample, spec.sample_by),
+                         ('parquet', 'overwrite', False, [], 0, None))
+
+    def test_options_follow_the_format(self):
+        spec = ExportSpec(' parquet ; mode = append; partitionBy=day, hour; sample=1000; sampleBy=kind')
+        self.assertEqual((spec.format, spec.append, spec.partition_by, spec.sample, spec.sample_by),
+                         ('parquet', True, ['day', 'hour'], 1000, 'kind'))
+
+    def test_invalid_options_are_rejected(self):
+        for value in ('parquet; mode=merge', 'parquet; sample=many', 'parquet; compression=snappy', 'parquet; sampleBy='):
+            self.assertRaises(ValueError, ExportSpec, value)
+
+    def test_partitioned_exports_must_be_appended(self):
+        self.assertRaises(ValueError, ExportSpec, 'parquet; partitionBy=day')
+
+    def test_local_exports_take_no_options(self):
+        self.assertTrue(ExportSpec('npy').local)
+        self.assertRaises(ValueError, ExportSpec, 'arrow; mode=append')
+        self.assertRaises(ValueError, ExportSpec, 'npy; sample=10')
+
+    def test_describe_shows_the_equivalent_write(self):
+        self.assertEqual(ExportSpec('parquet; mode=append; partitionBy=day').describe('df', '/out'),
+                         'df.write.save("/out", format="parquet", mode=\'append\', partitionBy=[\'day\'])')
+        self.assertEqual(ExportSpec('npy').describe('arr', '/out'), 'numpy.save("/out/array.npy", arr)')
+
+
+class SpillRowsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_rows_within_the_budget_are_a_list(self):
+        rows = spill_rows(iter(range(35)), 1 << 20, self.dir, chunk_rows=10)
+        self.assertEqual(rows, list(range(35)))
+
+    def test_rows_over_the_budget_are_spilled(self):
+        rows = spill_rows(iter(range(35)), 1, self.dir, chunk_rows=10)
+        self.assertIsInstance(rows, SpilledRows)
+        self.addCleanup(rows.spill.close)
+        self.assertEqual(rows.head, list(range(10)))
+        self.assertEqual(len(rows), 35)
+        self.assertEqual(list(rows), list(range(35)))
+        self.assertEqual((rows[0], rows[9], rows[10], rows[34], rows[-1]), (0, 9, 10, 34, 34))
+        self.assertEqual(rows[8:13], [8, 9, 10, 11, 12])
+        self.assertEqual(rows[::-10], [34, 24, 14, 4])
+        self.assertRaises(IndexError, lambda: rows[35])
+
+    def test_no_rows_are_an_empty_list(self):
+        self.assertEqual(spill_rows(iter([]), 1, self.dir), [])
+
+
+class ImportProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'profiled_outer.py'), 'w') as f:
+            f.write('import profiled_inner\n')
+        with open(os.path.join(self.dir, 'profiled_inner.py'), 'w') as f:
+            f.write('VALUE = 1\n')
+        sys.path.insert(0, self.dir)
+
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        for name in ('profiled_outer', 'profiled_inner'):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.dir)
+
+    def test_records_the_imports_nested_in_an_import(self):
+        profiler = ImportProfiler()
+        profiler.install()
+        try:
+            import profiled_outer
+        finally:
+            profiler.uninstall()
+
+        self.assertEqual([(depth, name) for depth, name, own, cumulative in profiler.entries],
+                         [(1, 'profiled_inner'), (0, 'profiled_outer')])
+        self.assertIn('  profiled_inner', profiler.report(threshold=0))
+        self.assertTrue(profiler.slowest().startswith('profiled_outer'))
+
+    def test_imports_of_loaded_modules_are_not_recorded(self):
+        profiler = ImportProfiler()
+        profiler.install()
+        try:
+            import json
+        finally:
+            profiler.uninstall()
+
+        self.assertEqual(profiler.entries, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
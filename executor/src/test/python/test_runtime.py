@@ -0,0 +1,170 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'main', 'resources'))
+
+from runtime import AmaContext, Environment
+
+try:
+    import pandas
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+
+class FakeSession(object):
+    _jsparkSession = None
+
+
+class FakeIncrementalExports(object):
+    # reads the partition manifest as the JVM's IncrementalExports.readJson does
+    def readJson(self, session, path):
+        manifest = os.path.join(path, '_amaterasu_partitions.json')
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest) as f:
+            return f.read()
+
+
+class LocalAmaContext(AmaContext):
+
+    def _incremental(self):
+        return FakeIncrementalExports()
+
+    def get_manifest(self, action_name, dataset_name):
+        return None
+
+
+@unittest.skipIf(pyarrow is None, 'pandas and pyarrow are not installed')
+class IncrementalPandasTests(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        export = os.path.join(self.working_dir, 'incremental', 'pipeline', 'start', 'events')
+        schema = {'type': 'struct', 'fields': [
+            {'name': 'value', 'type': 'string', 'nullable': True, 'metadata': {}},
+            {'name': 'day', 'type': 'integer', 'nullable': True, 'metadata': {}}]}
+        commits = []
+        for marker, day in ((1, 1), (2, 2)):
+            os.makedirs(os.path.join(export, 'day=%d' % day))
+            name = 'day=%d/part-%d.parquet' % (day, marker)
+            table = pyarrow.Table.from_pydict({'value': ['a%d' % day, 'b%d' % day]})
+            pq.write_table(table, os.path.join(export, name))
+            commits.append({'marker': marker, 'jobId': 'job', 'timestamp': 0, 'partitions': ['day=%d' % day], 'files': [name]})
+        # written by a failed run, never committed
+        pq.write_table(pyarrow.Table.from_pydict({'value': ['x']}), os.path.join(export, 'day=2', 'part-3.parquet'))
+        with open(os.path.join(export, '_amaterasu_partitions.json'), 'w') as f:
+            json.dump({'format': 'parquet', 'partitionBy': ['day'], 'schema': json.dumps(schema), 'commits': commits}, f)
+
+        env = Environment('test', 'local', None, None, self.working_dir, {}, 'pipeline')
+        self.context = LocalAmaContext(None, FakeSession(), 'job', env)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def test_reads_the_committed_files_with_their_partition_columns(self):
+        df = self.context.get_pandas('start', 'events')
+        self.assertEqual(list(df.columns), ['value', 'day'])
+        self.assertEqual(sorted(zip(df['value'], df['day'])), [('a1', 1), ('a2', 2), ('b1', 1), ('b2', 2)])
+        self.assertEqual(str(df['day'].dtype), 'int32')
+
+    def test_reads_the_partitions_committed_since_a_marker(self):
+        df = self.context.get_pandas('start', 'events', since=1)
+        self.assertEqual(sorted(df['value']), ['a2', 'b2'])
+
+    def test_reads_the_requested_columns(self):
+        df = self.context.get_pandas('start', 'events', columns=['day'])
+        self.assertEqual(list(df.columns), ['day'])
+        self.assertEqual(sorted(df['day']), [1, 1, 2, 2])
+
+    def test_since_requires_an_export_in_append_mode(self):
+        self.assertRaises(ValueError, self.context.get_pandas, 'start', 'other', since=1)
+
+
+class FakeJvmDataFrames(object):
+    # counts invalidations per export as the JVM's DataFrameCache does
+    def __init__(self):
+        self.generations = {}
+
+    def invalidate(self, action_name, dataset_name):
+        key = (action_name, dataset_name)
+        self.generations[key] = self.generations.get(key, 0) + 1
+
+    def generation(self, action_name, dataset_name):
+        return self.generations.get((action_name, dataset_name), 0)
+
+
+class FakeSparkContext(object):
+
+    def broadcast(self, value):
+        return FakeBroadcast(value)
+
+
+class FakeBroadcast(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def unpersist(self):
+        pass
+
+
+class FakeRows(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def select(self, *columns):
+        return self
+
+    def collect(self):
+        return self.rows
+
+
+class SharedExportContext(AmaContext):
+    # reads exports from a dict, written by the tests as scala actions would
+    def __init__(self, env):
+        super(SharedExportContext, self).__init__(FakeSparkContext(), FakeSession(), 'job', env)
+        self.jvm_dataframes = FakeJvmDataFrames()
+        self.exports = {}
+
+    def get_dataframe(self, action_name, dataset_name, format="parquet", **kwargs):
+        return FakeRows(self.exports[(action_name, dataset_name)])
+
+    def _jvm_dataframes(self):
+        return self.jvm_dataframes
+
+
+class GenerationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.context = SharedExportContext(Environment('test', 'local', None, None, '/tmp', {}, 'pipeline'))
+        self.context.exports[('start', 'lookup')] = [('a', 1)]
+
+    def test_exports_written_again_by_scala_actions_are_read_again(self):
+        self.assertEqual(self.context.get_broadcast('start', 'lookup', 'k', 'v').value, {'a': 1})
+
+        # a scala action writes the export again and invalidates the JVM's cache only
+        self.context.exports[('start', 'lookup')] = [('a', 2)]
+        self.context.jvm_dataframes.invalidate('start', 'lookup')
+        self.assertEqual(self.context.get_broadcast('start', 'lookup', 'k', 'v').value, {'a': 2})
+        self.assertEqual(self.context.broadcasts.misses, 2)
+
+    def test_python_exports_invalidate_the_jvm_cache(self):
+        self.context.get_broadcast('start', 'lookup', 'k', 'v')
+        self.context.invalidate('start', 'lookup')
+        self.assertEqual(self.context.jvm_dataframes.generation('start', 'lookup'), 1)
+
+        # and are not dropped again for the invalidation they counted
+        self.context.get_broadcast('start', 'lookup', 'k', 'v')
+        self.context.get_broadcast('start', 'lookup', 'k', 'v')
+        self.assertEqual((self.context.broadcasts.hits, self.context.broadcasts.misses), (1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
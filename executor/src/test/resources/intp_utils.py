@@ -0,0 +1,1041 @@
+import ast
+import bisect
+import errno
+import functools
+import gc
+import hashlib
+import io
+import itertools
+import json
+import marshal
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+
+
+def first_line(node):
+    # decorators are evaluated before the line of the def/class itself
+    lines = [node.lineno] + [d.lineno for d in getattr(node, 'decorator_list', [])]
+    return min(lines)
+
+
+class Statement(object):
+    """
+    The position and export target of a top level statement. It is kept apart from the
+    ast so that compiled actions can be cached without it.
+    """
+
+    def __init__(self, start_line, start_col, end_line, end_col, target):
+        self.start_line = start_line
+        self.start_col = start_col
+        self.end_line = end_line
+        self.end_col = end_col
+        self.target = target
+
+    def to_tuple(self):
+        return self.start_line, self.start_col, self.end_line, self.end_col, self.target
+
+
+def describe_statements(nodes, line_count):
+    starts = []
+    for node in nodes:
+        line = first_line(node)
+        starts.append((line, node.col_offset if line == node.lineno else 0))
+
+    statements = []
+    for index, node in enumerate(nodes):
+        if getattr(node, 'end_lineno', None) is not None:
+            end_line, end_col = node.end_lineno, node.end_col_offset
+        elif index + 1 < len(nodes):
+            end_line, end_col = starts[index + 1]
+        else:
+            end_line, end_col = line_count, None
+
+        # assignments to a single name are candidates for exports
+        target = None
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+            target = node.targets[0].id
+
+        statements.append(Statement(starts[index][0], starts[index][1], end_line, end_col, target))
+    return statements
+
+
+class CompiledAction(object):
+    """
+    The code objects of an action, either one per top level statement or a single one
+    for the whole action. errors holds the compilation errors of statements that could
+    not be compiled on their own, nodes the ast when the action was not loaded from cache.
+    """
+
+    def __init__(self, whole, statements, codes, errors=None, nodes=None):
+        self.whole = whole
+        self.statements = statements
+        self.codes = codes
+        self.errors = errors or {}
+        self.nodes = nodes
+
+    def to_marshal(self):
+        return self.whole, [s.to_tuple() for s in self.statements], self.codes
+
+    @staticmethod
+    def from_marshal(data):
+        whole, statements, codes = data
+        return CompiledAction(whole, [Statement(*s) for s in statements], codes)
+
+
+def compile_action(source, whole=False):
+    tree = ast.parse(source)
+    statements = describe_statements(tree.body, len(source.splitlines()))
+
+    if whole and tree.body:
+        return CompiledAction(True, statements, [compile(tree, "<ast>", 'exec')], nodes=tree.body)
+
+    codes = []
+    errors = {}
+    for index, node in enumerate(tree.body):
+        try:
+            codes.append(compile(ast.Module(body=[node], type_ignores=[]), "<ast>", 'exec'))
+        except SyntaxError:
+            codes.append(None)
+            errors[index] = str(sys.exc_info()[1])
+    return CompiledAction(False, statements, codes, errors, tree.body)
+
+
+class StartupTimer(object):
+    """
+    Times the startup phases of the interpreter, which are reported to the JVM together
+    with the interpreter's ready signal.
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = []
+
+    def phase(self, name):
+        now = time.time()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        return 'started in %.3fs (%s)' % (
+            self.last - self.started, ', '.join('%s %.3fs' % phase for phase in self.phases))
+
+
+class LazyJavaImports(object):
+    """
+    Defers py4j java imports of rarely used JVM packages until the python package that
+    needs them is first imported. It sits on sys.meta_path only to be told about imports
+    and never loads a module itself.
+    """
+
+    def __init__(self, java_import, imports):
+        self.java_import = java_import
+        self.pending = dict(imports)
+        self.lock = threading.Lock()
+
+    def install(self):
+        for name in list(sys.modules):
+            self._trigger(name)
+        sys.meta_path.insert(0, self)
+
+    def find_module(self, fullname, path=None):
+        self._trigger(fullname)
+        return None
+
+    def find_spec(self, fullname, path=None, target=None):
+        self._trigger(fullname)
+        return None
+
+    def _trigger(self, fullname):
+        with self.lock:
+            packages = [p for p in self.pending if fullname == p or fullname.startswith(p + '.')]
+            for package in packages:
+                for java_package in self.pending.pop(package):
+                    self.java_import(java_package)
+
+
+class ActionRun(object):
+    """
+    The state of a single action while it executes in the interpreter.
+    """
+
+    def __init__(self, name, source, exports, results, writer, namespace):
+        self.name = name
+        self.source = source
+        self.exports = exports
+        self.results = results
+        self.writer = writer
+        self.namespace = namespace
+        self.compiled = None
+        self.renderer = None
+        self.profiler = None
+        self.persistence = None
+        self.batches = None
+        self.assigned = None
+        self.completion = []
+
+
+class BytecodeCache(object):
+    """
+    A content addressed, on-disk cache of compiled actions. Entries are keyed by a hash of
+    the action source, the compile mode and the interpreter version, and hold the
+    marshalled code objects so that a hit skips both parsing and compiling.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, source, whole=False):
+        path = os.path.join(self.directory, self._key(source, whole))
+        try:
+            with open(path, 'rb') as cached:
+                compiled = CompiledAction.from_marshal(marshal.load(cached))
+            self.hits += 1
+            return compiled
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            self.misses += 1
+
+        compiled = compile_action(source, whole)
+        if not compiled.errors:
+            self._store(path, compiled)
+        return compiled
+
+    def report(self):
+        return 'bytecode cache hits: %d, misses: %d' % (self.hits, self.misses)
+
+    def _key(self, source, whole):
+        digest = hashlib.sha1()
+        digest.update(_encode(sys.version))
+        digest.update(_encode('%d:%s' % (marshal.version, 'action' if whole else 'statement')))
+        digest.update(_encode(source))
+        return digest.hexdigest()
+
+    def _store(self, path, compiled):
+        # written to a temporary file first so concurrent readers never see partial entries,
+        # the file is unique so that concurrent actions storing the same entry do not collide
+        temp = None
+        try:
+            try:
+                os.makedirs(self.directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            descriptor, temp = tempfile.mkstemp(dir=self.directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+            with os.fdopen(descriptor, 'wb') as entry:
+                marshal.dump(compiled.to_marshal(), entry)
+            os.rename(temp, path)
+        except (IOError, OSError):
+            # the cache is an optimisation only, failing to write it must not fail the action
+            if temp is not None and os.path.exists(temp):
+                os.remove(temp)
+
+
+class StatementRenderer(object):
+    """
+    Produces the source text of an action's top level statements for result messages.
+    The text is sliced out of the original action source using the statements' positions,
+    the codegen SourceGenerator is only used as a fallback. Nothing is rendered when
+    disabled, i.e. when the leader does not report at code level.
+    """
+
+    def __init__(self, source, statements, nodes=None, enabled=True):
+        self.source = source
+        self.statements = statements
+        self.nodes = nodes
+        self.enabled = enabled
+        self._lines = None
+
+    def render(self, index):
+        if not self.enabled:
+            return ''
+        try:
+            return self._slice(index)
+        except Exception:
+            if self.nodes is None:
+                return ''
+            try:
+                # imported on first use, slicing rarely fails
+                import codegen
+                return codegen.to_source(self.nodes[index])
+            except Exception:
+                return ''
+
+    def _slice(self, index):
+        if self._lines is None:
+            self._lines = self.source.splitlines()
+
+        statement = self.statements[index]
+
+        # column offsets are byte offsets into the utf-8 encoded line
+        lines = [_encode(line) for line in self._lines[statement.start_line - 1:statement.end_line]]
+        if statement.end_col is not None:
+            lines[-1] = lines[-1][:statement.end_col]
+        lines[0] = lines[0][statement.start_col:]
+
+        # without end positions the gap up to the next statement may hold comments
+        while lines and (not lines[-1].strip() or lines[-1].strip().startswith(b'#')):
+            lines.pop()
+        if not lines:
+            raise ValueError('no source found for statement %d' % index)
+        return _decode(b'\n'.join(lines).strip().rstrip(b';').rstrip())
+
+
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+def _decode(text):
+    return text if isinstance(text, str) else text.decode('utf-8')
+
+
+class StatementTracer(object):
+    """
+    Executes a whole action as a single code object and maps line events of the
+    action's top level frame back to its top level statements, calling on_success
+    with the index of every statement once execution moved past it and on_start with
+    the index of every statement execution reached.
+    """
+
+    def __init__(self, starts, on_success, on_start=None):
+        self.starts = starts
+        self.on_success = on_success
+        self.on_start = on_start
+        self.current = -1
+        self.code = None
+
+    def run(self, code, namespace):
+        self.code = code
+        previous = sys.gettrace()
+        sys.settrace(self._global_trace)
+        try:
+            exec(code, namespace)
+        finally:
+            sys.settrace(previous)
+        self._advance(len(self.starts))
+
+    def failed_index(self):
+        return max(self.current, 0)
+
+    def _global_trace(self, frame, event, arg):
+        # only the action's own frame is traced, calls into functions run untraced
+        if frame.f_code is self.code:
+            return self._local_trace
+        return None
+
+    def _local_trace(self, frame, event, arg):
+        if event == 'line':
+            index = bisect.bisect_right(self.starts, frame.f_lineno) - 1
+            if index > self.current:
+                self._advance(index)
+        return self._local_trace
+
+    def _advance(self, index):
+        # statements that never produced a line event (e.g. constant expressions)
+        # are started and completed together with the statement preceding them
+        for done in range(max(self.current, 0), index):
+            if done > self.current:
+                self._start(done)
+            self.on_success(done)
+        self.current = index
+        if index < len(self.starts):
+            self._start(index)
+
+    def _start(self, index):
+        if self.on_start is not None:
+            self.on_start(index)
+
+
+class ResultBuffer(object):
+    """
+    Buffers interpreter results and sends them to the JVM ResultQueue in bulk. Pending
+    results are flushed once max_size of them accumulated or the oldest one waited for
+    max_wait seconds, errors and completions are flushed immediately.
+    """
+
+    def __init__(self, result_queue, max_size=100, max_wait=1.0):
+        self.result_queue = result_queue
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.oldest = None
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        if max_size > 1:
+            flusher = threading.Thread(target=self._flush_periodically)
+            flusher.daemon = True
+            flusher.start()
+
+    def put(self, result_type, action, statement, message):
+        with self.lock:
+            self.pending.append([result_type, action, statement, message])
+            if self.oldest is None:
+                self.oldest = time.time()
+            if result_type != 'success' or len(self.pending) >= self.max_size:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        self.closed.set()
+
+    def _flush(self):
+        if len(self.pending) == 1:
+            self.result_queue.put(*self.pending[0])
+        elif self.pending:
+            self.result_queue.putAll(json.dumps(self.pending))
+        self.pending = []
+        self.oldest = None
+
+    def _flush_periodically(self):
+        # makes sure results of statements preceding a long running one are not held back
+        while not self.closed.wait(self.max_wait):
+            with self.lock:
+                if self.oldest is not None and time.time() - self.oldest >= self.max_wait:
+                    self._flush()
+
+
+def process_memory():
+    """
+    The resident set size of the interpreter process in bytes, None where it is unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def release_namespace(namespace, shared, keep=()):
+    """
+    Releases the names an action bound in its namespace, keeping only the ones bound to the
+    same value in the shared namespace, i.e. the interpreter's globals and the names that
+    survive the action. Datasets the action cached are unpersisted and garbage collected,
+    unless they are in keep. Returns the number of unpersisted datasets.
+    """
+    surviving = set(id(value) for value in list(shared.values()) + list(keep))
+    unpersisted = 0
+    for name in [n for n in namespace if n not in shared or namespace[n] is not shared[n]]:
+        value = namespace.pop(name)
+        if id(value) not in surviving and getattr(value, 'is_cached', False):
+            try:
+                value.unpersist()
+                unpersisted += 1
+            except Exception:
+                pass
+    value = None
+    gc.collect()
+    return unpersisted
+
+
+def memory_report(at_start, at_end, released, survivors, unpersisted):
+    if None in (at_start, at_end, released):
+        return 'memory: unavailable, %d names kept, %d cached datasets unpersisted' % (survivors, unpersisted)
+    mb = 1024.0 * 1024.0
+    return 'memory: %.1f MB at start, %.1f MB at end, %.1f MB after release (%.1f MB reclaimed), ' \
+           '%d names kept, %d cached datasets unpersisted' % (
+               at_start / mb, at_end / mb, released / mb, (at_end - released) / mb, survivors, unpersisted)
+
+
+# DataFrame and RDD methods that run a Spark job
+_JOB_METHODS = frozenset([
+    'collect', 'count', 'countByKey', 'countByValue', 'first', 'foreach', 'foreachPartition', 'head',
+    'reduce', 'saveAsTextFile', 'show', 'take', 'takeOrdered', 'toLocalIterator', 'toPandas'])
+
+# DataFrameWriter methods, which run a Spark job when called on a DataFrame's write
+_WRITE_METHODS = frozenset(['csv', 'insertInto', 'jdbc', 'json', 'orc', 'parquet', 'save', 'saveAsTable', 'text'])
+
+
+def _scope_walk(node):
+    # the nodes of a statement, leaving out the bodies of the functions and classes it defines
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        yield current
+        for child in ast.iter_child_nodes(current):
+            if not isinstance(child, (ast.FunctionDef, ast.ClassDef, ast.Lambda)):
+                pending.append(child)
+
+
+def _attribute_names(node):
+    names = []
+    while isinstance(node, (ast.Attribute, ast.Call, ast.Subscript)):
+        if isinstance(node, ast.Attribute):
+            names.append(node.attr)
+            node = node.value
+        elif isinstance(node, ast.Call):
+            node = node.func
+        else:
+            node = node.value
+    return names
+
+
+def runs_job(node):
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        # defining a function runs none of the jobs in its body
+        return False
+    for child in _scope_walk(node):
+        if isinstance(child, ast.Call) and isinstance(child.func, ast.Attribute):
+            if child.func.attr in _JOB_METHODS:
+                return True
+            if child.func.attr in _WRITE_METHODS and 'write' in _attribute_names(child.func.value):
+                return True
+    return False
+
+
+def writes_data(node):
+    # whether the statement writes to a path or a table, through a DataFrame's write or an RDD's saveAs methods
+    for child in _scope_walk(node):
+        if isinstance(child, ast.Call) and isinstance(child.func, ast.Attribute):
+            if child.func.attr in _WRITE_METHODS and 'write' in _attribute_names(child.func.value):
+                return True
+            if child.func.attr.startswith('saveAs'):
+                return True
+    return False
+
+
+def read_names(node):
+    return set(n.id for n in _scope_walk(node) if isinstance(n, ast.Name) and not isinstance(n.ctx, ast.Store))
+
+
+def bound_names(node):
+    names = set(n.id for n in _scope_walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store))
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        names.add(node.name)
+    return names
+
+
+def mutated_names(node):
+    # names changed in place, e.g. x.y = 1, x[0] = 1 or x.append(1) as a statement of its own
+    names = set()
+    for child in _scope_walk(node):
+        if isinstance(child, (ast.Attribute, ast.Subscript)) and isinstance(child.ctx, (ast.Store, ast.Del)):
+            root = child.value
+            while isinstance(root, (ast.Attribute, ast.Subscript, ast.Call)):
+                root = root.func if isinstance(root, ast.Call) else root.value
+            if isinstance(root, ast.Name):
+                names.add(root.id)
+    if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) \
+            and isinstance(node.value.func, ast.Attribute) and isinstance(node.value.func.value, ast.Name) \
+            and node.value.func.attr not in _JOB_METHODS:
+        names.add(node.value.func.value.id)
+    return names
+
+
+def concurrent_batches(nodes, errors=()):
+    """
+    Groups the top level statements of an action into batches to run one after another,
+    where the statements of a batch may run concurrently. Consecutive statements running
+    Spark jobs share a batch as long as none of them reads or changes a name another one
+    assigns or changes. Statements writing to a path or a table run on their own, as
+    other statements may read what they write, e.g. with spark.read, which names do not
+    show. Statements calling functions or classes the action defines may have effects the
+    analysis cannot see, so they run on their own too, as do all statements running no job.
+    """
+    batches = []
+    batch, reads, writes = [], set(), set()
+    defined = set()
+    for index, node in enumerate(nodes):
+        node_reads = read_names(node)
+        node_writes = bound_names(node) | mutated_names(node)
+        calls = set(child.func.id for child in _scope_walk(node)
+                    if isinstance(child, ast.Call) and isinstance(child.func, ast.Name))
+        candidate = index not in errors and runs_job(node) and not writes_data(node) and not calls & defined
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            defined.add(node.name)
+
+        if candidate and batch and not node_reads & writes and not node_writes & (reads | writes):
+            batch.append(index)
+            reads |= node_reads
+            writes |= node_writes
+            continue
+
+        if batch:
+            batches.append(batch)
+        if candidate:
+            batch, reads, writes = [index], node_reads, node_writes
+        else:
+            batches.append([index])
+            batch, reads, writes = [], set(), set()
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class PersistencePlan(object):
+    """
+    The DataFrames an action persists on its own, found by a liveness analysis of its top
+    level statements. A name assigned by a statement is persisted once assigned when two or
+    more of the following statements running Spark jobs depend on it, directly or through
+    names derived from it, and is unpersisted after the last of them. When that last
+    statement is an export, which is written in the background, the name is unpersisted
+    once the action completes instead.
+    """
+
+    def __init__(self, nodes, exports):
+        self.lines = [first_line(node) for node in nodes]
+        self.persist = {}
+        self.unpersist = {}
+        self.jobs = {}
+        self.deferred = set()
+        self.persisted = {}
+        self.decisions = []
+        self._analyse(nodes, exports)
+
+    def _analyse(self, nodes, exports):
+        # a binding is a name together with the index of the statement assigning it
+        bindings = {}
+        lineage = {}
+        exported = set()
+        cached = set()
+        uses = {}
+        for index, node in enumerate(nodes):
+            depends = set()
+            for name in read_names(node):
+                if name in bindings:
+                    depends |= lineage[bindings[name]]
+
+            # names the action persists itself
+            for child in _scope_walk(node):
+                if isinstance(child, ast.Call) and isinstance(child.func, ast.Attribute) \
+                        and child.func.attr in ('cache', 'persist') and isinstance(child.func.value, ast.Name) \
+                        and child.func.value.id in bindings:
+                    cached.add(bindings[child.func.value.id])
+
+            runs = runs_job(node)
+            for binding in depends if runs else ():
+                self.jobs[binding].append(index)
+            if runs:
+                uses[index] = depends
+
+            for name in bound_names(node):
+                binding = (name, index)
+                bindings[name] = binding
+                lineage[binding] = depends | set([binding])
+                self.jobs[binding] = []
+
+            target = node.targets[0].id if isinstance(node, ast.Assign) and len(node.targets) == 1 \
+                and isinstance(node.targets[0], ast.Name) else None
+            if target is not None and target in exports:
+                exported.add(index)
+                for binding in lineage[bindings[target]]:
+                    if index not in self.jobs[binding]:
+                        self.jobs[binding].append(index)
+                uses[index] = uses.get(index, set()) | lineage[bindings[target]]
+
+        # the latest bindings are decided first, as a job reading a persisted binding does not
+        # need the bindings it derives from to be persisted as well
+        chosen = []
+        for binding in sorted(self.jobs, key=lambda b: b[1], reverse=True):
+            name, index = binding
+            assigned = nodes[index]
+            # what a statement running a job assigns is its result rather than a DataFrame
+            lazy = isinstance(assigned, ast.Assign) and len(assigned.targets) == 1 \
+                and isinstance(assigned.targets[0], ast.Name) and not runs_job(assigned)
+            if binding in cached or not lazy:
+                continue
+            jobs = [job for job in self.jobs[binding]
+                    if not any(binding in lineage[other] and other in uses[job] for other in chosen)]
+            if len(jobs) < 2:
+                continue
+            chosen.append(binding)
+            self.jobs[binding] = jobs
+            self.persist.setdefault(index, []).append(binding)
+            if jobs[-1] in exported:
+                self.deferred.add(binding)
+            else:
+                self.unpersist.setdefault(jobs[-1], []).append(binding)
+
+    def after(self, index, namespace, is_dataframe, level):
+        # called once the statement at index completed
+        for binding in self.unpersist.get(index, []):
+            df = self.persisted.pop(binding, None)
+            if df is not None:
+                df.unpersist()
+
+        for binding in self.persist.get(index, []):
+            df = namespace.get(binding[0])
+            if is_dataframe(df) and not df.is_cached:
+                df.persist(level)
+                self.persisted[binding] = df
+                self.decisions.append(self._describe(binding))
+
+    def release(self):
+        # unpersists what is still persisted once the action completes
+        for df in self.persisted.values():
+            df.unpersist()
+        self.persisted = {}
+
+    def report(self):
+        return '\n'.join(self.decisions)
+
+    def _describe(self, binding):
+        name, index = binding
+        jobs = self.jobs[binding]
+        released = 'once the action completes' if binding in self.deferred else 'after line %d' % self.lines[jobs[-1]]
+        return 'auto persist: %s of line %d persisted for the jobs of lines %s, unpersisted %s' % (
+            name, self.lines[index], ', '.join(str(self.lines[job]) for job in jobs), released)
+
+
+class ExportSpec(object):
+    """
+    How an export is written, parsed from its entry in the action's exports map: a format,
+    optionally followed by options, e.g. 'parquet; mode=append; partitionBy=day; sample=1000'.
+    """
+
+    def __init__(self, value):
+        parts = [part.strip() for part in (value or '').split(';')]
+        self.format = parts[0]
+        self.mode = 'overwrite'
+        self.partition_by = []
+        self.sample = 0
+        self.sample_by = None
+        for option in [part for part in parts[1:] if part]:
+            key, _, setting = [item.strip() for item in option.partition('=')]
+            if key == 'mode' and setting in ('overwrite', 'append'):
+                self.mode = setting
+            elif key == 'partitionBy':
+                self.partition_by = [column.strip() for column in setting.split(',') if column.strip()]
+            elif key == 'sample' and setting.isdigit():
+                self.sample = int(setting)
+            elif key == 'sampleBy' and setting:
+                self.sample_by = setting
+            else:
+                raise ValueError('invalid export option %s in %s' % (option, value))
+        if self.local and (self.append or self.partition_by or self.sample):
+            raise ValueError('%s exports take no options, %s' % (self.format, value))
+        if self.partition_by and not self.append:
+            raise ValueError('partitionBy is only supported for exports in append mode, %s' % value)
+
+    @property
+    def append(self):
+        return self.mode == 'append'
+
+    @property
+    def local(self):
+        # numpy arrays as npy and pandas frames as arrow files, written without Spark
+        return self.format in ('npy', 'arrow')
+
+    def describe(self, name, path):
+        # the equivalent DataFrameWriter call, shown when writing the export fails
+        if self.format == 'npy':
+            return 'numpy.save("%s/array.npy", %s)' % (path, name)
+        if self.format == 'arrow':
+            return 'ama_context.put_pandas("%s", %s, format="arrow")' % (name, name)
+        options = ', partitionBy=%r' % self.partition_by if self.partition_by else ''
+        return '%s.write.save("%s", format="%s", mode=\'%s\'%s)' % (name, path, self.format, self.mode, options)
+
+
+def _megabytes(size):
+    return '%.1f MB' % (size / (1024.0 * 1024.0))
+
+
+class SpilledRows(object):
+    """
+    The rows of a collect that did not fit the driver budget. The first rows are kept in
+    memory and the rest are pickled to a temporary file in chunks, which are read back as
+    the rows are iterated. Supports len, iteration and indexing like the list collect
+    returns.
+    """
+
+    def __init__(self, head, spill, offsets, chunk_rows, count):
+        self.head = head
+        self.spill = spill
+        self.offsets = offsets
+        self.chunk_rows = chunk_rows
+        self.count = count
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for row in self.head:
+            yield row
+        for index in range(len(self.offsets)):
+            for row in self._chunk(index):
+                yield row
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            if step < 0:
+                return list(self)[index]
+            return list(itertools.islice(self, start, stop, step))
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('row index out of range')
+        if index < len(self.head):
+            return self.head[index]
+        chunk, offset = divmod(index - len(self.head), self.chunk_rows)
+        return self._chunk(chunk)[offset]
+
+    def _chunk(self, index):
+        with self.lock:
+            self.spill.seek(self.offsets[index])
+            return pickle.load(self.spill)
+
+
+def spill_rows(rows, budget, spill_dir, chunk_rows=1000):
+    """
+    Reads rows into a list as long as they fit the budget, judged by the pickled size of the
+    first chunk of rows, and into SpilledRows spilling the rest to spill_dir otherwise.
+    """
+    head = []
+    spill = None
+    offsets = []
+    count = 0
+    limit = None
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_rows))
+        if not chunk:
+            break
+        count += len(chunk)
+        if spill is None:
+            if limit is None:
+                row_size = max(1.0, len(pickle.dumps(chunk, 2)) / float(len(chunk)))
+                limit = max(chunk_rows, int(budget / row_size))
+            if len(head) + len(chunk) <= limit:
+                head.extend(chunk)
+                continue
+            spill = tempfile.TemporaryFile(dir=spill_dir, prefix='amaterasu-spill-')
+        offsets.append(spill.tell())
+        pickle.dump(chunk, spill, 2)
+
+    if spill is None:
+        return head
+    return SpilledRows(head, spill, offsets, chunk_rows, count)
+
+
+class DriverGuard(object):
+    """
+    Checks the calls materialising a DataFrame in the interpreter, collect and toPandas, and
+    take, head and first which collect, against a budget of bytes using an estimate of the
+    DataFrame's size. Calls on DataFrames without an estimate, e.g. joins, are let through.
+    Over budget, the 'fail' mode raises a MemoryError before anything is collected, and the
+    'spill' mode streams the rows of a collect a partition at a time, spilling what does not
+    fit the budget to disk (see SpilledRows). A pandas DataFrame cannot be spilled, so
+    toPandas fails over budget in both modes.
+    """
+
+    def __init__(self, budget, mode, estimate, spill_dir):
+        if mode not in ('fail', 'spill'):
+            raise ValueError('the driver budget mode is fail or spill, not %s' % mode)
+        self.budget = budget
+        self.mode = mode
+        self.estimate = estimate
+        self.spill_dir = spill_dir
+        self.local = threading.local()
+        self.refused = 0
+        self.spilled = 0
+        self.unestimated = 0
+
+    def install(self, dataframe_class):
+        guard = self
+        collect = dataframe_class.collect
+        to_pandas = dataframe_class.toPandas
+
+        @functools.wraps(collect)
+        def guarded_collect(df):
+            return guard.call(df, 'collect', collect,
+                              lambda: spill_rows(df.toLocalIterator(), guard.budget, guard.spill_dir))
+
+        @functools.wraps(to_pandas)
+        def guarded_to_pandas(df):
+            return guard.call(df, 'toPandas', to_pandas, None)
+
+        dataframe_class.collect = guarded_collect
+        dataframe_class.toPandas = guarded_to_pandas
+
+    def call(self, df, name, call, spill):
+        # calls made by a guarded call, e.g. collect by toPandas, were already checked
+        if getattr(self.local, 'active', False):
+            return call(df)
+        self.local.active = True
+        try:
+            estimate = self.estimate(df)
+            if estimate is None:
+                self.unestimated += 1
+                return call(df)
+            if estimate <= self.budget:
+                return call(df)
+            if self.mode == 'spill' and spill is not None:
+                self.spilled += 1
+                return spill()
+            self.refused += 1
+            raise MemoryError(
+                '%s of a DataFrame estimated at %s exceeds the driver budget of %s (pysparkDriverBudget), '
+                'export it or iterate over it with toLocalIterator instead' % (
+                    name, _megabytes(estimate), _megabytes(self.budget)))
+        finally:
+            self.local.active = False
+
+    def report(self):
+        return 'driver budget of %s: %d calls refused, %d collects spilled to disk, %d calls without an estimate' % (
+            _megabytes(self.budget), self.refused, self.spilled, self.unestimated)
+
+
+class ExportWriter(object):
+    """
+    Persists the exports of a single action. Given a function returning a thread pool,
+    exports are written in the background while the action carries on executing, and
+    wait() blocks until all of them are done, returning the description and error message
+    of every failed write. The pool is only asked for once the first export is written.
+    """
+
+    def __init__(self, write, pool=None):
+        self.write = write
+        self.pool = pool
+        self.pending = []
+
+    def submit(self, description, *args):
+        if self.pool is None:
+            self.write(*args)
+        else:
+            self.pending.append((description, self.pool().apply_async(self.write, args)))
+
+    def wait(self):
+        failures = []
+        for description, result in self.pending:
+            try:
+                result.get()
+            except Exception:
+                failures.append((description, str(sys.exc_info()[1])))
+        self.pending = []
+        return failures
+
+
+# per thread CPU time where the interpreter provides it, process CPU time otherwise
+_cpu_time = getattr(time, 'thread_time', None) or time.clock
+
+
+class CallCounter(object):
+    """
+    Counts the calls made through a py4j GatewayClient, separately for every thread.
+    """
+
+    def __init__(self, client):
+        self.local = threading.local()
+        send_command = client.send_command
+
+        def counting_send_command(*args, **kwargs):
+            self.local.count = getattr(self.local, 'count', 0) + 1
+            return send_command(*args, **kwargs)
+
+        client.send_command = counting_send_command
+
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+
+class StatementProfile(object):
+
+    def __init__(self, index, wall, cpu, calls):
+        self.index = index
+        self.wall = wall
+        self.cpu = cpu
+        self.calls = calls
+        self.jobs = []
+        self.stages = []
+
+    def summary(self):
+        return 'wall %.3fs, cpu %.3fs, py4j calls %d, jobs [%s], stages [%s]' % (
+            self.wall, self.cpu, self.calls, _ids(self.jobs), _ids(self.stages))
+
+
+def _ids(ids):
+    return ','.join(str(i) for i in ids)
+
+
+class StatementProfiler(object):
+    """
+    Records the wall time, CPU time, py4j calls and the Spark jobs and stages of every
+    statement of an action. Every statement runs in a Spark job group of its own, which
+    set_job_group sets and group_jobs resolves to (job id, stage ids) pairs once the
+    statement completed.
+    """
+
+    columns = ['index', 'line', 'wall_s', 'cpu_s', 'py4j_calls', 'jobs', 'stages', 'statement']
+
+    def __init__(self, action_name, call_count, set_job_group, group_jobs):
+        self.action_name = action_name
+        self.call_count = call_count
+        self.set_job_group = set_job_group
+        self.group_jobs = group_jobs
+        self.started = {}
+        self.profiles = []
+
+    def start(self, index):
+        self.set_job_group(self._group(index), 'amaterasu action %s statement %d' % (self.action_name, index))
+        self.started[index] = (time.time(), _cpu_time(), self.call_count())
+
+    def stop(self, index):
+        if index not in self.started:
+            return ''
+        wall, cpu, calls = self.started.pop(index)
+        profile = StatementProfile(index, time.time() - wall, _cpu_time() - cpu, self.call_count() - calls)
+        try:
+            for job, stages in self.group_jobs(self._group(index)):
+                profile.jobs.append(job)
+                profile.stages.extend(stages)
+        except Exception:
+            # jobs are reported on a best effort basis, e.g. the tracker may have dropped them
+            pass
+        self.profiles.append(profile)
+        return profile.summary()
+
+    def ranked(self):
+        return sorted(self.profiles, key=lambda p: p.wall, reverse=True)
+
+    def report(self, statements, render, limit=10):
+        ranked = self.ranked()
+        lines = ['profile: %d statements, %.3fs wall, %.3fs cpu, %d py4j calls, %d jobs; slowest statements:' % (
+            len(ranked), sum(p.wall for p in ranked), sum(p.cpu for p in ranked),
+            sum(p.calls for p in ranked), sum(len(p.jobs) for p in ranked))]
+        for profile in ranked[:limit]:
+            lines.append('  line %d: %s | %s' % (
+                statements[profile.index].start_line, profile.summary(), _text(_first_line(render(profile.index), 60))))
+        return '\n'.join(lines)
+
+    def write(self, path, statements, render):
+        """
+        Writes the profile as a tab separated file ranked by wall time, its columns can be
+        re-sorted by any other cost, e.g. sort -t$'\\t' -k4 -rn for CPU time.
+        """
+        directory = os.path.dirname(path)
+        try:
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with io.open(path, 'w', encoding='utf-8') as report:
+                report.write(_text('\t'.join(self.columns) + '\n'))
+                for p in self.ranked():
+                    row = '%d\t%d\t%.6f\t%.6f\t%d\t%s\t%s\t' % (
+                        p.index, statements[p.index].start_line, p.wall, p.cpu, p.calls, _ids(p.jobs), _ids(p.stages))
+                    report.write(_text(row) + _text(_first_line(render(p.index), 200)) + _text('\n'))
+            return path
+        except (IOError, OSError):
+            return None
+
+    def _group(self, index):
+        return '%s-%d' % (self.action_name, index)
+
+
+def _text(text):
+    # io files take unicode only, on python 2 that differs from str
+    return text.decode('utf-8') if isinstance(text, bytes) else text
+
+
+def _first_line(text, width):
+    line = text.split('\n')[0].replace('\t', ' ') if text else ''
+    return line if len(line) <= width else line[:width - 3] + '...'
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+#
+# Measures the per statement cost of producing the text reported for every executed
+# statement: codegen.to_source (the previous behaviour) against slicing the action
+# source (StatementRenderer) and against not rendering at all (report level other than
+# code). Usage: python render_benchmark.py [number of statements]
+
+import ast
+import sys
+import timeit
+
+import codegen
+from intp_utils import StatementRenderer, describe_statements
+
+TEMPLATES = [
+    "df_{0} = spark.read.format('parquet').load('/data/input/{0}')",
+    "df_{0} = df_{0}.filter(df_{0}['value'] > {0}).select('id', 'value')",
+    "counts_{0} = dict((k, v * 2) for k, v in zip(range({0}), range({0})) if k % 3 == 0)",
+    "def transform_{0}(row):\n    if row.value is None:\n        return 0\n    return row.value * {0}",
+    "for i in range(3):\n    total = sum([x ** 2 for x in range(i, {0})])",
+]
+
+
+def generate(statements):
+    return '\n'.join(TEMPLATES[i % len(TEMPLATES)].format(i) for i in range(statements)) + '\n'
+
+
+def per_statement(fn, nodes, repeat=5):
+    best = min(timeit.repeat(fn, number=1, repeat=repeat))
+    return best / len(nodes) * 1e6
+
+
+if __name__ == '__main__':
+    statements = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    source = generate(statements)
+    nodes = ast.parse(source).body
+    statements = describe_statements(nodes, len(source.splitlines()))
+
+    def with_codegen():
+        for node in nodes:
+            codegen.to_source(node)
+
+    def with_slicing():
+        renderer = StatementRenderer(source, statements, nodes)
+        for index in range(len(nodes)):
+            renderer.render(index)
+
+    def disabled():
+        renderer = StatementRenderer(source, statements, nodes, enabled=False)
+        for index in range(len(nodes)):
+            renderer.render(index)
+
+    print('statements: %d' % len(nodes))
+    try:
+        print('codegen.to_source: %8.2f us/statement' % per_statement(with_codegen, nodes))
+    except AttributeError:
+        # codegen only understands the python 2 ast
+        print('codegen.to_source:      n/a')
+    print('source slicing:    %8.2f us/statement' % per_statement(with_slicing, nodes))
+    print('not rendered:      %8.2f us/statement' % per_statement(disabled, nodes))
@@ -6,10 +6,23 @@
 # with open('/Users/roadan/pypath.txt', 'a') as the_file:
 #     the_file.write(user_paths)
 
+import time
+startup_began = time.time()
+
+# installed before any other import, the interpreter's own imports are timed along with
+# pyspark's and written to the executor log once the interpreter is ready
+from import_profiler import ImportProfiler
+import_profiler = ImportProfiler()
+import_profiler.install()
+
 import ast
-import codegen
 import os
 import sys
+import threading
+from intp_utils import ActionRun, BytecodeCache, CallCounter, DriverGuard, ExportSpec, ExportWriter, \
+    LazyJavaImports, PersistencePlan, ResultBuffer, StartupTimer, StatementProfiler, StatementRenderer, \
+    StatementTracer, bound_names, compile_action, concurrent_batches, memory_report, process_memory, \
+    release_namespace
 from runtime import AmaContext, Environment
 
 os.chdir(os.getcwd() + '/build/resources/test/')
@@ -24,6 +37,7 @@ from py4j.java_gateway import JavaGateway, GatewayClient, java_import
 from py4j.protocol import Py4JJavaError
 from pyspark.conf import SparkConf
 from pyspark.context import SparkContext
+# bound for the actions' use only, pyspark.context imports these modules already
 from pyspark.rdd import RDD
 from pyspark.files import SparkFiles
 from pyspark.storagelevel import StorageLevel
@@ -33,6 +47,10 @@ from pyspark.broadcast import Broadcast
 from pyspark.serializers import MarshalSerializer, PickleSerializer
 from pyspark.sql import SparkSession
 from pyspark.sql import Row
+from pyspark.sql import DataFrame
+
+startup = StartupTimer(startup_began)
+startup.phase('imports')
 
 client = GatewayClient(port=int(sys.argv[1]))
 gateway = JavaGateway(client, auto_convert=True)
@@ -43,51 +61,386 @@ java_import(gateway.jvm, "org.apache.spark.SparkEnv")
 java_import(gateway.jvm, "org.apache.spark.SparkConf")
 java_import(gateway.jvm, "org.apache.spark.api.java.*")
 java_import(gateway.jvm, "org.apache.spark.api.python.*")
-java_import(gateway.jvm, "org.apache.spark.mllib.api.python.*")
 java_import(gateway.jvm, "org.apache.spark.sql.*")
 java_import(gateway.jvm, "org.apache.spark.sql.hive.*")
 java_import(gateway.jvm, "scala.Tuple2")
 
+# JVM packages only some actions need are imported once their python package is imported
+LazyJavaImports(lambda package: java_import(gateway.jvm, package), {
+    'pyspark.mllib': ["org.apache.spark.mllib.api.python.*"]
+}).install()
+startup.phase('gateway')
+
 jconf = entry_point.getSparkConf()
 jsc = entry_point.getJavaSparkContext()
 
 job_id = entry_point.getJobId()
 javaEnv = entry_point.getEnv()
 working_dir = javaEnv.workingDir() or '/tmp/amaterasu'
-env = Environment(javaEnv.name(), javaEnv.master(), javaEnv.inputRootPath(), javaEnv.outputRootPath(), working_dir, javaEnv.configuration())
+env = Environment(javaEnv.name(), javaEnv.master(), javaEnv.inputRootPath(), javaEnv.outputRootPath(), working_dir, dict(entry_point.getConfiguration()), javaEnv.jobName())
 conf = SparkConf(_jvm=gateway.jvm, _jconf=jconf)
 
 sc = SparkContext(jsc=jsc, gateway=gateway, conf=conf)
 spark = SparkSession(sc, entry_point.getSparkSession())
 
 ama_context = AmaContext(sc, spark, job_id, env)
+startup.phase('spark context')
+
+# 'statement' compiles and executes every top level statement on its own, 'action'
+# compiles the whole action once and tracks statements using line events
+compile_mode = env.get_conf('pysparkCompileMode', 'statement')
+
+# results are sent to the JVM in batches, a batch size of 1 reports every result on its own
+result_batch_size = env.get_conf('pysparkResultBatchSize', 100)
+result_batch_window = env.get_conf('pysparkResultBatchWindow', 1.0)
+
+# the leader only shows statements when reporting at code level
+render_statements = entry_point.getReportLevel() in (None, 'code')
+
+# compiled actions are cached on disk so retries and reruns of an unchanged action
+# skip parsing and compiling, by default in the executor's sandbox
+bytecode_cache = None
+if env.get_conf('pysparkBytecodeCache', True):
+    bytecode_cache = BytecodeCache(env.get_conf('pysparkBytecodeCacheDir', os.path.join(os.getcwd(), 'bytecode-cache')))
+
+# exports are written concurrently by a bounded pool of background threads while the action
+# keeps running, 0 threads writes them synchronously. Setting a scheduler pool runs the
+# export jobs in that FAIR scheduler pool
+export_threads = env.get_conf('pysparkExportThreads', 4)
+export_scheduler_pool = env.get_conf('pysparkExportSchedulerPool', '')
+export_pool = None
+export_pool_lock = threading.Lock()
+
+# independent actions sent to this executor run concurrently on a pool of workers, each
+# in its own namespace and Spark job group. A single worker runs actions one at a time
+# in the interpreter's globals
+concurrent_actions = env.get_conf('pysparkConcurrentActions', 1)
+
+# every action runs in a namespace of its own which is released once the action completes,
+# only exported and pinned names are carried over to the following actions. Concurrent
+# actions always run in their own namespaces
+action_namespaces = env.get_conf('pysparkActionNamespaces', True) or concurrent_actions > 1
+
+# profiling records the cost and Spark jobs of every statement, running each statement in a
+# job group of its own. Profiles are attached to the statements' results, summarised in the
+# action's completion and written to a report per action in the executor's sandbox
+profile = env.get_conf('pysparkProfile', False)
+profile_dir = env.get_conf('pysparkProfileDir', os.path.join(os.getcwd(), 'profiles'))
+profile_top = env.get_conf('pysparkProfileTop', 10)
+call_counter = CallCounter(client) if profile else None
+
+# DataFrames that two or more of the following Spark jobs of an action depend on are persisted
+# once assigned and unpersisted after their last use, as found by a liveness analysis of the
+# action's statements. The decisions are reported in the action's completion
+auto_persist = env.get_conf('pysparkAutoPersist', False)
+auto_persist_level = getattr(StorageLevel, env.get_conf('pysparkAutoPersistLevel', 'MEMORY_AND_DISK'))
+
+# DataFrames assigned by a statement are checkpointed once their plans grow deeper than the
+# environment's checkpointPlanDepth, cutting the planning time of the DataFrames derived from
+# them. Checkpoints are reported in the action's completion with the planning time saved.
+# Only top level statements are covered, once they completed, so a DataFrame grown in a loop
+# is checkpointed after the loop; loops call ama_context.checkpoint_lineage themselves
+auto_checkpoint = env.get_conf('pysparkAutoCheckpoint', False)
+
+# independent statements of an action that run Spark jobs, as found by a def-use analysis of
+# its top level statements, run concurrently on a pool of threads, in a FAIR scheduler pool
+# when one is set. Results are still reported in source order. Only used when compiling
+# statement by statement and not profiling, as profiles are taken one statement at a time
+concurrent_statements = env.get_conf('pysparkConcurrentStatements', 1)
+statement_scheduler_pool = env.get_conf('pysparkStatementSchedulerPool', '')
+statement_pool = None
+statement_pool_lock = threading.Lock()
+
+
+# collecting a DataFrame estimated to take more than the driver budget, in bytes, fails fast
+# rather than running the interpreter out of memory, or with the spill mode streams the rows
+# and spills what does not fit to disk. 0 leaves driver calls unchecked
+driver_budget = env.get_conf('pysparkDriverBudget', 0)
+driver_guard = None
+if driver_budget > 0:
+    driver_guard = DriverGuard(driver_budget, env.get_conf('pysparkDriverBudgetMode', 'fail'), ama_context.estimate_bytes,
+                               env.get_conf('pysparkSpillDir', os.getcwd()))
+    driver_guard.install(DataFrame)
+
+
+def export_path(action_name, varName, spec):
+    if spec.append:
+        # appended to by every run of the job, so kept outside of the run's directory
+        return env.working_dir + "/incremental/" + env.job_name.replace('/', '_') + "/" + action_name + "/" + varName
+    return env.working_dir + "/" + job_id + "/" + action_name + "/" + varName
+
+
+def persist_code(statement, action_name, exports):
+    # if this statement is an assignment, we need to check if it needs to be persisted
+    varName = statement.target
+    if varName is not None and exports.containsKey(varName):
+        spec = ExportSpec(exports[varName])
+        return spec.describe(varName, export_path(action_name, varName, spec))
+    return ''
+
+
+def get_export_pool():
+    # created once the first export is written, most actions export nothing
+    global export_pool
+    with export_pool_lock:
+        if export_pool is None:
+            from multiprocessing.pool import ThreadPool
+            export_pool = ThreadPool(export_threads)
+    return export_pool
+
+
+def write_export(value, action_name, varName, export):
+    spec = ExportSpec(export)
+    if spec.local:
+        # numpy arrays and pandas frames are written by the python process itself
+        if spec.format == 'npy':
+            ama_context.put_array(varName, value, action_name)
+        else:
+            ama_context.put_pandas(varName, value, action_name, format=spec.format)
+        return
+    path = export_path(action_name, varName, spec)
+    entry_point.saveExport(value._jdf, action_name, varName, path, export, export_scheduler_pool)
+
+
+def persist(run, statement):
+    persistCode = ''
+    try:
+        persistCode = persist_code(statement, run.name, run.exports)
+        if persistCode:
+            varName = statement.target
+            ama_context.invalidate(run.name, varName)
+            run.writer.submit(persistCode, run.namespace[varName], run.name, varName, run.exports[varName])
+    except:
+        run.results.put('error', run.name, persistCode, str(sys.exc_info()[1]))
+
+
+def get_statement_pool():
+    global statement_pool
+    with statement_pool_lock:
+        if statement_pool is None:
+            from multiprocessing.pool import ThreadPool
+            statement_pool = ThreadPool(concurrent_statements)
+    return statement_pool
+
+
+def group_jobs(group):
+    tracker = sc.statusTracker()
+    jobs = []
+    for job in sorted(tracker.getJobIdsForGroup(group)):
+        info = tracker.getJobInfo(job)
+        jobs.append((job, sorted(info.stageIds) if info is not None else []))
+    return jobs
+
+
+def start_statement(run, index):
+    if run.profiler is not None:
+        run.profiler.start(index)
+
+
+def stop_statement(run, index):
+    return run.profiler.stop(index) if run.profiler is not None else ''
+
+
+def after_statement(run, index):
+    # the statement succeeded, failing to optimise what follows it only leaves a note
+    try:
+        if run.assigned is not None:
+            for name in run.assigned[index]:
+                if isinstance(run.namespace.get(name), DataFrame):
+                    run.namespace[name] = ama_context.checkpoint_lineage(run.namespace[name], name=name)
+        if run.persistence is not None:
+            run.persistence.after(index, run.namespace, lambda value: isinstance(value, DataFrame), auto_persist_level)
+    except:
+        run.completion.append('after line %d: %s' % (run.compiled.statements[index].start_line, sys.exc_info()[1]))
+
+
+def execute_statement(run, index):
+
+    if index in run.compiled.errors:
+        return 'error', run.compiled.errors[index]
+    try:
+        start_statement(run, index)
+        exec(run.compiled.codes[index], run.namespace)
+        return 'success', stop_statement(run, index)
+    except:
+        stop_statement(run, index)
+        return 'error', str(sys.exc_info()[1])
+
+
+def execute_concurrently(run, index):
+    # job groups and scheduler pools are thread local on the JVM side, as for concurrent
+    # actions this is best effort with py4j in Spark 2.x
+    ama_context.action_name = run.name
+    sc.setJobGroup(run.name, "amaterasu action " + run.name)
+    if statement_scheduler_pool:
+        sc.setLocalProperty('spark.scheduler.pool', statement_scheduler_pool)
+    return execute_statement(run, index)
+
+
+def execute_statements(run):
+
+    batches = run.batches or [[index] for index in range(len(run.compiled.statements))]
+    for batch in batches:
+        if len(batch) == 1:
+            results = [execute_statement(run, batch[0])]
+        else:
+            results = get_statement_pool().map(lambda index: execute_concurrently(run, index), batch)
+
+        for index, (status, message) in zip(batch, results):
+            run.results.put(status, run.name, run.renderer.render(index), message)
+            if status == 'success':
+                after_statement(run, index)
+                persist(run, run.compiled.statements[index])
+
+
+def execute_action(run):
+
+    def on_success(index):
+        run.results.put('success', run.name, run.renderer.render(index), stop_statement(run, index))
+        after_statement(run, index)
+        persist(run, run.compiled.statements[index])
+
+    def on_start(index):
+        start_statement(run, index)
+
+    tracer = StatementTracer([s.start_line for s in run.compiled.statements], on_success, on_start)
+    try:
+        tracer.run(run.compiled.codes[0], run.namespace)
+    except:
+        stop_statement(run, tracer.failed_index())
+        run.results.put('error', run.name, run.renderer.render(tracer.failed_index()), str(sys.exc_info()[1]))
+
+
+def report_profile(run):
+
+    # statements are always rendered for the report, whatever the leader's report level
+    render = StatementRenderer(run.source, run.compiled.statements, run.compiled.nodes).render
+    path = run.profiler.write(os.path.join(profile_dir, job_id, run.name + '.tsv'), run.compiled.statements, render)
+    report = run.profiler.report(run.compiled.statements, render, profile_top)
+    return report + ('\nprofile report: ' + path if path else '')
+
+
+def release_action(run, shared, memory_at_start):
+
+    memory_at_end = process_memory()
+    survivors = [name for name in list(run.exports) + list(ama_context.pinned) if name in run.namespace]
+    for name in survivors:
+        shared[name] = run.namespace[name]
+
+    # dataframes persisted by the dataframe cache outlive the action reading them
+    unpersisted = release_namespace(run.namespace, shared, ama_context.dataframes.dataframes())
+    run.namespace = None
+    return memory_report(memory_at_start, memory_at_end, process_memory(), len(survivors), unpersisted)
+
+
+def run_action(actionData, shared):
+
+    memory_at_start = process_memory() if action_namespaces else None
+    namespace = dict(shared) if action_namespaces else shared
+    results = ResultBuffer(entry_point.getResultQueue(actionData._2()), result_batch_size, result_batch_window)
+    run = ActionRun(actionData._2(), actionData._1(), actionData._3(), results, ExportWriter(write_export, get_export_pool if export_threads > 0 else None), namespace)
+    ama_context.action_name = run.name
+
+    try:
+        if bytecode_cache is not None:
+            run.compiled = bytecode_cache.compile(run.source, compile_mode == 'action')
+            run.completion.append(bytecode_cache.report())
+        else:
+            run.compiled = compile_action(run.source, compile_mode == 'action')
+    except:
+        run.results.put('error', run.name, '', str(sys.exc_info()[1]))
+
+    if run.compiled is not None:
+        run.renderer = StatementRenderer(run.source, run.compiled.statements, run.compiled.nodes, render_statements)
+        if profile:
+            run.profiler = StatementProfiler(run.name, call_counter.count, sc.setJobGroup, group_jobs)
+        # actions loaded from the bytecode cache come without their ast
+        nodes = run.compiled.nodes
+        if nodes is None and (auto_persist or auto_checkpoint or concurrent_statements > 1):
+            nodes = ast.parse(run.source).body
+        if auto_checkpoint:
+            run.assigned = [bound_names(node) for node in nodes]
+        if auto_persist:
+            run.persistence = PersistencePlan(nodes, run.exports)
+        if concurrent_statements > 1 and not run.compiled.whole and run.profiler is None:
+            run.batches = concurrent_batches(nodes, run.compiled.errors)
+            concurrent = [batch for batch in run.batches if len(batch) > 1]
+            if concurrent:
+                run.completion.append('concurrent statements: ' + '; '.join(
+                    'lines ' + ', '.join(str(run.compiled.statements[index].start_line) for index in batch)
+                    for batch in concurrent))
+        if run.compiled.whole:
+            execute_action(run)
+        else:
+            execute_statements(run)
+        if run.profiler is not None:
+            run.completion.append(report_profile(run))
+
+    # the action only completes once all of its exports are written
+    for persistCode, message in run.writer.wait():
+        run.results.put('error', run.name, persistCode, message)
+
+    if run.persistence is not None:
+        run.persistence.release()
+        if run.persistence.decisions:
+            run.completion.append(run.persistence.report())
+
+    checkpoints = ama_context.checkpoints.pop(run.name, None)
+    if checkpoints:
+        run.completion.append('\n'.join(checkpoints))
+
+    if ama_context.dataframes.hits or ama_context.dataframes.misses:
+        run.completion.append(ama_context.dataframes.report())
+
+    if ama_context.broadcasts.hits or ama_context.broadcasts.misses:
+        run.completion.append(ama_context.broadcasts.report())
+
+    if driver_guard is not None and (driver_guard.refused or driver_guard.spilled):
+        run.completion.append(driver_guard.report())
+
+    if action_namespaces:
+        run.completion.append(release_action(run, shared, memory_at_start))
+
+    run.results.put('completion', '', '', '\n'.join(run.completion))
+    run.results.close()
+
+
+def action_worker(shared):
+
+    while True:
+        actionData = queue.getNext()
+        if actionData is None:
+            return
+
+        # job groups are thread local on the JVM side, with py4j in Spark 2.x this is
+        # best effort as calls of a python thread are not pinned to a single JVM thread
+        sc.setJobGroup(actionData._2(), "amaterasu action " + actionData._2())
+        run_action(actionData, shared)
+
+
+startup.phase('configuration')
+import_profiler.uninstall()
+
+shared_namespace = dict(globals()) if action_namespaces else globals()
+
+# actions are only dispatched to the interpreter once it signalled it is ready, the
+# executor logs the reports rather than them going to the interpreter's stdout
+entry_point.ready(startup.report() + ', slowest imports: ' + import_profiler.slowest(), import_profiler.report())
+
+if concurrent_actions > 1:
+    workers = [threading.Thread(target=action_worker, args=(shared_namespace,)) for i in range(concurrent_actions)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+else:
+    while True:
+        actionData = queue.getNext()
+        # the execution queue returns null once it has been idle for an hour
+        if actionData is None:
+            break
+        run_action(actionData, shared_namespace)
 
-while True:
-    actionData = queue.getNext()
-    resultQueue = entry_point.getResultQueue(actionData._2())
-    actionSource = actionData._1()
-    tree = ast.parse(actionSource)
-    exports = actionData._3()
-
-    for node in tree.body:
-
-        wrapper = ast.Module(body=[node])
-        try:
-            co = compile(wrapper, "<ast>", 'exec')
-            exec (co)
-            resultQueue.put('success', actionData._2(), codegen.to_source(node), '')
-            #if this node is an assignment, we need to check if it needs to be persisted
-            try:
-                persistCode = ''
-                if(isinstance(node,ast.Assign)):
-                    varName = node.targets[0].id
-                    if(exports.containsKey(varName)):
-                        persistCode = varName + ".write.save(\"" + env.working_dir + "/" + job_id + "/" + actionData._2() + "/" + varName + "\", format=\"" + exports[varName] + "\", mode='overwrite')"
-                        persist = compile(persistCode, '<stdin>', 'exec')
-                        exec(persist)
-
-            except:
-                resultQueue.put('error', actionData._2(), persistCode, str(sys.exc_info()[1]))
-        except:
-            resultQueue.put('error', actionData._2(), codegen.to_source(node), str(sys.exc_info()[1]))
-    resultQueue.put('completion', '', '', '')
+# the execution queue went idle, no action is left to share the broadcasts with
+ama_context.broadcasts.release()
\ No newline at end of file
@@ -0,0 +1,109 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.spark
+
+import java.nio.file.Files
+
+import org.apache.amaterasu.executor.runtime.DataFrameCache
+import org.apache.commons.io.FileUtils
+import org.apache.spark.sql.SparkSession
+import org.apache.spark.storage.StorageLevel
+import org.scalatest.{BeforeAndAfterAll, DoNotDiscover, FlatSpec, Matchers}
+
+@DoNotDiscover
+class DataFrameCacheTests extends FlatSpec with Matchers with BeforeAndAfterAll {
+
+  var spark: SparkSession = _
+
+  private val dir = Files.createTempDirectory("ama-dataframes").toFile
+
+  override protected def afterAll(): Unit = {
+    FileUtils.deleteQuietly(dir)
+    super.afterAll()
+  }
+
+  "DataFrameCache" should "charge persisted DataFrames the size of their cached data" in {
+    val session = spark
+    import session.implicits._
+    val cache = new DataFrameCache(8, 1L << 30)
+    val numbers = cache.getOrLoad(("start", "numbers", "parquet"), Some(StorageLevel.MEMORY_ONLY)) {
+      (1 to 1000).toDF("n")
+    }
+
+    // nothing is cached until an action computes the DataFrame
+    cache.persistedBytes shouldBe 0
+    numbers.count()
+    cache.getOrLoad(("start", "numbers", "parquet"), None)(fail("cached DataFrames are not loaded again"))
+    cache.persistedBytes should be > 0L
+    numbers.unpersist()
+  }
+
+  it should "evict the persisted DataFrames once their cached data is over budget" in {
+    val session = spark
+    import session.implicits._
+    val cache = new DataFrameCache(8, 1)
+    val first = cache.getOrLoad(("start", "first", "parquet"), Some(StorageLevel.MEMORY_ONLY))((1 to 1000).toDF("n"))
+    first.count()
+    cache.getOrLoad(("start", "second", "parquet"), Some(StorageLevel.MEMORY_ONLY))((1 to 10).toDF("n"))
+
+    cache.evictions shouldBe 1
+    first.storageLevel shouldBe StorageLevel.NONE
+  }
+
+  it should "count the invalidations of every export" in {
+    val session = spark
+    import session.implicits._
+    val cache = new DataFrameCache(8, 1L << 30)
+    cache.getOrLoad(("start", "numbers", "parquet"), None)((1 to 10).toDF("n"))
+    cache.generation("start", "numbers") shouldBe 0
+
+    cache.invalidate("start", "numbers")
+    cache.invalidate("start", "numbers")
+    cache.generation("start", "numbers") shouldBe 2
+    cache.generation("start", "other") shouldBe 0
+    cache.getOrLoad(("start", "numbers", "parquet"), None)((1 to 5).toDF("n")).count() shouldBe 5
+  }
+
+  "DataFrameCache.estimatedSize" should "estimate DataFrames read from files" in {
+    val session = spark
+    import session.implicits._
+    val path = new java.io.File(dir, "numbers").toURI.toString
+    Seq(1, 2, 3).toDF("n").write.parquet(path)
+
+    DataFrameCache.estimatedSize(spark.read.parquet(path)) shouldBe defined
+  }
+
+  it should "not estimate joins, which spark sizes as the product of their inputs" in {
+    val session = spark
+    import session.implicits._
+    val left = Seq.tabulate(10)(i => (i, s"l$i")).toDF("k", "l")
+    val right = Seq.tabulate(10)(i => (i, s"r$i")).toDF("k", "r")
+
+    DataFrameCache.estimatedSize(left) shouldBe defined
+    DataFrameCache.estimatedSize(left.join(right, "k")) shouldBe None
+  }
+
+  it should "not estimate DataFrames created from RDDs, as python data is" in {
+    val session = spark
+    import session.implicits._
+    val df = spark.sparkContext.parallelize(1 to 10).toDF("n")
+
+    DataFrameCache.estimatedSize(df) shouldBe None
+    DataFrameCache.estimatedSize(df.where($"n" > 5)) shouldBe None
+  }
+
+}
@@ -0,0 +1,338 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.spark
+
+import java.nio.file.Files
+
+import org.apache.amaterasu.common.dataobjects.ExportSpec
+import org.apache.amaterasu.common.runtime.Environment
+import org.apache.amaterasu.executor.runtime._
+import org.apache.commons.io.FileUtils
+import org.apache.spark.sql.functions._
+import org.apache.spark.sql.{Column, DataFrame, SparkSession}
+import org.apache.spark.storage.StorageLevel
+import org.scalatest.{BeforeAndAfterAll, DoNotDiscover, FlatSpec, Matchers}
+
+import scala.concurrent.ExecutionContext.Implicits.global
+import scala.concurrent.duration._
+import scala.concurrent.{Await, Future}
+
+@DoNotDiscover
+class ExportsTests extends FlatSpec with Matchers with BeforeAndAfterAll {
+
+  var spark: SparkSession = _
+
+  private val dir = Files.createTempDirectory("ama-exports").toFile
+
+  override protected def afterAll(): Unit = {
+    FileUtils.deleteQuietly(dir)
+    super.afterAll()
+  }
+
+  private def env(conf: (String, String)*): Environment = {
+    val env = Environment()
+    env.workingDir = dir.toURI.toString
+    env.configuration = conf.toMap
+    env
+  }
+
+  /**
+    * Writes every DataFrame as its own files of one parquet export with a manifest with statistics
+    */
+  private def export(name: String, parts: DataFrame*): String = {
+    val exportPath = path(name)
+    parts.foreach(_.coalesce(1).write.mode("append").parquet(exportPath))
+    ExportManifest.write(spark, parts.head, exportPath, "parquet", env("exportManifestStats" -> "true"))
+    exportPath
+  }
+
+  private def path(name: String): String = new java.io.File(dir, name).toURI.toString
+
+  private def matching(path: String, condition: Column): DataFrame = {
+    ExportManifest.loadMatching(spark, path, "parquet", condition).get.where(condition)
+  }
+
+  "ExportManifest" should "describe an export without column statistics by default" in {
+    val session = spark
+    import session.implicits._
+    val df = (1 to 10).toDF("n").repartition(2)
+    val exportPath = path("described")
+    df.write.parquet(exportPath)
+    ExportManifest.write(spark, df, exportPath, "parquet", env())
+
+    val manifest = ExportManifest.read(spark, exportPath).get
+    // counting the rows would take another pass over the export
+    manifest.rowCount shouldBe -1
+    manifest.files should have size 2
+    manifest.files.foreach(_.rowCount shouldBe -1)
+    manifest.columns shouldBe empty
+    manifest.structType shouldBe df.schema
+    ExportManifest.load(spark, exportPath, "parquet").as[Int].collect().sorted shouldBe (1 to 10).toArray
+    // without statistics no file can be ruled out
+    ExportManifest.loadMatching(spark, exportPath, "parquet", col("n") > 5) shouldBe None
+  }
+
+  it should "not be written when the environment disables it" in {
+    val session = spark
+    import session.implicits._
+    val exportPath = path("undescribed")
+    val df = (1 to 10).toDF("n")
+    df.write.parquet(exportPath)
+    ExportManifest.write(spark, df, exportPath, "parquet", env("exportManifest" -> "false"))
+
+    ExportManifest.read(spark, exportPath) shouldBe None
+    ExportManifest.load(spark, exportPath, "parquet").count() shouldBe 10
+  }
+
+  it should "collect per file statistics when the environment asks for them" in {
+    val session = spark
+    import session.implicits._
+    val manifest = ExportManifest.read(spark, export("stats", Seq(1, 2, 3).toDF("n"), Seq(10, 11, 12).toDF("n"))).get
+
+    manifest.rowCount shouldBe 6
+    manifest.columns("n") shouldBe ColumnStats("1", "12", 0)
+    manifest.files.map(f => (f.columns("n").min, f.columns("n").max)).sorted shouldBe Seq(("1", "3"), ("10", "12"))
+  }
+
+  "ExportManifest.loadMatching" should "skip the files whose statistics rule out the condition" in {
+    val session = spark
+    import session.implicits._
+    val path = export("pruned", Seq(1, 2, 3).toDF("n"), Seq(10, 11, 12).toDF("n"))
+
+    val read = matching(path, col("n") > 5)
+    read.inputFiles should have size 1
+    read.as[Int].collect().sorted shouldBe Array(10, 11, 12)
+    matching(path, col("n") > 100).count() shouldBe 0
+  }
+
+  it should "keep the files when the literal's type differs from the column's" in {
+    val session = spark
+    import session.implicits._
+    val ints = export("ints", Seq(-5, -1, 0).toDF("n"), Seq(5, 6, 9).toDF("n"))
+    val strings = export("strings", Seq("10", "20").toDF("s"), Seq("1", "3").toDF("s"))
+
+    // as the literal's type, 5.5 and -0.5 would be read as the ints 5 and 0, and 5 as the string "5"
+    matching(ints, col("n") < 5.5).count() shouldBe 4
+    matching(ints, col("n") > -0.5).count() shouldBe 4
+    matching(strings, col("s") > 5).as[String].collect().sorted shouldBe Array("10", "20")
+  }
+
+  it should "compare narrower integral literals with wider columns" in {
+    val session = spark
+    import session.implicits._
+    val path = export("longs", Seq(1L, 2L).toDF("n"), Seq(10L, 20L).toDF("n"))
+
+    val read = matching(path, col("n") >= 10)
+    read.inputFiles should have size 1
+    read.count() shouldBe 2
+  }
+
+  "ExportSamples" should "write a sample of the export's rows" in {
+    val session = spark
+    import session.implicits._
+    val exportPath = path("sampled")
+    val df = (1 to 1000).toDF("n")
+    df.write.parquet(exportPath)
+    ExportSamples.write(spark, exportPath, df.schema, ExportSpec.parse("parquet; sample=10"))
+
+    val sample = ExportSamples.load(spark, exportPath).get.as[Int].collect()
+    sample should have size 10
+    sample.distinct should have size 10
+    // the sample is not read as part of the export
+    spark.read.parquet(exportPath).count() shouldBe 1000
+  }
+
+  it should "give every value of the sampleBy column a share of the sample" in {
+    val session = spark
+    import session.implicits._
+    val exportPath = path("stratified")
+    val df = ((1 to 990).map(n => ("common", n)) ++ (1 to 10).map(n => ("rare", n))).toDF("kind", "n")
+    df.write.parquet(exportPath)
+    ExportSamples.write(spark, exportPath, df.schema, ExportSpec.parse("parquet; sample=100; sampleBy=kind"))
+
+    val counts = ExportSamples.load(spark, exportPath).get.groupBy("kind").count().as[(String, Long)].collect().toMap
+    counts("common") should (be > 0L and be <= 99L)
+    counts("rare") shouldBe 1
+  }
+
+  it should "not write a sample for exports without a sample option" in {
+    val session = spark
+    import session.implicits._
+    val exportPath = path("unsampled")
+    val df = (1 to 10).toDF("n")
+    df.write.parquet(exportPath)
+    ExportSamples.write(spark, exportPath, df.schema, ExportSpec.parse("parquet"))
+
+    ExportSamples.exists(spark, exportPath) shouldBe false
+    ExportSamples.load(spark, exportPath) shouldBe None
+  }
+
+  "ExportViews" should "hand written exports over in memory" in {
+    val session = spark
+    import session.implicits._
+    val viewsEnv = env("exportViews" -> "true")
+    val df = (1 to 10).toDF("n")
+    df.write.parquet(path("viewed"))
+    ExportViews.register(spark, path("viewed"), "parquet", df.schema, "job", "start", "viewed", viewsEnv)
+
+    val view = ExportViews.lookup(spark, "job", "start", "viewed").get
+    view.as[Int].collect().sorted shouldBe (1 to 10).toArray
+    view.storageLevel shouldBe StorageLevel.MEMORY_AND_DISK
+    ExportViews.cachedBytes should be > 0L
+    ExportViews.lookup(spark, "job", "start", "other") shouldBe None
+  }
+
+  it should "release the cached export when it cannot be read back" in {
+    val session = spark
+    import session.implicits._
+    val viewsEnv = env("exportViews" -> "true")
+    val schema = (1 to 10).toDF("n").schema
+    val corrupt = new java.io.File(dir, "corrupt")
+    corrupt.mkdirs()
+    FileUtils.writeStringToFile(new java.io.File(corrupt, "part-00000.parquet"), "not parquet", "UTF-8")
+    val bytes = ExportViews.cachedBytes
+    ExportViews.register(spark, path("corrupt"), "parquet", schema, "job", "start", "corrupt", viewsEnv)
+
+    ExportViews.lookup(spark, "job", "start", "corrupt") shouldBe None
+    ExportViews.cachedBytes shouldBe bytes
+    spark.read.schema(schema).parquet(path("corrupt")).storageLevel shouldBe StorageLevel.NONE
+  }
+
+  it should "not hand exports over when disabled" in {
+    val session = spark
+    import session.implicits._
+    val df = (1 to 10).toDF("n")
+    df.write.parquet(path("disabled"))
+    ExportViews.register(spark, path("disabled"), "parquet", df.schema, "job", "start", "disabled", env())
+
+    ExportViews.lookup(spark, "job", "start", "disabled") shouldBe None
+    spark.read.schema(df.schema).parquet(path("disabled")).storageLevel shouldBe StorageLevel.NONE
+  }
+
+  it should "drop the least recently read views over the byte budget" in {
+    val session = spark
+    import session.implicits._
+    val viewsEnv = env("exportViews" -> "true", "exportViewBytes" -> "1")
+    val df = (1 to 10).toDF("n")
+    Seq("first", "second").foreach(name => {
+      df.write.parquet(path(s"budget_$name"))
+      ExportViews.register(spark, path(s"budget_$name"), "parquet", df.schema, "job", "budget", name, viewsEnv)
+    })
+
+    ExportViews.lookup(spark, "job", "budget", "first") shouldBe None
+    spark.read.schema(df.schema).parquet(path("budget_first")).storageLevel shouldBe StorageLevel.NONE
+    ExportViews.lookup(spark, "job", "budget", "second") shouldBe defined
+  }
+
+  "IncrementalExports" should "commit the partitions of every append" in {
+    val session = spark
+    import session.implicits._
+    val exportPath = IncrementalExports.path(dir.toURI.toString, "pipeline", "start", "events")
+    val spec = ExportSpec.parse("parquet; mode=append; partitionBy=day")
+    val first = IncrementalExports.append(spark, Seq((1, "a"), (1, "b")).toDF("day", "value"), exportPath, spec, "job1")
+    val second = IncrementalExports.append(spark, Seq((2, "c")).toDF("day", "value"), exportPath, spec, "job2")
+
+    first.marker shouldBe 1
+    second.marker shouldBe 2
+    second.partitions shouldBe Seq("day=2")
+    IncrementalExports.read(spark, exportPath).get.lastMarker shouldBe 2
+
+    val all = IncrementalExports.load(spark, exportPath, 0).get
+    all.columns shouldBe Array("value", "day")
+    all.as[(String, Int)].collect().sorted shouldBe Array(("a", 1), ("b", 1), ("c", 2))
+    IncrementalExports.load(spark, exportPath, first.marker).get.as[(String, Int)].collect() shouldBe Array(("c", 2))
+    IncrementalExports.load(spark, exportPath, second.marker).get.count() shouldBe 0
+  }
+
+  it should "not read files that were never committed" in {
+    val session = spark
+    import session.implicits._
+    val exportPath = IncrementalExports.path(dir.toURI.toString, "pipeline", "start", "uncommitted")
+    val spec = ExportSpec.parse("parquet; mode=append; partitionBy=day")
+    IncrementalExports.append(spark, Seq((1, "a")).toDF("day", "value"), exportPath, spec, "job1")
+    // as left behind by a run failing before its commit
+    Seq((1, "lost")).toDF("day", "value").write.mode("append").partitionBy("day").parquet(exportPath)
+
+    IncrementalExports.load(spark, exportPath, 0).get.as[(String, Int)].collect() shouldBe Array(("a", 1))
+  }
+
+  it should "refuse appends partitioned differently" in {
+    val session = spark
+    import session.implicits._
+    val exportPath = IncrementalExports.path(dir.toURI.toString, "pipeline", "start", "repartitioned")
+    val df = Seq((1, "a")).toDF("day", "value")
+    IncrementalExports.append(spark, df, exportPath, ExportSpec.parse("parquet; mode=append; partitionBy=day"), "job1")
+
+    an[IllegalArgumentException] should be thrownBy
+      IncrementalExports.append(spark, df, exportPath, ExportSpec.parse("parquet; mode=append"), "job2")
+  }
+
+  it should "commit the files of concurrent appends to their own commits" in {
+    val session = spark
+    import session.implicits._
+    val exportPath = IncrementalExports.path(dir.toURI.toString, "pipeline", "start", "concurrent")
+    val spec = ExportSpec.parse("parquet; mode=append; partitionBy=day")
+    val appends = (1 to 4).map(n => Future {
+      IncrementalExports.append(spark, (1 to 10).map(v => (n, v)).toDF("day", "value"), exportPath, spec, s"job$n")
+    })
+    val commits = Await.result(Future.sequence(appends), 5.minutes)
+
+    commits.map(_.marker).sorted shouldBe (1 to 4)
+    commits.flatMap(_.files).distinct should have size commits.map(_.files.size).sum
+    commits.foreach(commit => commit.partitions shouldBe Seq(s"day=${commit.jobId.stripPrefix("job")}"))
+    IncrementalExports.read(spark, exportPath).get.commits should have size 4
+    IncrementalExports.load(spark, exportPath, 0).get.count() shouldBe 40
+  }
+
+  it should "keep the exports of jobs sharing a working directory apart" in {
+    val session = spark
+    import session.implicits._
+    val spec = ExportSpec.parse("parquet; mode=append")
+    val first = IncrementalExports.path(dir.toURI.toString, "first", "start", "shared")
+    val second = IncrementalExports.path(dir.toURI.toString, "second", "start", "shared")
+    IncrementalExports.append(spark, Seq((1, "a")).toDF("day", "value"), first, spec, "job1")
+
+    first should not be second
+    IncrementalExports.append(spark, Seq((2, "b")).toDF("day", "value"), second, spec, "job2").marker shouldBe 1
+    IncrementalExports.load(spark, second, 0).get.as[(Int, String)].collect() shouldBe Array((2, "b"))
+  }
+
+  "LineageCheckpoints" should "checkpoint DataFrames whose plans grew too deep" in {
+    val session = spark
+    import session.implicits._
+    val base = (1 to 3).toDF("n")
+    val grown = (1 to 20).foldLeft(base)((df, _) => df.union(base))
+
+    LineageCheckpoints.depth(base) should be < 5
+    LineageCheckpoints.depth(grown) should be > 20
+
+    val checkpoint = LineageCheckpoints.checkpoint(grown, 10, path("checkpoints")).get
+    checkpoint.depth shouldBe LineageCheckpoints.depth(grown)
+    LineageCheckpoints.depth(checkpoint.dataFrame) should be < 5
+    checkpoint.dataFrame.count() shouldBe 63
+  }
+
+  it should "leave shallow plans as they are" in {
+    val session = spark
+    import session.implicits._
+    val df = (1 to 3).toDF("n").union((1 to 3).toDF("n"))
+
+    LineageCheckpoints.checkpoint(df, 10, path("checkpoints")) shouldBe None
+    LineageCheckpoints.checkpoint(df, 0, path("checkpoints")) shouldBe None
+  }
+
+}
@@ -0,0 +1,38 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.spark
+
+import org.apache.amaterasu.executor.execution.actions.runners.spark.PySpark.{ResultQueue, ResultType}
+import org.scalatest.{FlatSpec, Matchers}
+
+class ResultQueueTests extends FlatSpec with Matchers {
+
+  "ResultQueue.putAll" should "queue a batch of results in the order they were sent" in {
+
+    val queue = new ResultQueue
+    queue.putAll("""[["success", "start", "x = 1", ""], ["error", "start", "1/0", "division by zero"]]""")
+
+    val first = queue.getNext()
+    first.resultType should be(ResultType.success)
+    first.statement should be("x = 1")
+
+    val second = queue.getNext()
+    second.resultType should be(ResultType.error)
+    second.message should be("division by zero")
+  }
+
+}
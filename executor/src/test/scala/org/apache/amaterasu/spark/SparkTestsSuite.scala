@@ -36,7 +36,9 @@ import scala.collection.mutable.ListBuffer
   */
 class SparkTestsSuite extends Suites(
   new PySparkRunnerTests(),
-  new RunnersLoadingTests()) with BeforeAndAfterAll {
+  new RunnersLoadingTests(),
+  new ExportsTests(),
+  new DataFrameCacheTests()) with BeforeAndAfterAll {
 
   var env: Environment = _
   var factory: ProvidersFactory = _
@@ -70,6 +72,8 @@ class SparkTestsSuite extends Suites(
 
     this.nestedSuites.filter(s => s.isInstanceOf[RunnersLoadingTests]).foreach(s => s.asInstanceOf[RunnersLoadingTests].factory = factory)
     this.nestedSuites.filter(s => s.isInstanceOf[PySparkRunnerTests]).foreach(s => s.asInstanceOf[PySparkRunnerTests].factory = factory)
+    this.nestedSuites.filter(s => s.isInstanceOf[ExportsTests]).foreach(s => s.asInstanceOf[ExportsTests].spark = spark)
+    this.nestedSuites.filter(s => s.isInstanceOf[DataFrameCacheTests]).foreach(s => s.asInstanceOf[DataFrameCacheTests].spark = spark)
 
 
     super.beforeAll()
@@ -21,7 +21,7 @@ import java.util.concurrent.BlockingQueue
 import com.fasterxml.jackson.databind.{JsonNode, ObjectMapper}
 import com.fasterxml.jackson.databind.node.ArrayNode
 import com.fasterxml.jackson.dataformat.yaml.YAMLFactory
-import org.apache.amaterasu.common.dataobjects.ActionData
+import org.apache.amaterasu.common.dataobjects.{ActionData, ExportSpec}
 import org.apache.amaterasu.leader.execution.actions.{Action, ErrorAction, SequentialAction}
 import org.apache.amaterasu.leader.execution.JobManager
 import org.apache.curator.framework.CuratorFramework
@@ -144,7 +144,7 @@ object JobParser {
       action.path("file").asText,
       action.path("runner").path("group").asText,
       action.path("runner").path("type").asText,
-      action.path("exports").fields().asScala.toSeq.map(e=> (e.getKey, e.getValue.asText())).toMap,
+      action.path("exports").fields().asScala.toSeq.map(e=> (e.getKey, parseExport(e.getValue))).toMap,
       jobId,
       actionsQueue,
       client,
@@ -153,6 +153,34 @@ object JobParser {
 
   }
 
+  /**
+    * An export is either given as its format or as a map of its format, mode, partition
+    * columns and sample, e.g. {format: parquet, mode: append, partitionBy: [day], sample: 1000}.
+    * Both are passed on to the executors as a string
+    */
+  def parseExport(export: JsonNode): String = {
+
+    if (!export.isObject) {
+      export.asText()
+    } else {
+      val partitionBy = export.path("partitionBy") match {
+        case columns: ArrayNode => columns.asScala.map(_.asText).toSeq
+        case column if column.isMissingNode => Seq.empty
+        case column => column.asText.split(",").map(_.trim).toSeq
+      }
+      val spec = ExportSpec(
+        Option(export.get("format")).map(_.asText).getOrElse("parquet"),
+        Option(export.get("mode")).map(_.asText).getOrElse(ExportSpec.OverwriteMode),
+        partitionBy,
+        Option(export.get("sample")).map(_.asLong).getOrElse(0L),
+        Option(export.get("sampleBy")).map(_.asText)
+      ).toString
+      // fails the job's parsing for exports the executors would reject
+      ExportSpec.parse(spec).toString
+    }
+
+  }
+
   def parseErrorAction(
     action: JsonNode,
     jobId: String,
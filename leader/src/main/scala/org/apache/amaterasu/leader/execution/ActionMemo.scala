@@ -0,0 +1,127 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.leader.execution
+
+import java.io.File
+import java.nio.charset.StandardCharsets
+import java.nio.file.Files
+import java.security.MessageDigest
+
+import com.fasterxml.jackson.databind.ObjectMapper
+import com.fasterxml.jackson.module.scala.DefaultScalaModule
+import org.apache.amaterasu.common.dataobjects.ActionData
+import org.apache.amaterasu.common.logging.Logging
+import org.apache.curator.framework.CuratorFramework
+
+case class MemoEntry(fingerprint: String, jobId: String, completed: Long)
+
+/**
+  * Remembers the actions a job completed by a fingerprint of its definition: its source, the
+  * environment's configuration, its exports and the fingerprint of the action it follows.
+  * Entries are kept in ZooKeeper under /memo/<job name>.
+  * The fingerprint does not cover the data an action reads, so an action is only skipped
+  * when it completed earlier in the same run, i.e. before the job was resumed, where its
+  * exports are still in the run's directory. Actions of a new run always run, as they may
+  * read new data, and resumed actions whose definition changed since they completed run again
+  */
+class ActionMemo(client: CuratorFramework, jobName: String, jobId: String, env: String, repo: String = "repo") extends Logging {
+
+  private val mapper = new ObjectMapper()
+  mapper.registerModule(DefaultScalaModule)
+
+  private val root = s"/memo/${jobName.replace("/", "_")}"
+
+  // all the files of the environment take part, e.g. job.yml and spark.yml
+  private lazy val envFiles: Seq[File] = {
+    Option(new File(s"$repo/env/$env").listFiles()).map(_.toSeq).getOrElse(Seq.empty)
+      .filter(_.isFile)
+      .sortBy(_.getName)
+  }
+
+  def fingerprint(data: ActionData, upstream: String): String = {
+
+    val digest = MessageDigest.getInstance("SHA-256")
+
+    // every part is prefixed with its length so that parts cannot run into each other
+    def add(bytes: Array[Byte]): Unit = {
+      digest.update(s"${bytes.length}:".getBytes(StandardCharsets.UTF_8))
+      digest.update(bytes)
+    }
+    def addString(value: String): Unit = add(Option(value).getOrElse("").getBytes(StandardCharsets.UTF_8))
+
+    Seq(data.name, data.groupId, data.typeId, data.src).foreach(addString)
+    add(read(new File(s"$repo/src/${data.src}")))
+    envFiles.foreach(file => {
+      addString(file.getName)
+      add(read(file))
+    })
+    data.exports.toSeq.sorted.foreach { case (name, export) =>
+      addString(name)
+      addString(export)
+    }
+    addString(upstream)
+
+    digest.digest().map("%02x".format(_)).mkString
+  }
+
+  /**
+    * Why the action can be skipped, None if it has to run
+    */
+  def skipReason(data: ActionData, fingerprint: String): Option[String] = {
+
+    lookup(data.name) match {
+      case Some(entry) if entry.fingerprint == fingerprint && entry.jobId == jobId =>
+        Some("unchanged since it completed earlier in this run")
+      case _ =>
+        None
+    }
+  }
+
+  def record(data: ActionData, fingerprint: String): Unit = {
+
+    val path = node(data.name)
+    val entry = mapper.writeValueAsBytes(MemoEntry(fingerprint, jobId, System.currentTimeMillis()))
+    try {
+      if (client.checkExists().forPath(path) == null)
+        client.create().creatingParentsIfNeeded().forPath(path, entry)
+      else
+        client.setData().forPath(path, entry)
+    } catch {
+      case e: Exception => log.warn(s"failed to record the completion of action ${data.name}: ${e.getMessage}")
+    }
+  }
+
+  private def lookup(actionName: String): Option[MemoEntry] = {
+
+    val path = node(actionName)
+    try {
+      if (client.checkExists().forPath(path) == null) None
+      else Some(mapper.readValue(client.getData.forPath(path), classOf[MemoEntry]))
+    } catch {
+      case e: Exception =>
+        log.warn(s"failed to look up action $actionName: ${e.getMessage}")
+        None
+    }
+  }
+
+  private def node(actionName: String): String = s"$root/${actionName.replace("/", "_")}"
+
+  private def read(file: File): Array[Byte] = {
+    if (file.isFile) Files.readAllBytes(file.toPath) else Array.empty[Byte]
+  }
+
+}
@@ -72,7 +72,7 @@ object JobLoader extends Logging {
     maki
   }
 
-  def reloadJob(jobId: String, client: CuratorFramework, attempts: Int, actionsQueue: BlockingQueue[ActionData]) = {
+  def reloadJob(jobId: String, client: CuratorFramework, attempts: Int, actionsQueue: BlockingQueue[ActionData]): JobManager = {
 
     //val jobState = client.getChildren.forPath(s"/$jobId")
     val src = new String(client.getData.forPath(s"/$jobId/repo"))
@@ -80,11 +80,19 @@ object JobLoader extends Logging {
 
     val maki: String = loadMaki(src, branch)
 
-    val jobManager: JobManager = createJobManager(maki, jobId, client, attempts, actionsQueue)
-    restoreJobState(jobManager, jobId, client)
+    reloadJob(maki, jobId, client, attempts, actionsQueue)
+  }
+
+  /**
+    * Reloads a job that is resumed. The job is started by the scheduler, like new jobs, and
+    * start walks the flow from its head, where the memo skips the actions completed before
+    * the job was resumed. The actions left queued or started are not re-queued as well, as
+    * they would then run twice
+    */
+  def reloadJob(maki: String, jobId: String, client: CuratorFramework, attempts: Int, actionsQueue: BlockingQueue[ActionData]): JobManager = {
+
+    createJobManager(maki, jobId, client, attempts, actionsQueue)
 
-    jobManager.start()
-    jobManager
   }
 
   def restoreJobState(jobManager: JobManager, jobId: String, client: CuratorFramework): Unit = {
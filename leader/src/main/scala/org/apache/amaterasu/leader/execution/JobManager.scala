@@ -40,6 +40,10 @@ class JobManager extends Logging {
 
   val jobReport = new StringBuilder
 
+  // when set, actions that did not change since they last completed are skipped
+  var memo: ActionMemo = null
+  private val fingerprints = new TrieMap[String, String]
+
   // TODO: this is not private due to tests, fix this!!!
   val registeredActions = new TrieMap[String, Action]
   private var executionQueue: BlockingQueue[ActionData] = null
@@ -59,7 +63,37 @@ class JobManager extends Logging {
        """.stripMargin
     )
     jobReport.append("\n")
-    head.execute()
+    execute(head)
+
+  }
+
+  /**
+    * Executes the action unless the memo finds it unchanged since it last completed, in which
+    * case it is completed right away and the reason is added to the job report
+    */
+  private def execute(action: Action): Unit = {
+
+    val reason = if (memo == null) None else memo.skipReason(action.data, fingerprint(action))
+    reason match {
+      case Some(message) =>
+        log.info(s"skipping action ${action.data.name}: $message")
+        jobReport.append(s" *+-> action: ${action.actionId} (${action.data.name}) skipped, $message *\n")
+        complete(action)
+      case None =>
+        action.execute()
+    }
+
+  }
+
+  /**
+    * The action's fingerprint, which depends on the fingerprint of the action it follows
+    */
+  private def fingerprint(action: Action): String = {
+
+    fingerprints.getOrElseUpdate(action.actionId, {
+      val upstream = registeredActions.values.find(_.data.nextActionIds.contains(action.actionId))
+      memo.fingerprint(action.data, upstream.map(fingerprint).getOrElse(""))
+    })
 
   }
 
@@ -112,9 +146,16 @@ class JobManager extends Logging {
 
     jobReport.append(s" *+-> action: $actionId completed                                *\n")
     val action = registeredActions.get(actionId).get
+    if (memo != null)
+      memo.record(action.data, fingerprint(action))
+    complete(action)
+  }
+
+  private def complete(action: Action): Unit = {
+
     action.announceComplete
     action.data.nextActionIds.foreach(id =>
-      registeredActions.get(id).get.execute())
+      execute(registeredActions.get(id).get))
 
     // we don't need the error action anymore
     if (action.data.errorActionId != null)
@@ -30,7 +30,7 @@ import org.apache.amaterasu.common.execution.actions.{Notification, Notification
 import org.apache.amaterasu.common.execution.actions.NotificationLevel.NotificationLevel
 import org.apache.amaterasu.enums.ActionStatus
 import org.apache.amaterasu.enums.ActionStatus.ActionStatus
-import org.apache.amaterasu.leader.execution.{JobLoader, JobManager}
+import org.apache.amaterasu.leader.execution.{ActionMemo, JobLoader, JobManager}
 import org.apache.amaterasu.leader.utilities.{DataLoader, HttpServer}
 
 import org.apache.curator.framework.{CuratorFramework, CuratorFrameworkFactory}
@@ -160,7 +160,7 @@ class JobScheduler extends AmaterasuScheduler {
                 executor = slavesExecutors(slaveId)
               }
               else {
-                val execData = DataLoader.getExecutorData(env, config)
+                val execData = DataLoader.getExecutorData(env, config, reportLevel.toString, jobManager.name)
                 //TODO: wait for Eyal's refactoring to extract the containers params
 
                 val command = CommandInfo
@@ -198,6 +198,16 @@ class JobScheduler extends AmaterasuScheduler {
                     .setExecutable(false)
                     .setExtract(false)
                     .build())
+                  .addUris(URI.newBuilder()
+                    .setValue(s"http://${sys.env("AMA_NODE")}:${config.Webserver.Port}/intp_utils.py")
+                    .setExecutable(false)
+                    .setExtract(false)
+                    .build())
+                  .addUris(URI.newBuilder()
+                    .setValue(s"http://${sys.env("AMA_NODE")}:${config.Webserver.Port}/import_profiler.py")
+                    .setExecutable(false)
+                    .setExtract(false)
+                    .build())
                 executor = ExecutorInfo
                   .newBuilder
                   .setData(execData)
@@ -217,7 +227,7 @@ class JobScheduler extends AmaterasuScheduler {
               .setSlaveId(offer.getSlaveId)
               .setExecutor(executor)
 
-              .setData(DataLoader.getTaskData(actionData, env))
+              .setData(DataLoader.getTaskData(actionData, env, jobManager.name))
               .addResources(createScalarResource("cpus", config.Jobs.Tasks.cpus))
               .addResources(createScalarResource("mem", config.Jobs.Tasks.mem))
               .addResources(createScalarResource("disk", config.Jobs.repoSize))
@@ -265,7 +275,7 @@ class JobScheduler extends AmaterasuScheduler {
     }
     else {
 
-      JobLoader.reloadJob(
+      jobManager = JobLoader.reloadJob(
         frameworkId.getValue,
         client,
         config.Jobs.Tasks.attempts,
@@ -273,6 +283,10 @@ class JobScheduler extends AmaterasuScheduler {
       )
 
     }
+
+    if (config.Jobs.memoize)
+      jobManager.memo = new ActionMemo(client, jobManager.name, jobManager.jobId, env)
+
     jobManager.start()
 
   }
@@ -45,24 +45,26 @@ object DataLoader extends Logging {
   val ymlMapper = new ObjectMapper(new YAMLFactory())
   ymlMapper.registerModule(DefaultScalaModule)
 
-  def getTaskData(actionData: ActionData, env: String): ByteString = {
+  def getTaskData(actionData: ActionData, env: String, jobName: String): ByteString = {
 
     val srcFile = actionData.src
     val src = Source.fromFile(s"repo/src/$srcFile").mkString
     val envValue = Source.fromFile(s"repo/env/$env/job.yml").mkString
 
     val envData = ymlMapper.readValue(envValue, classOf[Environment])
+    envData.jobName = jobName
 
     val data = mapper.writeValueAsBytes(TaskData(src, envData, actionData.groupId, actionData.typeId, actionData.exports))
     ByteString.copyFrom(data)
 
   }
 
-  def getExecutorData(env: String, clusterConf: ClusterConfig): ByteString = {
+  def getExecutorData(env: String, clusterConf: ClusterConfig, reportLevel: String, jobName: String): ByteString = {
 
     // loading the job configuration
     val envValue = Source.fromFile(s"repo/env/$env/job.yml").mkString //TODO: change this to YAML
     val envData = ymlMapper.readValue(envValue, classOf[Environment])
+    envData.jobName = jobName
     // loading all additional configurations
     val files = new File(s"repo/env/$env/").listFiles().filter(_.isFile).filter(_.getName != "job.yml")
     val config = files.map(yamlToMap).toMap
@@ -77,7 +79,7 @@ object DataLoader extends Logging {
       val pyDepsValue = Source.fromFile(s"repo/deps/python.yml").mkString
       pyDepsData = ymlMapper.readValue(pyDepsValue, classOf[PythonDependencies])
     }
-    val data = mapper.writeValueAsBytes(ExecData(envData, depsData, pyDepsData, config))
+    val data = mapper.writeValueAsBytes(ExecData(envData, depsData, pyDepsData, config, reportLevel))
     ByteString.copyFrom(data)
   }
 
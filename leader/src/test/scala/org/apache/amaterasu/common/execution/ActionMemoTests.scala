@@ -0,0 +1,141 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+package org.apache.amaterasu.common.execution
+
+import java.util.concurrent.LinkedBlockingQueue
+
+import org.apache.amaterasu.common.dataobjects.ActionData
+import org.apache.amaterasu.enums.ActionStatus
+import org.apache.amaterasu.leader.dsl.JobParser
+import org.apache.amaterasu.leader.execution.{ActionMemo, JobLoader, JobManager}
+import org.apache.curator.framework.CuratorFrameworkFactory
+import org.apache.curator.retry.ExponentialBackoffRetry
+import org.apache.curator.test.TestingServer
+import org.apache.zookeeper.CreateMode
+import org.scalatest.{FlatSpec, Matchers}
+
+import scala.collection.JavaConverters._
+import scala.collection.mutable.ListBuffer
+import scala.io.Source
+
+class ActionMemoTests extends FlatSpec with Matchers {
+
+  val retryPolicy = new ExponentialBackoffRetry(1000, 3)
+  val server = new TestingServer(2185, true)
+  val client = CuratorFrameworkFactory.newClient(server.getConnectString, retryPolicy)
+  client.start()
+
+  val yaml = Source.fromURL(getClass.getResource("/simple-maki.yml")).mkString
+
+  def run(jobId: String, resumed: Boolean = false) = {
+    val queue = new LinkedBlockingQueue[ActionData]()
+    if (!resumed)
+      client.create().withMode(CreateMode.PERSISTENT).forPath(s"/$jobId")
+    val job = JobParser.parse(jobId, yaml, queue, client, 1)
+    job.memo = new ActionMemo(client, job.name, jobId, "test")
+    (job, queue)
+  }
+
+  def actionId(job: JobManager, name: String): String = {
+    job.registeredActions.values.find(_.data.name == name).get.actionId
+  }
+
+  val (first, firstQueue) = run("job_memo_1")
+
+  "an action" should "run when it never completed before" in {
+
+    first.start()
+    firstQueue.peek.name should be("start")
+
+  }
+
+  it should "be skipped when its job is resumed after it completed" in {
+
+    first.getNextActionData
+    first.actionComplete(actionId(first, "start"))
+
+    val (resumed, resumedQueue) = run("job_memo_1", resumed = true)
+    resumed.start()
+    resumedQueue.peek.name should be("step2")
+    resumed.registeredActions.get(actionId(resumed, "start")).get.data.status should be(ActionStatus.complete)
+    resumed.jobReport.toString should include("skipped, unchanged since it completed earlier in this run")
+
+  }
+
+  it should "run again in a new run of the job, which may read new data" in {
+
+    val (next, nextQueue) = run("job_memo_2")
+    next.start()
+    nextQueue.peek.name should be("start")
+
+  }
+
+  "a resumed job" should "queue the action it was interrupted in once" in {
+
+    val (job, _) = run("job_memo_5")
+    job.start()
+    job.getNextActionData
+    job.actionComplete(actionId(job, "start"))
+    // step2 started when the job was interrupted
+    job.getNextActionData.name should be("step2")
+
+    val queue = new LinkedBlockingQueue[ActionData]()
+    val resumed = JobLoader.reloadJob(yaml, "job_memo_5", client, 1, queue)
+    resumed.memo = new ActionMemo(client, resumed.name, "job_memo_5", "test")
+    resumed.start()
+
+    queue.asScala.map(_.name).toList should be(List("step2"))
+
+  }
+
+  it should "run again from its head without the memo, queueing every action once" in {
+
+    val (job, _) = run("job_memo_6")
+    job.start()
+    job.getNextActionData
+    job.actionComplete(actionId(job, "start"))
+
+    val queue = new LinkedBlockingQueue[ActionData]()
+    val resumed = JobLoader.reloadJob(yaml, "job_memo_6", client, 1, queue)
+    resumed.start()
+    queue.asScala.map(_.name).toList should be(List("start"))
+
+    resumed.getNextActionData
+    resumed.actionComplete(actionId(resumed, "start"))
+    queue.asScala.map(_.name).toList should be(List("step2"))
+
+  }
+
+  "an action with exports" should "only be skipped within the run it completed in" in {
+
+    val memo = new ActionMemo(client, "exports", "job_memo_3", "test")
+    val overwrite = ActionData(ActionStatus.pending, "overwrite", "a.py", "spark", "pyspark", "1", Map("df" -> "parquet"), new ListBuffer[String])
+    val append = overwrite.copy(name = "append", exports = Map("df" -> "parquet; mode=append"))
+    val none = overwrite.copy(name = "none", exports = Map.empty[String, String])
+
+    Seq(overwrite, append, none).foreach(data => memo.record(data, memo.fingerprint(data, "")))
+
+    val next = new ActionMemo(client, "exports", "job_memo_4", "test")
+    Seq(overwrite, append, none).foreach(data => next.skipReason(data, next.fingerprint(data, "")) should be(None))
+
+    val resumed = new ActionMemo(client, "exports", "job_memo_3", "test")
+    Seq(overwrite, append, none).foreach(data => resumed.skipReason(data, resumed.fingerprint(data, "")) should not be None)
+    resumed.skipReason(append, resumed.fingerprint(append, "upstream changed")) should be(None)
+
+  }
+
+}
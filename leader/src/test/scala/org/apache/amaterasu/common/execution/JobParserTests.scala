@@ -18,7 +18,9 @@ package org.apache.amaterasu.common.execution
 
 import java.util.concurrent.LinkedBlockingQueue
 
-import org.apache.amaterasu.common.dataobjects.ActionData
+import com.fasterxml.jackson.databind.ObjectMapper
+import com.fasterxml.jackson.dataformat.yaml.YAMLFactory
+import org.apache.amaterasu.common.dataobjects.{ActionData, ExportSpec}
 import org.apache.amaterasu.leader.dsl.JobParser
 import org.apache.curator.framework.CuratorFrameworkFactory
 import org.apache.curator.retry.ExponentialBackoffRetry
@@ -61,4 +63,33 @@ class JobParserTests extends FlatSpec with Matchers {
 
   }
 
-}
\ No newline at end of file
+  it should "pass exports given as a map on as export specs" in {
+
+    val exports = new ObjectMapper(new YAMLFactory()).readTree(
+      """df: parquet
+        |events:
+        |  mode: append
+        |  partitionBy: [day, hour]
+        |  sample: 1000
+        |""".stripMargin)
+
+    JobParser.parseExport(exports.path("df")) should be("parquet")
+    JobParser.parseExport(exports.path("events")) should be("parquet; mode=append; partitionBy=day,hour; sample=1000")
+    ExportSpec.parse(JobParser.parseExport(exports.path("events"))) should be(ExportSpec("parquet", "append", Seq("day", "hour"), 1000))
+
+  }
+
+  it should "reject partitioned exports that are not appended to" in {
+
+    val exports = new ObjectMapper(new YAMLFactory()).readTree(
+      """events:
+        |  partitionBy: day
+        |""".stripMargin)
+
+    an[IllegalArgumentException] should be thrownBy JobParser.parseExport(exports.path("events"))
+    an[IllegalArgumentException] should be thrownBy ExportSpec.parse("parquet; partitionBy=day")
+    ExportSpec.parse("parquet; partitionBy=day; mode=append").partitionBy should be(Seq("day"))
+
+  }
+
+}